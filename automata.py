@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+
+
+import array
+import collections
+import doctest
+import io
+import sys
+import xml.etree.ElementTree as ET
+
+import bitset
+
+
+# Version of the native simulation engines. This is recorded in the
+# "info" section of grading results, so bump it whenever a change to
+# one of the engines could change a verdict.
+ENGINE_VERSION = "4"
+
+
+# The number of words from which FiniteAutomaton.simulate_all uses the
+# bitset module by default; for fewer words, building its lookup table
+# costs more than it saves.
+BITSET_MIN_WORDS = 256
+
+# The number of state sets whose outgoing transitions a SubsetCache
+# remembers. Beyond that, the least recently used ones are forgotten.
+SUBSET_CACHE_SIZE = 4096
+
+
+class UnsupportedMachineError(Exception):
+    """Exception thrown when a JFLAP file describes a kind of machine that
+    the native engines cannot simulate (or cannot be read at all)."""
+    pass
+
+
+class InvalidMachineError(Exception):
+    """Exception thrown when a JFLAP file is well-formed but describes a
+    machine that cannot be simulated, e.g. one without an initial
+    state."""
+    pass
+
+
+class Outcome(object):
+    """The result of simulating a machine on a single input string.
+
+    This mirrors the fields of a test result in the output of
+    jflapgrader.run_tests: "accepted" is True, False or None (if the
+    simulation did not produce a verdict), "terminated" is whether the
+    simulation finished, "valid" is whether it finished with a
+    verdict, and "stdout" and "stderr" stand in for the output of
+    jflaplib-cli.
+    """
+    __slots__ = ("accepted", "terminated", "valid", "stdout", "stderr")
+
+    def __init__(self, accepted, terminated=True, valid=True,
+                 stdout=None, stderr=""):
+        self.accepted = accepted
+        self.terminated = terminated
+        self.valid = valid
+        if stdout is None:
+            stdout = "true" if accepted else "false" if valid else ""
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def __repr__(self):
+        return ("Outcome(accepted={!r}, terminated={!r}, valid={!r})"
+                .format(self.accepted, self.terminated, self.valid))
+
+
+def accepted(flag):
+    """Returns the Outcome for a simulation that finished with the given
+    verdict.
+
+    The same two objects are returned every time, so they must not be
+    modified.
+    """
+    return ACCEPTED if flag else REJECTED
+
+
+ACCEPTED = Outcome(True)
+REJECTED = Outcome(False)
+
+
+def invalid(message):
+    """Returns the Outcome for a simulation that finished without a
+    verdict, with message explaining why."""
+    return Outcome(None, terminated=True, valid=False, stderr=message)
+
+
+def did_not_terminate(message):
+    """Returns the Outcome for a simulation that was stopped before it
+    finished, with message explaining why."""
+    return Outcome(None, terminated=False, valid=None, stderr=message)
+
+
+def element_text(element, tag):
+    """Returns the text of the child of element with the given tag, or
+    the empty string if there is no such child or it is empty (which
+    is how JFLAP writes lambda).
+
+    >>> element = ET.fromstring("<t><read>ab</read><pop/></t>")
+    >>> element_text(element, "read"), element_text(element, "pop")
+    ('ab', '')
+    >>> element_text(element, "push")
+    ''
+    """
+    child = element.find(tag)
+    if child is None or child.text is None:
+        return ""
+    return child.text
+
+
+class FiniteAutomaton(object):
+    """A nondeterministic finite automaton with lambda transitions, in the
+    sense of JFLAP.
+
+    The states are given as a list of arbitrary hashable ids, of which
+    initial is one (or None) and finals is a collection. Each
+    transition is a tuple (from, read, to), where read may be the
+    empty string (a lambda transition) or, as JFLAP permits, a string
+    of several symbols. Multi-symbol transitions are expanded into
+    chains of anonymous intermediate states, so that the simulation
+    only ever has to deal with single symbols.
+
+    >>> fa = FiniteAutomaton(["a", "b"], "a", ["b"],
+    ...                      [("a", "0", "a"), ("a", "1", "b"),
+    ...                       ("b", "", "a"), ("b", "01", "b")])
+    >>> [word for word in ["", "1", "10", "101", "1001", "111"]
+    ...  if fa.accepts(word)]
+    ['1', '101', '1001', '111']
+    >>> import pickle
+    >>> copy = pickle.loads(pickle.dumps(fa))
+    >>> copy.accepts("1001"), copy.delta == fa.delta
+    (True, True)
+    """
+
+    # The automaton is defined by state_ids, size, initial, finals and
+    # arcs, which map each symbol (or "" for lambda) to an array of
+    # the transitions on it, as alternating source and target states.
+    # Everything else is computed from those by compile(), and only
+    # they are pickled, so sending an automaton to another process is
+    # cheap. Apart from subset_cache, it is never modified.
+    __slots__ = ("state_ids", "size", "initial", "finals", "arcs",
+                 "alphabet", "closures", "delta", "subset_cache")
+
+    def __init__(self, states, initial, finals, transitions):
+        self.state_ids = tuple(states)
+        index = {state: i for i, state in enumerate(self.state_ids)}
+        if initial is not None and initial not in index:
+            raise InvalidMachineError(
+                "initial state '{}' does not exist".format(initial))
+        arcs = {}
+        count = len(self.state_ids)
+        for source, read, target in transitions:
+            if source not in index or target not in index:
+                raise InvalidMachineError(
+                    "transition from '{}' to '{}' refers to a missing state"
+                    .format(source, target))
+            current = index[source]
+            # Expand "abc" into current -a-> new -b-> new -c-> target.
+            for position, symbol in enumerate(read):
+                if position == len(read) - 1:
+                    following = index[target]
+                else:
+                    following = count
+                    count += 1
+                pairs = arcs.get(symbol)
+                if pairs is None:
+                    pairs = arcs[symbol] = array.array("i")
+                pairs.append(current)
+                pairs.append(following)
+                current = following
+            if not read:
+                pairs = arcs.get("")
+                if pairs is None:
+                    pairs = arcs[""] = array.array("i")
+                pairs.append(current)
+                pairs.append(index[target])
+        self.size = count
+        self.initial = None if initial is None else index[initial]
+        self.finals = frozenset(index[state] for state in finals)
+        self.arcs = arcs
+        self.compile()
+
+    def compile(self):
+        """Computes alphabet, closures and delta from the definition of the
+        automaton."""
+        count = self.size
+        self.alphabet = frozenset(symbol for symbol in self.arcs if symbol)
+        # The lambda closure of every state, including the state itself.
+        # Most states have no lambda transitions, so their closure is
+        # just themselves.
+        self.closures = [frozenset((state,)) for state in range(count)]
+        pairs = self.arcs.get("")
+        if pairs:
+            lambdas = collections.defaultdict(list)
+            for source, target in zip(pairs[::2], pairs[1::2]):
+                lambdas[source].append(target)
+            for state in lambdas:
+                closure = {state}
+                stack = [state]
+                while stack:
+                    for target in lambdas.get(stack.pop(), ()):
+                        if target not in closure:
+                            closure.add(target)
+                            stack.append(target)
+                self.closures[state] = frozenset(closure)
+        # delta[state][symbol] is the set of states reachable by
+        # reading symbol from state and then following any number of
+        # lambda transitions, so that a simulation step is just a
+        # union of these sets.
+        closures = self.closures
+        self.delta = [{} for _ in range(count)]
+        for symbol, pairs in self.arcs.items():
+            if not symbol:
+                continue
+            moves = collections.defaultdict(list)
+            for source, target in zip(pairs[::2], pairs[1::2]):
+                moves[source].append(target)
+            for source, targets in moves.items():
+                if len(targets) == 1:
+                    reached = closures[targets[0]]
+                else:
+                    reached = frozenset().union(
+                        *[closures[target] for target in targets])
+                self.delta[source][symbol] = reached
+        self.subset_cache = None
+
+    def __getstate__(self):
+        # Two bytes per state are enough for most automata.
+        typecode = "H" if self.size <= 0xFFFF else "i"
+        arcs = {symbol: array.array(typecode, pairs)
+                for symbol, pairs in self.arcs.items()}
+        return self.state_ids, self.size, self.initial, self.finals, arcs
+
+    def __setstate__(self, state):
+        (self.state_ids, self.size, self.initial, self.finals,
+         self.arcs) = state
+        self.compile()
+
+    def start(self):
+        """Returns the set of states the automaton is in before reading any
+        input."""
+        if self.initial is None:
+            raise InvalidMachineError("automaton has no initial state")
+        return self.closures[self.initial]
+
+    def step(self, current, symbol):
+        """Returns the set of states reached from the set current by reading
+        symbol."""
+        reached = set()
+        delta = self.delta
+        for state in current:
+            targets = delta[state].get(symbol)
+            if targets:
+                reached |= targets
+        return frozenset(reached)
+
+    def accepts(self, word):
+        """Returns whether the automaton accepts word."""
+        current = self.start()
+        for symbol in word:
+            current = self.step(current, symbol)
+            if not current:
+                return False
+        return not self.finals.isdisjoint(current)
+
+    def simulate(self, word):
+        """Returns the Outcome of running the automaton on word."""
+        try:
+            return accepted(self.accepts(word))
+        except InvalidMachineError as e:
+            return invalid(str(e))
+
+    def accepts_all(self, words, subset_cache=None):
+        """Returns a list saying whether each of words is accepted,
+        simulating each distinct prefix of the words only once. If a
+        SubsetCache is given, steps are looked up in it.
+
+        Visiting the words in sorted order is a depth-first traversal of
+        the trie of the words, in which each word shares its longest
+        common prefix with the word before it. So we keep the stack of
+        state sets reached after each symbol of the previous word, pop
+        back to the common prefix, and only simulate the rest. The total
+        work is proportional to the size of the trie, rather than the
+        total length of the words.
+
+        >>> fa = FiniteAutomaton([0, 1], 0, [1], [(0, "0", 0), (0, "1", 1),
+        ...                                       (1, "1", 1)])
+        >>> words = ["011", "01", "", "0110", "10", "0111", "1"]
+        >>> fa.accepts_all(words) == [fa.accepts(word) for word in words]
+        True
+        """
+        finals = self.finals
+        step = self.step if subset_cache is None else subset_cache.step
+        verdicts = [False] * len(words)
+        stack = [self.start()]
+        previous = ""
+        for i in sorted(range(len(words)), key=words.__getitem__):
+            word = words[i]
+            # The stack is shorter than the previous word if its
+            # simulation died early, in which case there is no point
+            # going further.
+            limit = min(len(previous), len(word), len(stack) - 1)
+            common = 0
+            while common < limit and word[common] == previous[common]:
+                common += 1
+            del stack[common + 1:]
+            current = stack[-1]
+            for symbol in word[common:]:
+                if not current:
+                    break
+                current = step(current, symbol)
+                stack.append(current)
+            verdicts[i] = (len(stack) == len(word) + 1 and
+                           not finals.isdisjoint(current))
+            previous = word
+        return verdicts
+
+    def simulate_all(self, words, strategy="auto"):
+        """Returns a dictionary mapping each of words to its Outcome.
+
+        strategy is "word" to simulate each word separately, "trie" to
+        use accepts_all, "lazy" to use accepts_all with a SubsetCache,
+        "bitset" to simulate all of them at once with the bitset
+        module, or "auto" to use the bitset module when it is available
+        and there are enough words for it to pay off, and "lazy"
+        otherwise. The SubsetCache used by the "lazy" strategy is kept
+        in the subset_cache attribute, so that it can be reused and its
+        statistics inspected.
+        """
+        words = list(words)
+        if self.initial is None:
+            return {word: self.simulate(word) for word in words}
+        verdicts = None
+        if strategy == "bitset" or (strategy == "auto" and
+                                    bitset.available() and
+                                    len(words) >= BITSET_MIN_WORDS):
+            try:
+                verdicts = bitset.BitsetSimulator(self).accepts_all(words)
+            except bitset.TableTooLargeError:
+                pass
+        if verdicts is None:
+            if strategy == "word":
+                verdicts = [self.accepts(word) for word in words]
+            elif strategy == "trie":
+                verdicts = self.accepts_all(words)
+            else:
+                if self.subset_cache is None:
+                    self.subset_cache = SubsetCache(self)
+                verdicts = self.accepts_all(words, self.subset_cache)
+        return {word: accepted(verdict)
+                for word, verdict in zip(words, verdicts)}
+
+
+class SubsetCache(object):
+    """The subset construction of a FiniteAutomaton, built lazily.
+
+    Each set of states reached during simulation is a state of the
+    equivalent DFA, and the first time a transition out of it is taken,
+    the target set is computed with FiniteAutomaton.step and
+    remembered, so that every later occurrence of the same step (in
+    the same word or any other) is a pair of dictionary lookups. Only
+    the transitions out of the capacity most recently used sets are
+    kept, so an automaton with exponentially many reachable sets
+    doesn't exhaust memory.
+
+    >>> fa = FiniteAutomaton([0, 1, 2], 0, [2],
+    ...                      [(0, "0", 0), (0, "1", 0), (0, "1", 1),
+    ...                       (1, "0", 2), (1, "1", 2), (0, "", 1)])
+    >>> cache = SubsetCache(fa)
+    >>> words = ["10", "011", "100", "0", "1x", "111"]
+    >>> fa.accepts_all(words, cache) == [fa.accepts(word) for word in words]
+    True
+    >>> cache.statistics()
+    {'hits': 4, 'misses': 5, 'evictions': 0, 'hitRate': 0.444}
+    >>> small = SubsetCache(fa, capacity=1)
+    >>> small.step(small.step(fa.start(), "1"), "1") == fa.step(
+    ...     fa.step(fa.start(), "1"), "1")
+    True
+    >>> small.evictions
+    1
+    """
+
+    def __init__(self, fa, capacity=SUBSET_CACHE_SIZE):
+        self.fa = fa
+        self.capacity = capacity
+        # Maps each remembered set of states to a dictionary of the sets
+        # reached from it by each symbol, least recently used first.
+        self.rows = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def step(self, current, symbol):
+        """Returns the set of states reached from the set current by reading
+        symbol, as FiniteAutomaton.step does."""
+        rows = self.rows
+        row = rows.get(current)
+        if row is None:
+            row = rows[current] = {}
+            if len(rows) > self.capacity:
+                rows.popitem(last=False)
+                self.evictions += 1
+        else:
+            rows.move_to_end(current)
+        target = row.get(symbol)
+        if target is None:
+            self.misses += 1
+            target = row[symbol] = self.fa.step(current, symbol)
+        else:
+            self.hits += 1
+        return target
+
+    def statistics(self):
+        """Returns a dictionary of the numbers of steps that were and weren't
+        found in the cache, the number of sets evicted from it, and the
+        fraction of steps that were found, for the "info" section of
+        grading results."""
+        steps = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": round(self.hits / steps, 3) if steps else None,
+        }
+
+
+def automaton_element(structure):
+    """Returns the <automaton> element of the <structure> element of a
+    JFLAP file, or the <structure> element itself for files written by
+    old versions of JFLAP, which omit the <automaton> wrapper."""
+    automaton = structure.find("automaton")
+    if automaton is None:
+        return structure
+    return automaton
+
+
+def fa_state(element):
+    """Returns the id of the <state> element of a finite automaton, and
+    whether it is initial and final. Its layout and name are ignored."""
+    initial = final = False
+    for child in element:
+        if child.tag == "initial":
+            initial = True
+        elif child.tag == "final":
+            final = True
+    return element.get("id"), initial, final
+
+
+def fa_transition(element):
+    """Returns the (from, read, to) tuple of the <transition> element of
+    a finite automaton, as element_text would find them, but looking at
+    each child just once."""
+    source = read = target = None
+    for child in element:
+        tag = child.tag
+        if tag == "from":
+            if source is None:
+                source = child.text or ""
+        elif tag == "read":
+            if read is None:
+                read = child.text or ""
+        elif tag == "to":
+            if target is None:
+                target = child.text or ""
+    return source or "", read or "", target or ""
+
+
+def read_fa(structure):
+    """Builds a FiniteAutomaton from the <structure> element of a JFLAP
+    file."""
+    automaton = automaton_element(structure)
+    states = []
+    initial = None
+    finals = []
+    for state in automaton.iter("state"):
+        state_id, is_initial, is_final = fa_state(state)
+        states.append(state_id)
+        if is_initial:
+            initial = state_id
+        if is_final:
+            finals.append(state_id)
+    transitions = [fa_transition(transition)
+                   for transition in automaton.iter("transition")]
+    return FiniteAutomaton(states, initial, finals, transitions)
+
+
+# Readers for each value of <type> that the native engines support,
+# each taking the <structure> element of a JFLAP file and returning a
+# machine object. Engines defined in other modules add themselves
+# here.
+readers = {
+    "fa": read_fa,
+}
+
+
+def parse_jff(contents):
+    """Parses the contents of a JFLAP file and returns a machine object
+    with "simulate" and "simulate_all" methods.
+
+    Raises UnsupportedMachineError if the file cannot be read or
+    describes a kind of machine not in "readers", and
+    InvalidMachineError if the machine cannot be simulated.
+
+    >>> fa = parse_jff('''<?xml version="1.0"?><structure>
+    ...   <type>fa</type>
+    ...   <automaton>
+    ...     <state id="0" name="q0"><x>1.0</x><y>2.0</y><initial/></state>
+    ...     <state id="1" name="q1"><final/></state>
+    ...     <transition><from>0</from><to>1</to><read>a</read></transition>
+    ...     <transition><from>1</from><to>0</to><read/></transition>
+    ...   </automaton>
+    ... </structure>''')
+    >>> fa.simulate("aaa")
+    Outcome(accepted=True, terminated=True, valid=True)
+    >>> fa.simulate("ab")
+    Outcome(accepted=False, terminated=True, valid=True)
+    >>> parse_jff("<structure><type>mealy</type></structure>")
+    Traceback (most recent call last):
+        ...
+    UnsupportedMachineError: unsupported machine type 'mealy'
+    """
+    if isinstance(contents, str):
+        return stream_jff(io.StringIO(contents))
+    return stream_jff(io.BytesIO(contents))
+
+
+def read_structure(structure):
+    """Returns the machine object for the <structure> element of a JFLAP
+    file. See parse_jff."""
+    machine_type = element_text(structure, "type").strip()
+    if machine_type not in readers:
+        raise UnsupportedMachineError(
+            "unsupported machine type '{}'".format(machine_type))
+    return readers[machine_type](structure)
+
+
+def stream_jff(source):
+    """Parses a JFLAP file from the seekable file object source, as
+    parse_jff does.
+
+    The file is parsed incrementally. Finite automata are built as
+    their states and transitions are read, each of which is thrown
+    away once it has been read, along with its layout. So the whole
+    tree of the file, which takes several times as much memory as the
+    file itself and is mostly coordinates, is never built. Other
+    machines are read from the tree as usual.
+
+    >>> fa = stream_jff(io.BytesIO(b'''<?xml version="1.0"?><structure>
+    ...   <type>fa</type><automaton>
+    ...     <state id="0"><x>1.0</x><initial/><final/></state>
+    ...     <!--A comment.-->
+    ...     <transition><from>0</from><to>0</to><read>ab</read></transition>
+    ...   </automaton></structure>'''))
+    >>> fa.simulate("abab"), fa.size
+    (Outcome(accepted=True, terminated=True, valid=True), 2)
+    """
+    states = []
+    initial = None
+    finals = []
+    transitions = []
+    # Whether we know that this is a finite automaton, which we do if
+    # its type comes before its states, as it does in files written
+    # by JFLAP.
+    streaming = False
+    structure = None
+    try:
+        for event, element in ET.iterparse(source, events=("end",)):
+            tag = element.tag
+            if streaming:
+                if tag == "state":
+                    state_id, is_initial, is_final = fa_state(element)
+                    states.append(state_id)
+                    if is_initial:
+                        initial = state_id
+                    if is_final:
+                        finals.append(state_id)
+                    element.clear()
+                elif tag == "transition":
+                    transitions.append(fa_transition(element))
+                    element.clear()
+            elif tag == "type":
+                streaming = readers.get((element.text or "").strip()) is read_fa
+                if not streaming:
+                    break
+            elif tag in ("state", "transition"):
+                break
+            structure = element
+        else:
+            # Make sure the <type> we went by was that of the machine.
+            if (streaming and
+                    readers.get(element_text(structure, "type").strip())
+                    is read_fa):
+                return FiniteAutomaton(states, initial, finals, transitions)
+        # Otherwise, start again and parse the whole file into a tree,
+        # which the C parser does faster than we could stream it.
+        source.seek(0)
+        structure = ET.parse(source).getroot()
+    except ET.ParseError as e:
+        raise UnsupportedMachineError("malformed JFLAP file: {}".format(e))
+    return read_structure(structure)
+
+
+def load_jff(jflap_file):
+    """Reads and parses the JFLAP file at the given path. See parse_jff
+    and stream_jff.
+    """
+    try:
+        with open(jflap_file, "rb") as f:
+            return stream_jff(f)
+    except OSError as e:
+        raise UnsupportedMachineError("could not read JFLAP file: {}"
+                                      .format(e))
+
+
+# The engines for other kinds of machines live in their own modules,
+# which add their readers to "readers" when they are imported. They
+# are imported last because they use the definitions above.
+import grammar  # noqa: E402, F401
+import pda  # noqa: E402, F401
+import regex  # noqa: E402, F401
+import turing  # noqa: E402, F401
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
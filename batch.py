@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""Batch protocol for simulating many input strings with one process.
+
+A batch worker is a long-lived process that loads a single JFLAP file
+and then simulates input strings fed to it on stdin, one at a time,
+instead of being started once per input string. The protocol is:
+
+* After loading the file, the worker writes the line "ready".
+* For each input string, the client writes the length of the string
+  in bytes (UTF-8) on a line of its own, followed by the string and a
+  newline. Length-prefixing means input strings may contain newlines.
+* For each input string, the worker replies with a single line:
+  "true" if it was accepted, "false" if it was rejected, or "error"
+  followed by a message if it could not be simulated.
+* When the client closes stdin, the worker exits.
+
+Running this module with a JFLAP file as its argument starts a worker
+backed by the native engines of the automata module, in the same way
+that pythonGrader.py answers queries read from stdin.
+"""
+
+import doctest
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+import automata
+from command import BoundedBuffer, signal_group
+import scheduler
+
+
+# How long, in seconds, a worker may take to start up and load its
+# file before we give up on it. This is separate from the per-word
+# timeout, so that JVM startup is not charged to the first word.
+STARTUP_TIMEOUT = 60
+
+
+class BatchUnsupportedError(Exception):
+    """Exception thrown when a worker process does not speak the batch
+    protocol, e.g. because it exited without writing "ready"."""
+    pass
+
+
+class BatchWorker(object):
+    """Client for a single batch worker process.
+
+    command is the argument list used to start the worker. If a
+    simulation times out or the worker dies, the worker is killed and
+    transparently restarted for the next input string, so one looping
+    word does not take down the rest of the batch.
+
+    >>> worker = BatchWorker([sys.executable, __file__, example_jff])
+    >>> worker.simulate("00001101")
+    Outcome(accepted=True, terminated=True, valid=True)
+    >>> worker.simulate("line\\nbreak")
+    Outcome(accepted=False, terminated=True, valid=True)
+    >>> worker.close()
+    """
+
+    def __init__(self, command, startup_timeout=STARTUP_TIMEOUT):
+        self.command = command
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.lines = None
+        self.errors = None
+        self.errors_lock = threading.Lock()
+        # For each time the worker was started, how long starting the
+        # process took and how long it then took to become ready, in
+        # seconds.
+        self.starts = []
+
+    def start(self):
+        """Starts the worker process and waits until it is ready.
+
+        Raises BatchUnsupportedError if it never becomes ready.
+        """
+        start = time.perf_counter()
+        try:
+            self.process = subprocess.Popen(self.command,
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE,
+                                            env=os.environ,
+                                            start_new_session=(
+                                                os.name == "posix"))
+        except OSError as e:
+            raise BatchUnsupportedError("could not start worker: {}"
+                                        .format(e))
+        self.lines = queue.Queue()
+        self.errors = BoundedBuffer()
+        threading.Thread(target=pump_lines,
+                         args=(self.process.stdout, self.lines.put),
+                         daemon=True).start()
+        threading.Thread(target=pump_lines,
+                         args=(self.process.stderr, self.add_stderr),
+                         daemon=True).start()
+        spawned = time.perf_counter()
+        line = self.read_line(self.startup_timeout)
+        self.starts.append({"spawn": spawned - start,
+                            "startup": time.perf_counter() - spawned})
+        if line != "ready":
+            self.kill()
+            raise BatchUnsupportedError(
+                "worker did not start the batch protocol: {}"
+                .format(line if line is not None else self.take_stderr()))
+
+    def read_line(self, timeout):
+        """Returns the next line of output from the worker without its line
+        ending, or None if the worker exited or timeout expired."""
+        try:
+            line = self.lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if line is None:
+            return None
+        return line.rstrip("\r\n")
+
+    def add_stderr(self, line):
+        """Records a line the worker wrote to stderr (or None, at EOF)."""
+        if line is not None:
+            with self.errors_lock:
+                self.errors.write(line.encode("utf-8"))
+
+    def take_stderr(self):
+        """Returns whatever the worker has written to stderr since the last
+        call, truncated in the middle if it was too long to keep (see
+        command.BoundedBuffer)."""
+        with self.errors_lock:
+            errors, self.errors = self.errors, BoundedBuffer()
+        return errors.getvalue()
+
+    def simulate(self, word, timeout=None):
+        """Simulates the machine on word and returns the automata.Outcome.
+
+        If timeout (in seconds) expires, the worker is killed and the
+        outcome says the simulation did not terminate.
+        """
+        if self.process is None:
+            try:
+                self.start()
+            except BatchUnsupportedError as e:
+                return automata.invalid(str(e))
+        data = word.encode("utf-8")
+        try:
+            self.process.stdin.write(str(len(data)).encode("ascii") + b"\n"
+                                     + data + b"\n")
+            self.process.stdin.flush()
+        except OSError:
+            # The worker died; the reader will report the EOF below.
+            pass
+        line = self.read_line(timeout)
+        if line is None:
+            exited = self.process.poll() is not None
+            self.kill()
+            stderr = self.take_stderr()
+            if exited:
+                return automata.Outcome(None, terminated=True, valid=False,
+                                        stdout="", stderr=stderr)
+            return automata.Outcome(None, terminated=False, valid=None,
+                                    stdout="", stderr=stderr)
+        stderr = self.take_stderr()
+        if line in ("true", "false"):
+            return automata.Outcome(line == "true", stdout=line,
+                                    stderr=stderr)
+        return automata.Outcome(None, terminated=True, valid=False,
+                                stdout=line, stderr=stderr)
+
+    def kill(self):
+        """Kills the worker process, and anything it started, if it is
+        running."""
+        if self.process is not None:
+            signal_group(self.process, force=True)
+            self.process.wait()
+            self.process = None
+
+    def close(self):
+        """Asks the worker to exit and waits for it to do so."""
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=self.startup_timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            self.kill()
+
+
+def pump_lines(stream, callback):
+    """Calls callback with each line of the binary stream, decoded, and
+    then with None at EOF."""
+    for line in iter(stream.readline, b""):
+        callback(line.decode("utf-8", "replace"))
+    callback(None)
+
+
+def run_batch(command, words, timeout=None, jobs=1, on_outcome=None,
+              stats=None):
+    """Simulates each of words with batch workers started by command, and
+    returns a dictionary mapping each word to its automata.Outcome. If
+    on_outcome is given, it is called with each word and its outcome as
+    soon as it is known, possibly from several threads at once.
+
+    If stats is given, it should be a dictionary; the time in seconds
+    each word took is stored in stats["tests"], keyed by word, and the
+    BatchWorker.starts of each worker are added to the list
+    stats["workers"].
+
+    Up to jobs workers are run at once, each simulating an equal share
+    of the words; each worker holds a slot from the scheduler module
+    for as long as it runs. The other workers are only started once
+    the first one has started, so that a command which does not
+    support the protocol is only tried once.
+
+    Raises BatchUnsupportedError if a worker cannot be started, so
+    that the caller can fall back to running one process per word.
+    """
+    words = list(words)
+    jobs = max(1, min(jobs, len(words)))
+    chunks = [words[i::jobs] for i in range(jobs)]
+    # Set once the first worker has started, or failed to.
+    probed = threading.Event()
+    started = []
+
+    def on_start():
+        started.append(True)
+        probed.set()
+
+    def run_chunk(i):
+        if i == 0:
+            try:
+                return run_worker(command, chunks[0], timeout, on_outcome,
+                                  stats, on_start)
+            finally:
+                probed.set()
+        probed.wait()
+        if not started:
+            raise BatchUnsupportedError("the first batch worker could not"
+                                        " be started")
+        return run_worker(command, chunks[i], timeout, on_outcome, stats)
+
+    outcomes = {}
+    for chunk_outcomes in scheduler.map_concurrently(run_chunk, range(jobs),
+                                                     jobs):
+        outcomes.update(chunk_outcomes)
+    return {word: outcomes[word] for word in words}
+
+
+def run_worker(command, words, timeout=None, on_outcome=None, stats=None,
+               on_start=None):
+    """Simulates each of words with a single batch worker started by
+    command. See run_batch. If on_start is given, it is called once the
+    worker has started."""
+    outcomes = {}
+    with scheduler.subprocess_slot():
+        worker = BatchWorker(command)
+        try:
+            # Only the first start is allowed to fail outright; restarts
+            # after a timeout are handled by BatchWorker.simulate.
+            worker.start()
+            if on_start is not None:
+                on_start()
+            for word in words:
+                start = time.perf_counter()
+                outcomes[word] = worker.simulate(word, timeout)
+                if stats is not None:
+                    stats.setdefault("tests", {})[word] = (
+                        time.perf_counter() - start)
+                if on_outcome is not None:
+                    on_outcome(word, outcomes[word])
+        finally:
+            worker.close()
+            if stats is not None:
+                stats.setdefault("workers", []).extend(worker.starts)
+    return outcomes
+
+
+def serve(machine, stdin, stdout):
+    """Implements the worker side of the batch protocol for a machine
+    from the automata module, reading from the binary stream stdin
+    and writing to the binary stream stdout."""
+    stdout.write(b"ready\n")
+    stdout.flush()
+    while True:
+        header = stdin.readline()
+        if not header:
+            break
+        data = stdin.read(int(header))
+        stdin.readline()
+        outcome = machine.simulate(data.decode("utf-8"))
+        if outcome.valid:
+            reply = outcome.stdout
+        else:
+            reply = "error " + " ".join(outcome.stderr.split())
+        stdout.write(reply.encode("utf-8") + b"\n")
+        stdout.flush()
+
+
+example_jff = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "jff", "example.jff")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) == 1:
+        try:
+            machine = automata.load_jff(args[0])
+        except (automata.UnsupportedMachineError,
+                automata.InvalidMachineError) as e:
+            print("{}: {}".format(sys.argv[0], e), file=sys.stderr)
+            sys.exit(1)
+        serve(machine, sys.stdin.buffer, sys.stdout.buffer)
+    elif args:
+        print("usage: {} <jflap-file>".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+    else:
+        doctest.testmod()
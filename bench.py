@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+
+import automata
+import batch
+import bitset
+import datetime
+import jflapgrader
+import json
+import os
+import pickle
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wordgen
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+NAME = sys.argv[0]
+
+USAGE = """\
+usage: {}
+         simulation [<jflap-file> [<max-length>]]
+         parse [<test-cases>]
+         load [<states>]
+         suite [--quick] [--seed <seed>] [--output <json-file>]
+         words [<max-length>]\
+""".format(NAME)
+
+# The sizes of the synthetic machines and test sets generated by the
+# suite command, normally and with --quick.
+SUITE_SIZES = {
+    "states": 60,
+    "words": 5000,
+    "max_length": 40,
+    "exhaustive_length": 14,
+    "submissions": 16,
+}
+QUICK_SIZES = {
+    "states": 20,
+    "words": 500,
+    "max_length": 20,
+    "exhaustive_length": 9,
+    "submissions": 4,
+}
+
+# The concurrency levels at which the suite command measures the batch
+# worker and grade.py.
+SUITE_JOBS = [1, 2, 4]
+
+def print_stderr(msg, *args, **kwargs):
+    print(msg, *args, **kwargs, file=sys.stderr)
+
+def usage_and_exit(*args, **kwargs):
+    print_stderr(USAGE, *args, **kwargs)
+    sys.exit(1)
+
+def best_time(fn, repeat=3):
+    """Return the shortest of repeat wall-clock timings of fn(), in
+    seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def report(label, count, seconds, unit="words", file=None):
+    rate = count / seconds if seconds else float("inf")
+    print("{:<24} {:>10} {} {:>10.3f} s {:>14,.0f} {}/s"
+          .format(label, count, unit, seconds, rate, unit), file=file)
+
+def bench_simulation(jflap_file, max_length):
+    """Time each finite automaton simulation strategy on every bitstring
+    of at most max_length symbols."""
+    fa = automata.load_jff(jflap_file)
+    words = list(jflapgrader.all_bitstrings(max_length))
+    print("{}: {} states, all bitstrings of length <= {}"
+          .format(jflap_file, fa.size, max_length))
+    strategies = ["word", "trie", "lazy"]
+    if bitset.available():
+        strategies.append("bitset")
+    else:
+        print("(NumPy is not installed, skipping the bitset strategy)")
+    for strategy in strategies:
+        def simulate():
+            fa.subset_cache = None
+            fa.simulate_all(words, strategy)
+        seconds = best_time(simulate)
+        report(strategy, len(words), seconds)
+
+def slicing_bitstrings(length):
+    """The original implementation of jflapgrader.all_bitstrings, which
+    builds each bitstring from the last by slicing, as a baseline."""
+    if length >= 0:
+        yield ""
+    current = "0"
+    while len(current) <= length:
+        yield current
+        for j in range(len(current)):
+            i = len(current) - 1 - j
+            if current[i] == "0":
+                current = current[:i] + "1" + "0" * j
+                break
+            elif i == 0:
+                current = "0" * (len(current) + 1)
+
+def consume(words):
+    """Exhaust the iterable words without keeping them, and return how
+    many there were."""
+    count = 0
+    for _ in words:
+        count += 1
+    return count
+
+def bench_words(max_length):
+    """Time generating the words up to max_length symbols long with the
+    original all_bitstrings and with each of the generators in the
+    wordgen module, streaming rather than storing them."""
+    count = wordgen.count_words("01", max_length)
+    print("{:,} bitstrings of length <= {}".format(count, max_length))
+    cases = [
+        ("slicing all_bitstrings", lambda: slicing_bitstrings(max_length)),
+        ("all_words", lambda: wordgen.all_words("01", max_length)),
+        ("all_words abcd", lambda: wordgen.all_words(
+            "abcd", length=max_length // 2)),
+        ("random_words", lambda: wordgen.random_words(
+            count, "01", max_length, seed=0)),
+        ("sample_words", lambda: wordgen.sample_words(
+            count // 2, "01", max_length, seed=0)),
+        ("stratified_words", lambda: wordgen.stratified_words(
+            count // (2 * max_length + 2), "01", max_length, seed=0)),
+    ]
+    for label, generate in cases:
+        counts = []
+        seconds = best_time(lambda: counts.append(consume(generate())))
+        report(label, counts[-1], seconds)
+
+def large_test_file(path, cases, old_style):
+    """Write a test file with cases explicit test cases (some of them
+    repeated) to path, in the old style (a word per line, followed by
+    "reject" if it should be rejected) or the new style (with quoting
+    and a variety of result specifiers)."""
+    words = wordgen.random_words(cases, "01", 24, min_length=1, seed=0)
+    with open(path, "w") as f:
+        for i, word in enumerate(words):
+            accept = word.count("1") % 3 == 0
+            if old_style:
+                f.write(word + ("\n" if accept else " reject\n"))
+            else:
+                if i % 3 == 0:
+                    word = '"{}"'.format(word)
+                results = ("accept", "ok") if accept else ("reject", "no")
+                f.write("{} -> {}\n".format(word, results[i % 2]))
+
+def peak_memory(fn):
+    """Return the peak memory allocated while running fn(), in bytes."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_parse(cases):
+    """Time parsing large test files of each style, from a string with
+    parse_test_file_contents and streamed from the file with
+    parse_test_file, and measure the peak memory each one needs."""
+    directory = tempfile.mkdtemp(prefix="jflap-bench-")
+    try:
+        for style in ("new", "old"):
+            path = os.path.join(directory, style + ".in")
+            large_test_file(path, cases, style == "old")
+            print("{:,} test cases in the {} style ({:,} bytes)".format(
+                cases, style, os.path.getsize(path)))
+
+            def from_contents():
+                with open(path) as f:
+                    return jflapgrader.parse_test_file_contents(f.read())
+
+            def from_file():
+                with open(path) as f:
+                    return jflapgrader.parse_test_file(f)
+
+            for label, parse in [("parse_test_file_contents", from_contents),
+                                 ("parse_test_file", from_file)]:
+                counts = []
+                seconds = best_time(lambda: counts.append(len(parse())))
+                report(label, counts[-1], seconds)
+                print("{:<24} {:>10,.1f} MiB peak".format(
+                    "", peak_memory(parse) / (1 << 20)))
+    finally:
+        shutil.rmtree(directory)
+
+def bench_load(states):
+    """Time loading very large random machines with load_jff, against
+    parsing the whole file into a tree first, measure the peak memory
+    each one needs, and time pickling the machines, as when sending
+    them to another process."""
+    rng = random.Random(0)
+    machines = [("nfa", random_nfa(rng, states)), ("tm", random_tm(rng, states))]
+    directory = tempfile.mkdtemp(prefix="jflap-bench-")
+    try:
+        for name, contents in machines:
+            path = os.path.join(directory, name + ".jff")
+            with open(path, "w") as f:
+                f.write(contents)
+            print("{} with {:,} states ({:,} bytes)".format(
+                name, states, os.path.getsize(path)))
+
+            def from_tree():
+                return automata.read_structure(ET.parse(path).getroot())
+
+            for label, load in [("tree", from_tree),
+                                ("load_jff", lambda: automata.load_jff(path))]:
+                seconds = best_time(load)
+                report(label, states, seconds, "states")
+                print("{:<24} {:>10,.1f} MiB peak".format(
+                    "", peak_memory(load) / (1 << 20)))
+            machine = automata.load_jff(path)
+            data = pickle.dumps(machine)
+            report("pickle.dumps", len(data), best_time(
+                lambda: pickle.dumps(machine)), "bytes")
+            report("pickle.loads", len(data), best_time(
+                lambda: pickle.loads(data)), "bytes")
+    finally:
+        shutil.rmtree(directory)
+
+def jff_contents(machine_type, states, initial, finals, transitions):
+    """Return the contents of a JFLAP file for a machine with the given
+    type ("fa" or "turing"), states (a list of ids), initial state and
+    final states. Each transition is a dictionary mapping the tags of
+    its elements (from, to, read, ...) to their text."""
+    lines = ['<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
+             "<structure>",
+             "\t<type>{}</type>".format(machine_type),
+             "\t<automaton>"]
+    for i, state in enumerate(states):
+        lines.append('\t\t<state id="{0}" name="q{0}">'.format(state))
+        lines.append("\t\t\t<x>{}.0</x>".format(80 * (i % 10)))
+        lines.append("\t\t\t<y>{}.0</y>".format(80 * (i // 10)))
+        if state == initial:
+            lines.append("\t\t\t<initial/>")
+        if state in finals:
+            lines.append("\t\t\t<final/>")
+        lines.append("\t\t</state>")
+    for transition in transitions:
+        lines.append("\t\t<transition>")
+        for tag, text in transition.items():
+            if text:
+                lines.append("\t\t\t<{0}>{1}</{0}>".format(tag, escape(text)))
+            else:
+                lines.append("\t\t\t<{}/>".format(tag))
+        lines.append("\t\t</transition>")
+    lines += ["\t</automaton>", "</structure>", ""]
+    return "\n".join(lines)
+
+def random_dfa(rng, states, alphabet="01"):
+    """Return the contents of a JFLAP file for a random complete DFA."""
+    transitions = [{"from": str(state), "to": str(rng.randrange(states)),
+                    "read": symbol}
+                   for state in range(states) for symbol in alphabet]
+    finals = {str(state) for state in range(states) if rng.random() < 0.3}
+    return jff_contents("fa", [str(state) for state in range(states)], "0",
+                        finals, transitions)
+
+def random_nfa(rng, states, alphabet="01", density=2, lambdas=0.2):
+    """Return the contents of a JFLAP file for a random NFA with about
+    density transitions per state and symbol, and lambda transitions
+    from about the given fraction of states."""
+    transitions = []
+    for state in range(states):
+        for symbol in alphabet:
+            for _ in range(rng.randint(0, 2 * density)):
+                transitions.append({"from": str(state),
+                                    "to": str(rng.randrange(states)),
+                                    "read": symbol})
+        if rng.random() < lambdas:
+            transitions.append({"from": str(state),
+                                "to": str(rng.randrange(states)),
+                                "read": ""})
+    finals = {str(state) for state in range(states) if rng.random() < 0.3}
+    return jff_contents("fa", [str(state) for state in range(states)], "0",
+                        finals, transitions)
+
+def random_tm(rng, states, alphabet="01"):
+    """Return the contents of a JFLAP file for a random Turing machine.
+    It scans its input from left to right, rewriting it, and then
+    sweeps back to the start, so that it always halts."""
+    transitions = []
+    for state in range(states):
+        for symbol in alphabet:
+            transitions.append({"from": str(state),
+                                "to": str(rng.randrange(states)),
+                                "read": symbol,
+                                "write": rng.choice(alphabet),
+                                "move": "R"})
+        if rng.random() < 0.5:
+            transitions.append({"from": str(state), "to": "rewind",
+                                "read": "", "write": "", "move": "L"})
+    for symbol in alphabet:
+        transitions.append({"from": "rewind", "to": "rewind",
+                            "read": symbol, "write": symbol, "move": "L"})
+    transitions.append({"from": "rewind", "to": "halt",
+                        "read": "", "write": "", "move": "R"})
+    ids = [str(state) for state in range(states)] + ["rewind", "halt"]
+    return jff_contents("turing", ids, "0", {"halt"}, transitions)
+
+def random_words(rng, count, max_length, alphabet="01"):
+    """Return count distinct random words of at most max_length
+    symbols (fewer if there aren't that many)."""
+    words = set()
+    limit = sum(len(alphabet) ** n for n in range(max_length + 1))
+    while len(words) < min(count, limit):
+        words.add("".join(rng.choice(alphabet)
+                          for _ in range(rng.randint(0, max_length))))
+    return sorted(words, key=jflapgrader.len_lex)
+
+def explicit_test_file(machine, words):
+    """Return the contents of a test file listing each of words with the
+    result machine gives it, so that the machine passes."""
+    outcomes = machine.simulate_all(words)
+    return "".join('"{}" {}\n'.format(
+        word, "accept" if outcomes[word].accepted else "reject")
+        for word in words)
+
+def generated_test_file(max_length):
+    """Return the contents of a test file defining words() and check(),
+    for every bitstring of at most max_length symbols."""
+    return ("def words():\n"
+            "    return all_bitstrings({})\n"
+            "def check(word):\n"
+            "    return word.count('1') % 3 == 0\n").format(max_length)
+
+def generate_suite(directory, sizes, seed):
+    """Write synthetic machines and test files into directory, and return
+    a pair of dictionaries mapping names to the paths of the machines
+    and of the test files."""
+    rng = random.Random(seed)
+    machines = {
+        "dfa": random_dfa(rng, sizes["states"]),
+        "nfa": random_nfa(rng, sizes["states"]),
+        "tm": random_tm(rng, sizes["states"]),
+    }
+    machine_files = {}
+    for name, contents in machines.items():
+        machine_files[name] = os.path.join(directory, name + ".jff")
+        with open(machine_files[name], "w") as f:
+            f.write(contents)
+    words = random_words(rng, sizes["words"], sizes["max_length"])
+    test_contents = {
+        "generated": generated_test_file(sizes["exhaustive_length"]),
+    }
+    for name in machines:
+        test_contents["explicit-" + name] = explicit_test_file(
+            automata.parse_jff(machines[name]), words)
+    test_files = {}
+    for name, contents in test_contents.items():
+        test_files[name] = os.path.join(directory, name + ".in")
+        with open(test_files[name], "w") as f:
+            f.write(contents)
+    return machine_files, test_files
+
+def bench_suite(sizes, seed, output_file):
+    """Generate synthetic machines and test files, time parsing test
+    files, run_tests with the native engines, run_batch with batch
+    workers and grade.py at several levels of concurrency, and write
+    the results as JSON to output_file (or stdout if it is None). The
+    timings are also printed to stderr as they are taken, so that
+    stdout only holds the JSON."""
+    results = []
+
+    def record(benchmark, case, count, unit, seconds, **details):
+        label = " ".join([benchmark, case] + ["{}={}".format(*item)
+                                              for item in details.items()])
+        report("{:<48}".format(label), count, seconds, unit,
+               file=sys.stderr)
+        results.append(dict({
+            "benchmark": benchmark,
+            "case": case,
+            "count": count,
+            "unit": unit,
+            "seconds": seconds,
+            "rate": count / seconds if seconds else None,
+        }, **details))
+
+    directory = tempfile.mkdtemp(prefix="jflap-bench-")
+    try:
+        machine_files, test_files = generate_suite(directory, sizes, seed)
+        tests = {}
+        for name, test_file in test_files.items():
+            with open(test_file) as f:
+                contents = f.read()
+            tests[name] = jflapgrader.parse_test_file_contents(contents)
+            seconds = best_time(
+                lambda: jflapgrader.parse_test_file_contents(contents))
+            record("parse", name, len(tests[name]), "words", seconds)
+        cases = [(name, test_files[test_name], tests[test_name])
+                 for name in machine_files
+                 for test_name in ["explicit-" + name, "generated"]]
+        for name, test_file, words in cases:
+            case = "{} {}".format(name, os.path.basename(test_file))
+            seconds = best_time(lambda: jflapgrader.run_tests(
+                machine_files[name], test_file))
+            record("run_tests", case, len(words), "words", seconds,
+                   engine="native")
+            # The batch worker in batch.py speaks the same protocol as
+            # jflaplib-cli, so it measures the subprocess machinery
+            # even where Java is not installed.
+            command = [sys.executable,
+                       os.path.join(os.path.dirname(os.path.abspath(
+                           __file__)), "batch.py"),
+                       machine_files[name]]
+            for jobs in SUITE_JOBS:
+                seconds = best_time(
+                    lambda: batch.run_batch(command, words, jobs=jobs),
+                    repeat=1)
+                record("run_batch", case, len(words), "words", seconds,
+                       engine="batch", jobs=jobs)
+        grade_script = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "grade.py")
+        submissions = os.path.join(directory, "submissions")
+        os.mkdir(submissions)
+        for i in range(sizes["submissions"]):
+            name = sorted(machine_files)[i % len(machine_files)]
+            shutil.copy(machine_files[name],
+                        os.path.join(submissions, "{}-{}.jff".format(i, name)))
+        for jobs in SUITE_JOBS:
+            output = os.path.join(directory, "output-{}".format(jobs))
+            start = time.perf_counter()
+            # The submissions are copies of a few machines, so without
+            # --no-dedup only those few would be graded.
+            subprocess.run([sys.executable, grade_script, "--no-cache",
+                            "--no-dedup", "--jobs", str(jobs), submissions,
+                            output, test_files["generated"]],
+                           check=True, stdout=subprocess.DEVNULL)
+            record("grade.py", "generated", sizes["submissions"],
+                   "submissions", time.perf_counter() - start, jobs=jobs)
+    finally:
+        shutil.rmtree(directory)
+    data = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "engineVersion": automata.ENGINE_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": bitset.available(),
+        "seed": seed,
+        "sizes": sizes,
+        "results": results,
+    }
+    if output_file is None:
+        json.dump(data, sys.stdout, indent=2)
+        print()
+    else:
+        with open(output_file, "w") as f:
+            json.dump(data, f, indent=2)
+
+def parse_suite_args(args):
+    sizes = SUITE_SIZES
+    seed = 0
+    output_file = None
+    while args:
+        option = args.pop(0)
+        if option == "--quick":
+            sizes = QUICK_SIZES
+            continue
+        if not args:
+            usage_and_exit()
+        value = args.pop(0)
+        if option == "--seed":
+            try:
+                seed = int(value)
+            except ValueError:
+                usage_and_exit()
+        elif option == "--output":
+            output_file = value
+        else:
+            usage_and_exit()
+    return sizes, seed, output_file
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args:
+        usage_and_exit()
+    if args[0] == "simulation" and len(args) <= 3:
+        jflap_file = args[1] if len(args) > 1 else "jff/example.jff"
+        try:
+            max_length = int(args[2]) if len(args) > 2 else 14
+        except ValueError:
+            usage_and_exit()
+        bench_simulation(jflap_file, max_length)
+    elif args[0] == "words" and len(args) <= 2:
+        try:
+            max_length = int(args[1]) if len(args) > 1 else 18
+        except ValueError:
+            usage_and_exit()
+        bench_words(max_length)
+    elif args[0] == "parse" and len(args) <= 2:
+        try:
+            cases = int(args[1]) if len(args) > 1 else 200000
+        except ValueError:
+            usage_and_exit()
+        bench_parse(cases)
+    elif args[0] == "load" and len(args) <= 2:
+        try:
+            states = int(args[1]) if len(args) > 1 else 5000
+        except ValueError:
+            usage_and_exit()
+        bench_load(states)
+    elif args[0] == "suite":
+        bench_suite(*parse_suite_args(args[1:]))
+    else:
+        usage_and_exit()
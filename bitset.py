@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Vectorized simulation of a finite automaton on many words at once.
+
+The set of states an NFA is in is represented as a row of bits, packed
+into 64-bit integers, and the state sets for a whole batch of words of
+the same length are stored as the rows of a NumPy array. Reading one
+symbol is then a table lookup per byte of each row followed by an OR:
+for every symbol, byte position and byte value, the table holds the
+union of the transitions out of the (up to eight) states whose bits are
+set in that byte. So every word of a given length advances one symbol
+per step with a handful of array operations, instead of each word being
+simulated separately in Python.
+
+NumPy is optional. If it is not installed, available() returns false
+and the callers in the automata module use the per-word simulation.
+"""
+
+import doctest
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Lookup tables larger than this many bytes are not built; automata
+# that would need them are simulated word by word instead.
+MAX_TABLE_BYTES = 64 * 1024 * 1024
+
+# The number of table entries gathered at once when advancing a batch
+# of words, which bounds the size of the temporary arrays.
+CHUNK_ELEMENTS = 1 << 21
+
+
+class TableTooLargeError(Exception):
+    """Exception thrown when an automaton has too many states or symbols
+    for its lookup table to be worth building."""
+    pass
+
+
+def available():
+    """Returns whether NumPy, and hence this module, can be used."""
+    return numpy is not None
+
+
+class BitsetSimulator(object):
+    """Batch simulator for an automata.FiniteAutomaton (which must have an
+    initial state).
+
+    >>> import automata
+    >>> fa = automata.FiniteAutomaton(
+    ...     [0, 1, 2], 0, [2], [(0, "0", 0), (0, "1", 0), (0, "1", 1),
+    ...                         (1, "0", 2), (1, "1", 2)])
+    >>> words = ["", "10", "011", "100", "1x", "111", "0"]
+    >>> BitsetSimulator(fa).accepts_all(words) == [fa.accepts(word)
+    ...                                            for word in words]
+    True
+    """
+
+    def __init__(self, fa):
+        size = fa.size
+        self.words_per_row = (size + 63) // 64
+        self.bytes_per_row = self.words_per_row * 8
+        self.symbols = sorted(fa.alphabet)
+        symbol_count = len(self.symbols)
+        table_bytes = ((symbol_count + 1) * self.bytes_per_row * 256
+                       * self.bytes_per_row)
+        if table_bytes > MAX_TABLE_BYTES:
+            raise TableTooLargeError(
+                "lookup table would take {} bytes".format(table_bytes))
+        # table[c, b, v] is the union of delta[s][symbols[c]] over the
+        # states s whose bits are set in v, when v is byte b of a row.
+        # The extra last symbol stands for any symbol the automaton
+        # doesn't use, and leads nowhere.
+        self.table = numpy.zeros((symbol_count + 1, self.bytes_per_row, 256,
+                                  self.words_per_row), dtype="<u8")
+        for c, symbol in enumerate(self.symbols):
+            masks = numpy.zeros((self.bytes_per_row * 8, self.words_per_row),
+                                dtype="<u8")
+            for state in range(size):
+                for target in fa.delta[state].get(symbol, ()):
+                    masks[state, target >> 6] |= numpy.uint64(1 << (target & 63))
+            masks = masks.reshape(self.bytes_per_row, 8, self.words_per_row)
+            for value in range(1, 256):
+                low_bit = (value & -value).bit_length() - 1
+                self.table[c, :, value] = (self.table[c, :, value & (value - 1)]
+                                           | masks[:, low_bit])
+        self.start = self.pack(fa.start())
+        self.finals = self.pack(fa.finals)
+        self.codes = numpy.array([ord(symbol) for symbol in self.symbols],
+                                 dtype="<u4")
+
+    def pack(self, states):
+        """Returns the row of bits for a set of states."""
+        row = numpy.zeros(self.words_per_row, dtype="<u8")
+        for state in states:
+            row[state >> 6] |= numpy.uint64(1 << (state & 63))
+        return row
+
+    def encode(self, words, length):
+        """Returns an array with a row of symbol indices for each of words,
+        which must all have the given length."""
+        chars = numpy.array(words, dtype="<U{}".format(length))
+        chars = chars.view("<u4").reshape(len(words), length)
+        if len(self.codes) == 0:
+            return numpy.zeros(chars.shape, dtype=numpy.intp)
+        position = numpy.searchsorted(self.codes, chars)
+        position = numpy.minimum(position, len(self.codes) - 1)
+        known = self.codes[position] == chars
+        return numpy.where(known, position, len(self.codes))
+
+    def run(self, symbols):
+        """Returns a boolean array saying which rows of the array of symbol
+        indices are accepted."""
+        count, length = symbols.shape
+        current = numpy.tile(self.start, (count, 1))
+        byte_positions = numpy.arange(self.bytes_per_row)[None, :]
+        for step in range(length):
+            gathered = self.table[symbols[:, step, None], byte_positions,
+                                  current.view(numpy.uint8)]
+            current = numpy.bitwise_or.reduce(gathered, axis=1)
+        return (current & self.finals).any(axis=1)
+
+    def accepts_all(self, words):
+        """Returns a list saying whether each of words is accepted."""
+        by_length = {}
+        for i, word in enumerate(words):
+            by_length.setdefault(len(word), []).append(i)
+        verdicts = [False] * len(words)
+        chunk = max(1, CHUNK_ELEMENTS // (self.bytes_per_row
+                                          * self.words_per_row))
+        for length, indices in by_length.items():
+            for begin in range(0, len(indices), chunk):
+                batch = indices[begin:begin + chunk]
+                if length == 0:
+                    accepted = [bool((self.start & self.finals).any())] * len(batch)
+                else:
+                    symbols = self.encode([words[i] for i in batch], length)
+                    accepted = self.run(symbols).tolist()
+                for i, flag in zip(batch, accepted):
+                    verdicts[i] = flag
+        return verdicts
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    elif available():
+        doctest.testmod()
+    else:
+        print("NumPy is not installed; skipping tests.", file=sys.stderr)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""Content-addressed on-disk caches of grading results and test sets.
+
+Values are stored under a key which is a hash of everything they
+depend on: for results, the contents of the submission, the parsed
+test set, the version of the grader, and the grading options; for
+test sets, the contents of the test file. So an entry can never be
+stale; it simply stops being looked up. Entries are evicted least
+recently used first once a cache grows beyond its size limit.
+"""
+
+import doctest
+import hashlib
+import json
+import marshal
+import os
+import sys
+import tempfile
+
+
+# The default location of the cache, next to this file.
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 ".jflapcache")
+
+# The default size limit of the result cache, in bytes.
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# The fraction of its size limit that eviction shrinks a cache to, so
+# that it is not evicted again until a good deal more has been stored.
+EVICT_TO = 0.75
+
+
+def digest(*parts):
+    """Returns a hex digest identifying the sequence of parts, each of
+    which is bytes or a JSON-serializable value.
+
+    >>> digest(b"abc", {"x": [1, 2]}) == digest(b"abc", {"x": [1, 2]})
+    True
+    >>> digest(b"ab", b"c") == digest(b"a", b"bc")
+    False
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True).encode("utf-8")
+        # Length-prefix each part so that different splits of the same
+        # bytes give different digests.
+        h.update(str(len(part)).encode("ascii") + b":")
+        h.update(part)
+    return h.hexdigest()
+
+
+def file_digest(path):
+    """Returns the hex digest of the contents of the file at path."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def write_atomically(path, data):
+    """Writes the bytes data to path so that readers never see a partial
+    file."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_name, path)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+class DirectoryCache(object):
+    """A size-bounded LRU cache of byte strings in a directory.
+
+    Entries are files named by their key. Reading an entry updates its
+    modification time, which is what eviction goes by, so several
+    processes can share one cache without any coordination.
+    Subclasses convert values to and from bytes with encode and
+    decode.
+
+    Walking the directory to find its size takes time proportional to
+    the number of entries, so it is only done on the first put and
+    whenever the size estimated from then on, by adding up the entries
+    stored since, goes over the limit. Entries stored by other
+    processes are only counted at the next walk, so a shared cache can
+    go over its limit for a while.
+    """
+    suffix = ".bin"
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # The estimated total size of the entries, or None before the
+        # directory has been walked.
+        self.estimated_bytes = None
+
+    def encode(self, value):
+        return value
+
+    def decode(self, data):
+        return data
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key):
+        """Returns the value stored under key, or None if there is none (or
+        it cannot be decoded)."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                value = self.decode(f.read())
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """Stores value under key, then evicts old entries if the cache has
+        grown too large."""
+        data = self.encode(value)
+        write_atomically(self.path(key), data)
+        if self.estimated_bytes is not None:
+            self.estimated_bytes += len(data)
+        if self.estimated_bytes is None or \
+                self.estimated_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """If the total size of the cache is over its limit, deletes the
+        least recently used entries until it is within EVICT_TO of the
+        limit."""
+        target = self.max_bytes * EVICT_TO
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        if total > self.max_bytes:
+            for mtime, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Someone else evicted it first.
+                    pass
+                total -= size
+        self.estimated_bytes = total
+
+
+class ResultCache(DirectoryCache):
+    """A DirectoryCache of grading results, stored as JSON.
+
+    >>> import shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> cache = ResultCache(directory, max_bytes=40)
+    >>> cache.put("a" * 64, {"n": 1})
+    >>> cache.get("a" * 64)
+    {'n': 1}
+    >>> cache.get("b" * 64) is None
+    True
+    >>> cache.put("b" * 64, {"n": 2 * 10 ** 20})
+    >>> cache.put("c" * 64, {"n": 3 * 10 ** 20})
+    >>> cache.get("a" * 64) is None
+    True
+    >>> shutil.rmtree(directory)
+    """
+    suffix = ".json"
+
+    def __init__(self, directory=os.path.join(DEFAULT_DIRECTORY, "results"),
+                 max_bytes=DEFAULT_MAX_BYTES):
+        DirectoryCache.__init__(self, directory, max_bytes)
+
+    def encode(self, value):
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data):
+        return json.loads(data.decode("utf-8"))
+
+
+class TestSetCache(DirectoryCache):
+    """A DirectoryCache of parsed test files, i.e. dictionaries mapping
+    input strings to whether they should be accepted.
+
+    Test sets are stored compactly with marshal, as the tuple of input
+    strings followed by one byte per string for the expected result,
+    which is much faster to load than reparsing the test file and
+    rerunning its "words" and "check" functions.
+
+    >>> import shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> cache = TestSetCache(directory)
+    >>> cache.put("a" * 64, {"01": True, "": False})
+    >>> cache.get("a" * 64)
+    {'01': True, '': False}
+    >>> shutil.rmtree(directory)
+    """
+    suffix = ".tests"
+
+    def __init__(self, directory=os.path.join(DEFAULT_DIRECTORY, "tests"),
+                 max_bytes=DEFAULT_MAX_BYTES):
+        DirectoryCache.__init__(self, directory, max_bytes)
+
+    def encode(self, tests):
+        return marshal.dumps((tuple(tests), bytes(map(bool, tests.values()))))
+
+    def decode(self, data):
+        words, expected = marshal.loads(data)
+        return {word: flag == 1 for word, flag in zip(words, expected)}
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
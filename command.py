@@ -1,61 +1,398 @@
 #! /usr/bin/env python
-import threading
+"""Running subprocesses with a timeout, from an asyncio event loop.
+
+Each Command is supervised by a coroutine rather than by a thread of
+its own, so a single thread can run any number of them at once (see
+run_all). A command runs in a process group of its own, and when it
+times out the whole group is sent SIGTERM and then, if it is still
+around after a grace period, SIGKILL; this takes care of JVMs that
+ignore SIGTERM and of any processes they have started.
+
+Output is read as it is produced rather than all at once at the end,
+and only the first and last few kilobytes of each stream are kept, so
+a program that prints megabytes of tracing can't use up memory or
+bloat the grading results. A command can also be stopped as soon as a
+line of its output says everything we need to know.
+"""
+
+import asyncio
+import doctest
+import os
+import shlex
+import signal
 import subprocess
+import sys
+import time
 import traceback
-import shlex
 
 
-class Command(object):
+# How long, in seconds, a command that timed out is given to exit
+# after SIGTERM before it is sent SIGKILL. The same grace period is
+# given to its descendants to close the pipes after it has exited.
+KILL_GRACE = 2.0
+
+# How often, in seconds, to check whether a process has exited on
+# platforms without a way to be notified of it.
+POLL_INTERVAL = 0.01
+
+# The number of bytes of each of stdout and stderr kept from a
+# command: half from the start and half from the end.
+OUTPUT_LIMIT = 64 * 1024
+
+# The number of bytes read from a pipe at once.
+CHUNK_SIZE = 64 * 1024
+
+
+class CommandResult(object):
+    """The result of running a Command.
+
+    returncode, output, error and timed_out are as they were in the
+    tuple returned by older versions of Command.run, which this still
+    unpacks into, except that output and error may have been truncated
+    in the middle (see BoundedBuffer). wall_time is the time in seconds
+    from starting the command to its exit, cpu_time is the user and
+    system CPU time it used, or None where that is not available,
+    spawn_time is how long starting the process took, and
+    stopped_early says whether it was stopped because of its output
+    (see Command.run).
+
+    >>> result = CommandResult(0, "true\\n", "", False, 0.25, 0.5)
+    >>> returncode, output, error, timed_out = result
+    >>> returncode, output, timed_out, result.cpu_time
+    (0, 'true\\n', False, 0.5)
     """
-    Enables to run subprocess commands in a different thread with TIMEOUT option.
+    __slots__ = ("returncode", "output", "error", "timed_out", "wall_time",
+                 "cpu_time", "stopped_early", "spawn_time")
 
-    Based on jcollado's solution:
-    http://stackoverflow.com/questions/1191374/subprocess-with-timeout/4825933#4825933
+    def __init__(self, returncode, output, error, timed_out, wall_time,
+                 cpu_time=None, stopped_early=False, spawn_time=None):
+        self.returncode = returncode
+        self.output = output
+        self.error = error
+        self.timed_out = timed_out
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.stopped_early = stopped_early
+        self.spawn_time = spawn_time
 
-    Minor adaptations for use in the CS> system from kirpit's solution:
-    https://gist.github.com/kirpit/1306188
+    def __iter__(self):
+        return iter((self.returncode, self.output, self.error,
+                     self.timed_out))
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __repr__(self):
+        return ("CommandResult(returncode={!r}, timed_out={!r})"
+                .format(self.returncode, self.timed_out))
+
+
+class Command(object):
+    """A subprocess command which can be run with a timeout.
+
+    >>> python = [sys.executable, "-c"]
+    >>> returncode, output, error, timed_out = Command(
+    ...     python + ["print('true')"]).run()
+    >>> returncode, output, timed_out
+    (0, 'true\\n', False)
+    >>> stubborn = ("import signal, time; "
+    ...             "signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+    ...             "print('sleeping', flush=True); time.sleep(30)")
+    >>> result = Command(python + [stubborn], kill_grace=0.2).run(timeout=0.5)
+    >>> result.timed_out, result.output, result.wall_time < 5
+    (True, 'sleeping\\n', True)
+    >>> Command(["no such program"]).run().returncode
+    -1
+    >>> chatty = ("import time; print('x' * 100000); "
+    ...           "print('true', flush=True); time.sleep(30)")
+    >>> result = Command(python + [chatty], output_limit=20).run(
+    ...     until=lambda line: line == "true")
+    >>> result.output
+    'xxxxxxxxxx\\n[... 99986 bytes omitted ...]\\nxxxx\\ntrue\\n'
+    >>> result.stopped_early, result.timed_out
+    (True, False)
     """
-    command = None
-    process = None
-    returncode = None
-    output, error = '', ''
 
-    def __init__(self, command):
+    def __init__(self, command, kill_grace=KILL_GRACE,
+                 output_limit=OUTPUT_LIMIT):
         if isinstance(command, str):
             command = shlex.split(command)
         self.command = command
+        self.kill_grace = kill_grace
+        self.output_limit = output_limit
 
-    def run(self, timeout=None, **kwargs):
-        """Run a command.
+    def run(self, timeout=None, until=None, **kwargs):
+        """Runs the command and returns a CommandResult, which unpacks into
+        a tuple of the return code from the command, the stdout and
+        stderr as strings, and whether the process timed out.
 
-        Return a tuple of the return code from the command, the stdout
-        and stderr as strings, and whether the process timed out.
+        If until is given, it is called with each line of stdout
+        (without its line ending), and as soon as it returns true the
+        command is stopped in the same way as if it had timed out,
+        except that the result says it was stopped early rather than
+        that it timed out.
 
-        Remaining kwargs are passed to the Popen constructor.
+        Remaining kwargs are passed to the Popen constructor. This
+        starts an event loop of its own, so it must not be called from
+        a coroutine; use run_async instead.
         """
-        def target(**kwargs):
+        return asyncio.run(self.run_async(timeout, until, **kwargs))
+
+    async def run_async(self, timeout=None, until=None, **kwargs):
+        """Coroutine version of run."""
+        kwargs.setdefault("stdout", subprocess.PIPE)
+        kwargs.setdefault("stderr", subprocess.PIPE)
+        if os.name == "posix":
+            kwargs.setdefault("start_new_session", True)
+        start = time.perf_counter()
+        try:
+            process = subprocess.Popen(self.command, **kwargs)
+        except Exception:
+            return CommandResult(-1, "", traceback.format_exc(), False,
+                                 time.perf_counter() - start)
+        spawn_time = time.perf_counter() - start
+        output = BoundedBuffer(self.output_limit)
+        error = BoundedBuffer(self.output_limit)
+        answered = asyncio.Event()
+
+        def check_line(line):
+            if until(line):
+                answered.set()
+        try:
+            readers = [
+                asyncio.ensure_future(read_pipe(
+                    process.stdout, output,
+                    None if until is None else check_line)),
+                asyncio.ensure_future(read_pipe(process.stderr, error)),
+            ]
+            exited = asyncio.ensure_future(wait_process(process))
+            stop = asyncio.ensure_future(answered.wait())
             try:
-                self.process = subprocess.Popen(self.command, **kwargs)
-                self.output, self.error = self.process.communicate()
-                self.output = self.output.decode("utf-8")
-                self.error = self.error = self.error.decode("utf-8")
-                self.returncode = self.process.returncode
-            except:
-                self.error = traceback.format_exc()
-                self.returncode = -1
-        # default stdout and stderr
-        if 'stdout' not in kwargs:
-            kwargs['stdout'] = subprocess.PIPE
-        if 'stderr' not in kwargs:
-            kwargs['stderr'] = subprocess.PIPE
-        # thread
-        thread = threading.Thread(target=target, kwargs=kwargs)
-        thread.start()
-        thread.join(timeout)
-        timeout = False
-        if thread.is_alive():
-            timeout = True
-            if self.process:
-                self.process.terminate()
-                thread.join()
-        return self.returncode, self.output, self.error, timeout
+                await asyncio.wait([exited, stop], timeout=timeout,
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stop.cancel()
+            stopped_early = answered.is_set() and not exited.done()
+            timed_out = not exited.done() and not stopped_early
+            if timed_out or stopped_early:
+                signal_group(process, force=False)
+                if not await finish_within(exited, self.kill_grace):
+                    signal_group(process, force=True)
+            cpu_time = await exited
+            wall_time = time.perf_counter() - start
+            if timed_out or stopped_early:
+                # Make sure nothing the command started survives it.
+                signal_group(process, force=True)
+            pipes = asyncio.gather(*readers)
+            if not await finish_within(pipes, self.kill_grace):
+                # Some descendant still has the pipes open.
+                signal_group(process, force=True)
+            await pipes
+        finally:
+            if process.returncode is None:
+                signal_group(process, force=True)
+                process.wait()
+        return CommandResult(process.returncode, output.getvalue(),
+                             error.getvalue(), timed_out, wall_time, cpu_time,
+                             stopped_early, spawn_time)
+
+
+async def finish_within(future, timeout):
+    """Waits up to timeout seconds (forever if None) for future to finish,
+    without cancelling it, and returns whether it did."""
+    try:
+        await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+class BoundedBuffer(object):
+    """Collects bytes written to it, keeping only the first and last
+    limit // 2 or so of them.
+
+    >>> buffer = BoundedBuffer(8)
+    >>> for chunk in [b"abc", b"defghij", b"klm"]:
+    ...     buffer.write(chunk)
+    >>> buffer.getvalue()
+    'abcd\\n[... 5 bytes omitted ...]\\njklm'
+    >>> buffer.omitted
+    5
+    """
+
+    def __init__(self, limit=OUTPUT_LIMIT):
+        self.head_limit = limit - limit // 2
+        self.tail_limit = limit // 2
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.omitted = 0
+
+    def write(self, data):
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            excess = len(self.tail) - self.tail_limit
+            if excess > 0:
+                del self.tail[:excess]
+                self.omitted += excess
+
+    def getvalue(self):
+        """Returns what was kept, decoded from UTF-8, with a marker where
+        bytes were left out."""
+        text = self.head.decode("utf-8", "replace")
+        if self.omitted:
+            text += "\n[... {} bytes omitted ...]\n".format(self.omitted)
+        return text + self.tail.decode("utf-8", "replace")
+
+
+async def read_pipe(pipe, buffer, on_line=None):
+    """Writes everything read from pipe, until EOF, to the BoundedBuffer
+    buffer, calling on_line (if given) with each complete line decoded
+    from UTF-8 without its line ending. Does nothing if pipe is None.
+
+    Lines longer than buffer can hold are skipped rather than passed to
+    on_line, so that memory use stays bounded."""
+    if pipe is None:
+        return
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    line = bytearray()
+    overlong = False
+    try:
+        while True:
+            chunk = await reader.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer.write(chunk)
+            if on_line is None:
+                continue
+            *complete, rest = chunk.split(b"\n")
+            for piece in complete:
+                if not overlong:
+                    line += piece
+                    on_line(line.decode("utf-8", "replace").rstrip("\r"))
+                line.clear()
+                overlong = False
+            if not overlong:
+                line += rest
+                if len(line) > buffer.head_limit + buffer.tail_limit:
+                    line.clear()
+                    overlong = True
+    finally:
+        transport.close()
+
+
+async def wait_process(process):
+    """Waits for the subprocess.Popen process to exit, without blocking the
+    event loop, sets its returncode, and returns the CPU time it used
+    in seconds, or None if that is not available on this platform."""
+    if not hasattr(os, "wait4"):
+        while process.poll() is None:
+            await asyncio.sleep(POLL_INTERVAL)
+        return None
+    loop = asyncio.get_running_loop()
+    # On Linux, a pidfd becomes readable when the process exits, so we
+    # don't need to poll.
+    pidfd = None
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except OSError:
+            pass
+    try:
+        while True:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if pidfd is None:
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            readable = loop.create_future()
+            loop.add_reader(pidfd, lambda: readable.done()
+                            or readable.set_result(None))
+            try:
+                await readable
+            finally:
+                loop.remove_reader(pidfd)
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return usage.ru_utime + usage.ru_stime
+
+
+def signal_group(process, force):
+    """Sends SIGTERM, or SIGKILL if force is true, to the process group of
+    process (just to process itself on platforms without process
+    groups). Processes that have already exited are ignored."""
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid,
+                      signal.SIGKILL if force else signal.SIGTERM)
+        elif force:
+            process.kill()
+        else:
+            process.terminate()
+    except OSError:
+        pass
+
+
+def run_all(commands, timeout=None, jobs=None, slot=None, on_result=None,
+            **kwargs):
+    """Runs each of commands with Command.run_async, up to jobs (or, if
+    None, all of them) at once, from a single thread, and returns the
+    list of CommandResults in the same order. If on_result is given, it
+    is called with the index of each command and its result as soon as
+    it finishes.
+
+    If slot is given, it is called with no arguments to get an
+    asynchronous context manager which is held while each command
+    runs, such as scheduler.async_subprocess_slot. timeout and the
+    remaining kwargs are passed to run_async.
+
+    >>> commands = [Command([sys.executable, "-c", "print({})".format(n)])
+    ...             for n in range(4)]
+    >>> [result.output for result in run_all(commands, jobs=2)]
+    ['0\\n', '1\\n', '2\\n', '3\\n']
+    """
+    async def supervise():
+        limit = asyncio.Semaphore(jobs) if jobs else None
+
+        async def run_one(index, command):
+            if limit is not None:
+                await limit.acquire()
+            try:
+                if slot is None:
+                    result = await command.run_async(timeout, **dict(kwargs))
+                else:
+                    async with slot():
+                        result = await command.run_async(timeout,
+                                                         **dict(kwargs))
+            finally:
+                if limit is not None:
+                    limit.release()
+            if on_result is not None:
+                on_result(index, result)
+            return result
+
+        return await asyncio.gather(*(run_one(index, command)
+                                      for index, command
+                                      in enumerate(commands)))
+    return asyncio.run(supervise())
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
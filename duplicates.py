@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Finding submissions that are bound to get the same results.
+
+In a big section, many submissions are the same machine, up to the
+names and layout of their states, and many finite automata accept the
+same language even though they look quite different. Each such group
+only needs grading once.
+
+A fingerprint identifies what a submission's results depend on:
+
+* For a finite automaton the native engines can read, its language,
+  as the minimal DFA over the symbols it actually uses, with its
+  states numbered in breadth-first order (see equivalence.minimize),
+  unless finding it would take too long (see
+  equivalence.MAX_DFA_STATES).
+* For other machines, their structure: the type of machine, the
+  states reachable from the initial state, numbered in the order a
+  breadth-first search reaches them, with which are final, and the
+  transitions between them, with everything on them (what they read,
+  write, push and so on). State ids, names, labels, notes and x/y
+  coordinates are left out.
+* For anything else, such as a file with building blocks or one that
+  is not valid XML, the bytes of the file.
+
+Files with the same fingerprint get the same results. The converse
+does not hold: in particular, when a state has several transitions
+with the same label, which target the search reaches first depends on
+the order of the file, so some identical machines are not recognized.
+That only costs some grading.
+"""
+
+import doctest
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+import automata
+import cache
+import equivalence
+
+
+# The children of a <state> element that do not affect the results.
+LAYOUT_TAGS = {"x", "y", "label"}
+
+
+def language_fingerprint(fa):
+    """Returns the fingerprint of the automata.FiniteAutomaton fa, which
+    only depends on the language it accepts. Raises
+    automata.InvalidMachineError if fa has no initial state, and
+    equivalence.StateLimitError if its minimal DFA would take more than
+    equivalence.MAX_DFA_STATES states to find.
+
+    >>> a = automata.FiniteAutomaton(
+    ...     ["p", "q"], "p", ["q"], [("p", "1", "q"), ("q", "0", "q"),
+    ...                              ("q", "1", "q")])
+    >>> b = automata.FiniteAutomaton(
+    ...     [0, 1, 2, 3], 0, [1, 2], [(0, "1", 1), (1, "", 2),
+    ...                               (2, "0", 1), (2, "1", 2),
+    ...                               (0, "2", 3)])
+    >>> language_fingerprint(a) == language_fingerprint(b)
+    True
+    """
+    limit = equivalence.MAX_DFA_STATES
+    dfa = equivalence.minimize(equivalence.determinize(fa, limit=limit))
+    # Symbols on which every state goes to the dead state (if there is
+    # one) might as well not be in the alphabet. Leave them out, so
+    # that a stray transition to a dead end does not make a difference.
+    dead = [state for state in range(dfa.size)
+            if not dfa.accepting[state]
+            and all(target == state for target in dfa.table[state])]
+    live = [symbol for i, symbol in enumerate(dfa.alphabet)
+            if not dead or any(row[i] != dead[0] for row in dfa.table)]
+    if len(live) < len(dfa.alphabet):
+        dfa = equivalence.minimize(equivalence.determinize(fa, live, limit))
+    return cache.digest("language", list(dfa.alphabet), dfa.accepting,
+                        dfa.table)
+
+
+def element_key(element):
+    """Returns a JSON-serializable value identifying element, its
+    attributes, its text and its children, recursively."""
+    return [element.tag, sorted(element.attrib.items()),
+            (element.text or "").strip(),
+            [element_key(child) for child in element]]
+
+
+def structural_fingerprint(structure):
+    """Returns the fingerprint of the machine in the <structure> element
+    of a JFLAP file, which only depends on its structure, or None if it
+    has anything this function does not understand, or no initial
+    state.
+
+    >>> def fingerprint_of(contents):
+    ...     return structural_fingerprint(ET.fromstring(contents))
+    >>> a = fingerprint_of('''<structure><type>turing</type><automaton>
+    ...   <state id="0" name="q0"><x>1.0</x><y>2.0</y><initial/></state>
+    ...   <state id="1" name="q1"><x>5.0</x><y>2.0</y><final/></state>
+    ...   <transition><from>0</from><to>1</to><read>a</read>
+    ...     <write>b</write><move>R</move></transition>
+    ... </automaton></structure>''')
+    >>> b = fingerprint_of('''<structure><type>turing</type><automaton>
+    ...   <state id="7" name="end"><final/></state>
+    ...   <state id="3" name="start"><initial/></state>
+    ...   <state id="4" name="unreachable"/>
+    ...   <transition><from>3</from><to>7</to><move>R</move>
+    ...     <read>a</read><write>b</write></transition>
+    ... </automaton></structure>''')
+    >>> a == b
+    True
+    >>> a == fingerprint_of('''<structure><type>turing</type><automaton>
+    ...   <state id="0" name="q0"><initial/></state>
+    ...   <state id="1" name="q1"><final/></state>
+    ...   <transition><from>0</from><to>1</to><read>a</read>
+    ...     <write>b</write><move>L</move></transition>
+    ... </automaton></structure>''')
+    False
+    """
+    automaton = automata.automaton_element(structure)
+    # Anything at the top level other than the machine itself, such as
+    # its type or the number of tapes, is kept as it is.
+    settings = sorted(element_key(child) for child in structure
+                      if child is not automaton and
+                      child.tag not in ("state", "transition", "note"))
+    finals = set()
+    initial = None
+    outgoing = {}
+    for child in automaton:
+        if child.tag == "state":
+            state_id = child.get("id")
+            outgoing[state_id] = []
+            for part in child:
+                if part.tag == "initial":
+                    initial = state_id
+                elif part.tag == "final":
+                    finals.add(state_id)
+                elif part.tag not in LAYOUT_TAGS:
+                    return None
+        elif child.tag == "transition":
+            source = automata.element_text(child, "from")
+            target = automata.element_text(child, "to")
+            label = sorted(element_key(part) for part in child
+                           if part.tag not in ("from", "to"))
+            outgoing.setdefault(source, []).append((label, target))
+        elif child.tag == "note" or automaton is structure:
+            # Notes do not matter, and the other children of a
+            # <structure> without an <automaton> are in settings.
+            continue
+        else:
+            return None
+    if initial is None:
+        return None
+    # Number the states in breadth-first order, following transitions
+    # in order of their labels.
+    number = {initial: 0}
+    order = [initial]
+    states = []
+    for state in order:
+        arcs = []
+        for label, target in sorted(outgoing.get(state, []),
+                                    key=lambda arc: arc[0]):
+            if target not in number:
+                number[target] = len(order)
+                order.append(target)
+            arcs.append([label, number[target]])
+        states.append([state in finals, sorted(arcs)])
+    return cache.digest("structure", settings, states)
+
+
+def fingerprint(jflap_file):
+    """Returns the fingerprint of the JFLAP file at the path jflap_file
+    (see the module docstring), or None if it cannot be read.
+
+    >>> fingerprint(example_jff) == fingerprint(example_jff)
+    True
+    """
+    try:
+        with open(jflap_file, "rb") as f:
+            contents = f.read()
+    except OSError:
+        return None
+    try:
+        structure = ET.fromstring(contents)
+        try:
+            machine = automata.parse_jff(contents)
+        except (automata.UnsupportedMachineError,
+                automata.InvalidMachineError):
+            machine = None
+        if isinstance(machine, automata.FiniteAutomaton):
+            try:
+                return language_fingerprint(machine)
+            except (automata.InvalidMachineError,
+                    equivalence.StateLimitError):
+                # Such automata are still grouped by their structure.
+                pass
+        digest = structural_fingerprint(structure)
+    except Exception:
+        # Fingerprinting is only an optimization, so a file it cannot
+        # handle, for whatever reason, is only grouped with identical
+        # files, and left for grading to report on.
+        digest = None
+    if digest is None:
+        return cache.digest("bytes", contents)
+    return digest
+
+
+def group_submissions(paths):
+    """Groups the JFLAP files at paths by fingerprint, and returns a list
+    of the groups, each a list of paths, in the order in which their
+    first members appear in paths. A file that cannot be read is in a
+    group of its own.
+    """
+    groups = {}
+    for path in paths:
+        key = fingerprint(path)
+        if key is None:
+            key = ("unreadable", path)
+        groups.setdefault(key, []).append(path)
+    return list(groups.values())
+
+
+example_jff = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "jff", "example.jff")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""Deciding language equivalence of finite automata.
+
+Instead of running a submission on a list of test words, it can be
+compared against a reference automaton directly: both are determinized
+over a common alphabet and minimized, and a breadth-first search of
+their product finds the shortest words on which they disagree. If
+there are none, the two accept exactly the same language.
+"""
+
+import collections
+import doctest
+import sys
+
+# Only the doctests use automata directly.
+import automata  # noqa: F401
+
+
+# The number of states beyond which callers that must not hang on a
+# submission, such as deduplication and grading against a reference,
+# give up determinizing it. The subset construction can take
+# exponentially many states in the size of the NFA.
+MAX_DFA_STATES = 10000
+
+
+class StateLimitError(Exception):
+    """Exception thrown when the subset construction of an automaton
+    reaches more states than it was allowed."""
+    pass
+
+
+class DFA(object):
+    """A complete deterministic finite automaton.
+
+    alphabet is a sorted tuple of symbols, states are numbered from 0
+    to size - 1, start is the initial state, accepting is a list of
+    booleans indexed by state, and table[state][i] is the state reached
+    from state by reading alphabet[i].
+    """
+    __slots__ = ("alphabet", "start", "accepting", "table")
+
+    def __init__(self, alphabet, start, accepting, table):
+        self.alphabet = alphabet
+        self.start = start
+        self.accepting = accepting
+        self.table = table
+
+    @property
+    def size(self):
+        return len(self.table)
+
+    def accepts(self, word):
+        """Returns whether the DFA accepts word. Symbols outside the
+        alphabet are rejected."""
+        index = {symbol: i for i, symbol in enumerate(self.alphabet)}
+        state = self.start
+        for symbol in word:
+            if symbol not in index:
+                return False
+            state = self.table[state][index[symbol]]
+        return self.accepting[state]
+
+
+def determinize(fa, alphabet=None, limit=None):
+    """Returns a DFA accepting the same language as the
+    automata.FiniteAutomaton fa, by the subset construction.
+
+    The DFA is complete over alphabet, which defaults to the symbols
+    fa uses; the empty set of states becomes an ordinary rejecting
+    (dead) state. Raises automata.InvalidMachineError if fa has no
+    initial state, and StateLimitError if limit is given and the DFA
+    would have more than limit states.
+
+    >>> fa = automata.FiniteAutomaton(
+    ...     [0, 1, 2], 0, [2], [(0, "0", 0), (0, "1", 0), (0, "1", 1),
+    ...                         (1, "0", 2), (1, "1", 2)])
+    >>> dfa = determinize(fa)
+    >>> dfa.size, dfa.alphabet
+    (4, ('0', '1'))
+    >>> [dfa.accepts(word) for word in ["10", "011", "100", "12"]]
+    [True, True, False, False]
+    >>> determinize(fa, limit=3)
+    Traceback (most recent call last):
+        ...
+    StateLimitError: determinizing the automaton takes more than 3 states
+    """
+    if alphabet is None:
+        alphabet = fa.alphabet
+    alphabet = tuple(sorted(alphabet))
+    start = fa.start()
+    index = {start: 0}
+    subsets = [start]
+    table = []
+    for subset in subsets:
+        row = []
+        for symbol in alphabet:
+            target = fa.step(subset, symbol)
+            if target not in index:
+                if len(subsets) == limit:
+                    raise StateLimitError(
+                        "determinizing the automaton takes more than {}"
+                        " states".format(limit))
+                index[target] = len(subsets)
+                subsets.append(target)
+            row.append(index[target])
+        table.append(row)
+    accepting = [not fa.finals.isdisjoint(subset) for subset in subsets]
+    return DFA(alphabet, 0, accepting, table)
+
+
+def minimize(dfa):
+    """Returns the minimal DFA accepting the same language as dfa.
+
+    Unreachable states are dropped, and equivalent states are merged
+    by partition refinement. The states of the result are numbered in
+    the order a breadth-first search from the start state reaches
+    them, trying symbols in alphabetical order, so two DFAs over the
+    same alphabet accept the same language if and only if their
+    minimizations are identical.
+
+    >>> dfa = DFA(("a", "b"), 0, [False, True, False, True, False],
+    ...           [[1, 4], [2, 4], [3, 4], [2, 4], [4, 4]])
+    >>> small = minimize(dfa)
+    >>> small.accepting, small.table
+    ([False, True, False], [[1, 2], [0, 2], [2, 2]])
+    """
+    # Find the reachable states, in breadth-first order.
+    order = [dfa.start]
+    seen = {dfa.start}
+    for state in order:
+        for target in dfa.table[state]:
+            if target not in seen:
+                seen.add(target)
+                order.append(target)
+    # Moore's algorithm: start from the accepting/rejecting split and
+    # refine until the blocks are stable.
+    block = {state: int(dfa.accepting[state]) for state in order}
+    while True:
+        signatures = {}
+        refined = {}
+        for state in order:
+            signature = (block[state],
+                         tuple(block[target] for target in dfa.table[state]))
+            refined[state] = signatures.setdefault(signature, len(signatures))
+        if len(signatures) == len(set(block.values())):
+            break
+        block = refined
+    # Renumber the blocks in breadth-first order.
+    number = {}
+    queue = collections.deque([block[dfa.start]])
+    representative = {block[state]: state for state in reversed(order)}
+    number[block[dfa.start]] = 0
+    table = []
+    accepting = []
+    while queue:
+        current = queue.popleft()
+        state = representative[current]
+        row = []
+        for target in dfa.table[state]:
+            if block[target] not in number:
+                number[block[target]] = len(number)
+                queue.append(block[target])
+            row.append(number[block[target]])
+        table.append(row)
+        accepting.append(dfa.accepting[state])
+    return DFA(dfa.alphabet, 0, accepting, table)
+
+
+def counterexamples(submission, reference, limit=5):
+    """Compares two DFAs over the same alphabet.
+
+    Returns a pair of lists: words which submission accepts but
+    reference rejects (false accepts), and words which submission
+    rejects but reference accepts (false rejects). Each list holds the
+    first limit such words, ordered by length and then alphabetically,
+    and they are both empty if and only if the DFAs are equivalent.
+
+    >>> even = DFA(("0", "1"), 0, [True, False], [[0, 1], [1, 0]])
+    >>> odd = DFA(("0", "1"), 0, [False, True], [[0, 1], [1, 0]])
+    >>> none = DFA(("0", "1"), 0, [False], [[0, 0]])
+    >>> counterexamples(even, odd, limit=2)
+    (['', '0'], ['1', '01'])
+    >>> counterexamples(none, odd)
+    ([], ['1', '01', '10', '001', '010'])
+    >>> counterexamples(even, even)
+    ([], [])
+    """
+    assert submission.alphabet == reference.alphabet
+    false_accepts = []
+    false_rejects = []
+    # This is a breadth-first search over words rather than over states
+    # of the product automaton, so that it finds more than one word
+    # per state. But a state only needs to be expanded for the first
+    # limit words that reach it: any later word w reaching it can be
+    # swapped for one of those earlier words u, and if w + x is a
+    # counterexample then so is u + x, which comes before it. This keeps
+    # the search linear in the size of the product.
+    visits = collections.Counter()
+    start = (submission.start, reference.start)
+    visits[start] = 1
+    queue = collections.deque([(start, "")])
+    while queue:
+        (s, r), word = queue.popleft()
+        verdict = submission.accepting[s]
+        if verdict != reference.accepting[r]:
+            found = false_accepts if verdict else false_rejects
+            if len(found) < limit:
+                found.append(word)
+            if len(false_accepts) >= limit and len(false_rejects) >= limit:
+                break
+        for i, symbol in enumerate(submission.alphabet):
+            target = (submission.table[s][i], reference.table[r][i])
+            if visits[target] < limit:
+                visits[target] += 1
+                queue.append((target, word + symbol))
+    return false_accepts, false_rejects
+
+
+def compare(submission, reference, limit=5, max_states=None):
+    """Compares two automata.FiniteAutomaton objects over the union of
+    their alphabets, after determinizing and minimizing both. See
+    counterexamples for the return value. Raises StateLimitError if
+    max_states is given and determinizing submission takes more states
+    than that."""
+    alphabet = submission.alphabet | reference.alphabet
+    return counterexamples(minimize(determinize(submission, alphabet,
+                                                max_states)),
+                           minimize(determinize(reference, alphabet)),
+                           limit)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
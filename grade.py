@@ -1,17 +1,33 @@
 #!/usr/bin/env python3
 
+import cache
+import concurrent.futures
 import datetime
+import duplicates
 import jflapgrader
 import json
+import multiprocessing
+import oracle
 import os
+import scheduler
 import sys
+import tempfile
+import time
+import traceback
 
 NAME = sys.argv[0]
 
 USAGE = """\
 usage: {}
-         [--timeout <timeout>]
-         <input-jff-or-directory> <output-file-or-directory> <test-file>\
+         [--timeout <timeout>] [--jobs <jobs>] [--test-jobs <jobs>]
+         [--max-subprocesses <count>]
+         [--no-cache | --refresh] [--cache-dir <directory>] [--stream]
+         [--incremental] [--profile] [--no-dedup] [--batch]
+         [--reference <reference-jff>] [--oracle <reference-program-or-jff>]
+         [--oracle-timeout <timeout>]
+         <input-jff-or-directory> <output-file-or-directory> [<test-file>]
+
+The test file may only be omitted when a reference is given.\
 """.format(NAME)
 
 def print_stderr(msg, *args, **kwargs):
@@ -29,25 +45,360 @@ def log(msg, *args, **kwargs):
     print("[{}] {}".format(
         datetime.datetime.now().strftime("%H:%M:%S"), msg), *args, **kwargs)
 
+def write_json(output_name, data):
+    """Write data to output_name as JSON, atomically: the file either
+    keeps its old contents or has the complete new contents, even if
+    we are interrupted halfway through."""
+    directory = os.path.dirname(os.path.abspath(output_name))
+    fd, temp_name = tempfile.mkstemp(
+        dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+        # mkstemp creates the file readable only by us.
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, output_name)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+def read_previous(output_name):
+    """Return the results previously written to output_name, or None if
+    there are none that can be read."""
+    try:
+        with open(output_name) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) and "tests" in data else None
+
+def grade(input_name, output_name, test_file, options):
+    """Grade one submission and write the results, passing options as
+    keyword arguments to run_tests. Return None on success, or the
+    formatted traceback if grading failed, so that one bad submission
+    cannot abort a whole batch.
+
+    If options has a "reference", finite automata are instead graded by
+    comparing them against it with run_equivalence, and other machines
+    with the test file, if there is one.
+
+    If options has "stream" set, each test result is also written to
+    output_name + ".ndjson" as soon as it is known, and a rerun after
+    an interruption resumes from there (see jflapgrader.ResultStream).
+    The JSON file itself is only written at the end, as usual.
+
+    If options has "incremental" set and output_name already holds
+    results for the same submission, they are passed to run_tests as
+    previous, so only the tests that are new to the test file are
+    run.
+
+    If options has "profile" set, the results include timings (see
+    jflapgrader.Profile), including the time taken to encode them as
+    JSON, which profile_report summarizes."""
+    options = dict(options)
+    reference = options.pop("reference", None)
+    if options.pop("stream", False):
+        options["stream_file"] = output_name + ".ndjson"
+    if options.pop("incremental", False):
+        options["previous"] = read_previous(output_name)
+    profile = options.get("profile", False)
+    try:
+        data = None
+        if reference is not None:
+            try:
+                data = jflapgrader.run_equivalence(input_name, reference)
+            except jflapgrader.automata.UnsupportedMachineError:
+                if test_file is None:
+                    raise
+        if data is None:
+            data = jflapgrader.run_tests(input_name, test_file, **options)
+        elif profile:
+            data["info"]["profile"] = jflapgrader.Profile().as_dict(0)
+        if profile:
+            # Time encoding the results, which is most of the cost of
+            # writing them, and include that in what is written.
+            start = time.perf_counter()
+            cpu = time.process_time()
+            json.dumps(data, indent=2)
+            data["info"]["profile"]["phases"]["encode"] = {
+                "wall": time.perf_counter() - start,
+                "cpu": time.process_time() - cpu,
+            }
+        write_json(output_name, data)
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+def copy_results(output_name, group, outputs, timeout=None):
+    """Copy the results written to output_name, for the first submission
+    in group, to the outputs of the other submissions in group, which
+    have the same fingerprint (see the duplicates module) and so would
+    get the same results. The "info" section of each says how many
+    submissions are in the group, and those of the copies say which
+    submission was actually graded. The "resultsKey" of each copy is
+    that of its own submission, graded with timeout, so that it can be
+    regraded with --incremental. Return None on success, or the
+    formatted traceback."""
+    try:
+        with open(output_name) as f:
+            data = json.load(f)
+        info = data["info"]
+        info["groupSize"] = len(group)
+        write_json(output_name, data)
+        graded = info["filename"]
+        keyed = "resultsKey" in info
+        for input_name, copy_name in zip(group[1:], outputs[1:]):
+            info["filename"] = os.path.realpath(input_name)
+            info["duplicateOf"] = graded
+            if keyed:
+                with open(input_name, "rb") as f:
+                    info["resultsKey"] = jflapgrader.submission_results_key(
+                        f.read(), timeout)
+            write_json(copy_name, data)
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+def groups_report(groups):
+    """Print the number of distinct submissions among groups, and the
+    groups with more than one submission, largest first."""
+    count = sum(len(group) for group in groups)
+    log("graded {} submissions as {} distinct submissions"
+        .format(count, len(groups)))
+    for group in sorted(groups, key=len, reverse=True):
+        if len(group) < 2:
+            break
+        print("{:>6}  {}".format(len(group), ", ".join(group)))
+
+def percentile(values, fraction):
+    """Return the value below which the given fraction of the sorted list
+    values lie, rounding down."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def profile_report(outputs, top=10):
+    """Print a summary of the timings in the results written to outputs:
+    percentiles of the time taken by each phase of grading, of the
+    time taken to start subprocesses, and the slowest submissions and
+    tests."""
+    phases = {}
+    submissions = []
+    tests = []
+    spawns = []
+    startups = []
+    did_not_terminate = 0
+    for output_name in outputs:
+        data = read_previous(output_name)
+        profile = data and data.get("info", {}).get("profile")
+        if not profile:
+            continue
+        filename = data["info"].get("filename", output_name)
+        total = 0.0
+        for name, times in profile["phases"].items():
+            phases.setdefault(name, []).append(times["wall"])
+            # Nested phases are already counted in their outer phase.
+            if "/" not in name:
+                total += times["wall"]
+        submissions.append((total, filename))
+        for word, times in profile["tests"].items():
+            tests.append((times["wall"], word, filename))
+            if times.get("spawn") is not None:
+                spawns.append(times["spawn"])
+        for start in profile["workers"]:
+            spawns.append(start["spawn"])
+            startups.append(start["startup"])
+        did_not_terminate += profile["didNotTerminate"]
+    print("Profile of {} submissions (times in seconds):"
+          .format(len(submissions)))
+    print("{:<24} {:>9} {:>9} {:>9} {:>9} {:>9}"
+          .format("phase", "p50", "p90", "p99", "max", "total"))
+    rows = sorted(phases.items())
+    if spawns:
+        rows.append(("subprocess spawn", spawns))
+    if startups:
+        rows.append(("batch worker startup", startups))
+    for name, values in rows:
+        values = sorted(values)
+        print("{:<24} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}"
+              .format(name, percentile(values, 0.5),
+                      percentile(values, 0.9), percentile(values, 0.99),
+                      values[-1], sum(values)))
+    print("Tests that did not terminate: {}".format(did_not_terminate))
+    print("Slowest submissions:")
+    for total, filename in sorted(submissions, reverse=True)[:top]:
+        print("{:>10.3f}  {}".format(total, filename))
+    if tests:
+        print("Slowest tests:")
+        for wall, word, filename in sorted(tests, reverse=True)[:top]:
+            print("{:>10.3f}  {!r} in {}".format(wall, word, filename))
+
+def format_duration(seconds):
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+def grade_in_parallel(inputs, outputs, test_file, options, jobs, slots):
+    """Grade all the (input, output) pairs with a pool of jobs worker
+    processes, which share the subprocess limit slots. Yield
+    (input_name, output_name, error) triples as the submissions
+    finish, in whatever order that happens."""
+    pending = list(zip(inputs, outputs))
+    with concurrent.futures.ProcessPoolExecutor(
+            jobs, initializer=scheduler.set_subprocess_limit,
+            initargs=(slots,)) as pool:
+        futures = {pool.submit(grade, input_name, output_name,
+                               test_file, options):
+                   (input_name, output_name)
+                   for input_name, output_name in pending}
+        crashed = []
+        for future in concurrent.futures.as_completed(futures):
+            input_name, output_name = futures[future]
+            try:
+                yield input_name, output_name, future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                crashed.append((input_name, output_name))
+    # If a worker process dies outright (rather than raising an
+    # exception), the pool is unusable and every unfinished submission
+    # is reported as crashed. Retry those one at a time, each in a
+    # fresh process, so that only the culprit is reported as failed.
+    for input_name, output_name in crashed:
+        with concurrent.futures.ProcessPoolExecutor(
+                1, initializer=scheduler.set_subprocess_limit,
+                initargs=(slots,)) as pool:
+            future = pool.submit(grade, input_name, output_name,
+                                 test_file, options)
+            try:
+                error = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                error = "grading process crashed"
+        yield input_name, output_name, error
+
+def grade_in_sequence(inputs, outputs, test_file, options):
+    for input_name, output_name in zip(inputs, outputs):
+        log("generating: '{}'".format(output_name))
+        yield input_name, output_name, grade(
+            input_name, output_name, test_file, options)
+
+def parse_positive_int(name, value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        error_and_exit(
+            "{} '{}' is not a positive integer".format(name, value))
+    return number
+
 if __name__ == "__main__":
     args = sys.argv[1:]
-    if len(args) not in (3, 5):
-        usage_and_exit()
-    if len(args) == 5:
-        if args[0] != "--timeout":
+    timeout = None
+    jobs = 1
+    test_jobs = 1
+    # By default, never run more subprocesses (JVMs) at once than there
+    # are CPUs, however --jobs and --test-jobs are combined.
+    max_subprocesses = os.cpu_count() or 1
+    use_cache = True
+    refresh = False
+    cache_dir = cache.DEFAULT_DIRECTORY
+    reference = None
+    stream = False
+    incremental = False
+    profile = False
+    dedup = True
+    batch = False
+    oracle_path = None
+    oracle_timeout = oracle.ORACLE_TIMEOUT
+    while args and args[0].startswith("--"):
+        option = args.pop(0)
+        # First the options that don't take a value.
+        if option == "--no-cache":
+            use_cache = False
+            continue
+        elif option == "--refresh":
+            refresh = True
+            continue
+        elif option == "--stream":
+            stream = True
+            continue
+        elif option == "--incremental":
+            incremental = True
+            continue
+        elif option == "--profile":
+            profile = True
+            continue
+        elif option == "--no-dedup":
+            dedup = False
+            continue
+        elif option == "--batch":
+            batch = True
+            continue
+        if not args:
             usage_and_exit()
-        try:
-            timeout = float(args[1])
-        except ValueError:
-            error_and_exit(
-                "timeout '{}' is not a number".format(args[1]))
+        value = args.pop(0)
+        if option == "--timeout":
+            try:
+                timeout = float(value)
+            except ValueError:
+                error_and_exit(
+                    "timeout '{}' is not a number".format(value))
+        elif option == "--jobs":
+            jobs = parse_positive_int("jobs", value)
+        elif option == "--test-jobs":
+            test_jobs = parse_positive_int("test jobs", value)
+        elif option == "--max-subprocesses":
+            max_subprocesses = parse_positive_int("max subprocesses", value)
+        elif option == "--cache-dir":
+            cache_dir = value
+        elif option == "--reference":
+            reference = value
+        elif option == "--oracle":
+            oracle_path = value
+        elif option == "--oracle-timeout":
+            try:
+                oracle_timeout = float(value)
+            except ValueError:
+                error_and_exit(
+                    "oracle timeout '{}' is not a number".format(value))
+        else:
+            usage_and_exit()
+    if len(args) == 2 and reference is not None:
+        input_path, output_path = args
+        test_file = None
+    elif len(args) == 3:
+        input_path, output_path, test_file = args
     else:
-        timeout = None
-    input_path, output_path, test_file = args[-3:]
+        usage_and_exit()
+    options = {
+        "timeout": timeout,
+        "jobs": test_jobs,
+        "batch": batch,
+        "result_cache": (cache.ResultCache(os.path.join(cache_dir, "results"))
+                         if use_cache else None),
+        "test_cache": (cache.TestSetCache(os.path.join(cache_dir, "tests"))
+                       if use_cache else None),
+        "refresh": refresh,
+        "reference": reference,
+        "stream": stream,
+        "incremental": incremental,
+        "profile": profile,
+        "oracle": (oracle.make_oracle(oracle_path, oracle_timeout)
+                   if oracle_path is not None else None),
+    }
 
     # Take care of the test file check first, since it's the easiest.
-    if not os.path.isfile(test_file):
+    if test_file is not None and not os.path.isfile(test_file):
         error_and_exit("no such file: " + test_file)
+    if reference is not None and not os.path.isfile(reference):
+        error_and_exit("no such file: " + reference)
+    if oracle_path is not None and not os.path.isfile(oracle_path):
+        error_and_exit("no such file: " + oracle_path)
+
+    # Compute the expected results the oracle gives once, up front, so
+    # that a broken oracle stops us before we start and the workers
+    # find them in the test set cache rather than each running it.
+    if options["oracle"] is not None and test_file is not None:
+        try:
+            jflapgrader.load_tests(test_file, options["test_cache"], refresh,
+                                   oracle=options["oracle"])
+        except jflapgrader.CouldNotRunJFLAPTestsError as e:
+            error_and_exit(str(e))
 
     # Make sure the input is an existing file or directory.
     if not os.path.exists(input_path):
@@ -91,19 +442,54 @@ if __name__ == "__main__":
                 error_and_exit("directory does not exist: " + parent_dir)
             outputs = [output_path]
 
-    # Now do the actual mapping.
-    for input_name, output_name in zip(inputs, outputs):
-
-        # if os.path.exists(output_name):
-        #     log("already exists, skipping: '{}'".format(output_name))
-        # else:
-        #     log("generating: '{}'".format(output_name))
-        #     data = jflapgrader.run_tests(input_name, test_file, timeout)
-        #     with open(output_name, 'w') as f:
-        #         json.dump(data, f, indent=2)
+    # Submissions with the same fingerprint get the same results, so
+    # only the first of each group is graded, and its results are
+    # copied to the others.
+    if mapping and dedup:
+        groups = duplicates.group_submissions(inputs)
+    else:
+        groups = [[input_name] for input_name in inputs]
+    output_of = dict(zip(inputs, outputs))
+    group_of = {group[0]: group for group in groups}
+    graded_inputs = [group[0] for group in groups]
+    graded_outputs = [output_of[input_name] for input_name in graded_inputs]
 
-        # Replace
-        log("generating: '{}'".format(output_name))
-        data = jflapgrader.run_tests(input_name, test_file, timeout)
-        with open(output_name, 'w') as f:
-            json.dump(data, f, indent=2)
+    # Now do the actual mapping.
+    if jobs > 1:
+        slots = multiprocessing.BoundedSemaphore(max_subprocesses)
+        results = grade_in_parallel(graded_inputs, graded_outputs, test_file,
+                                    options, jobs, slots)
+    else:
+        scheduler.set_subprocess_limit(max_subprocesses)
+        results = grade_in_sequence(graded_inputs, graded_outputs, test_file,
+                                    options)
+    start_time = time.monotonic()
+    failures = []
+    done = 0
+    for input_name, output_name, error in results:
+        group = group_of[input_name]
+        if error is None and len(group) > 1:
+            error = copy_results(output_name, group,
+                                 [output_of[member] for member in group],
+                                 timeout)
+        done += len(group)
+        if error is not None:
+            failures.extend(group)
+            print_stderr("{}: failed to grade '{}':\n{}"
+                         .format(NAME, ", ".join(group), error))
+        if jobs > 1:
+            elapsed = time.monotonic() - start_time
+            remaining = elapsed / done * (len(inputs) - done)
+            log("{}/{} done, {} failed, {} elapsed, ETA {}: '{}'"
+                .format(done, len(inputs), len(failures),
+                        format_duration(elapsed),
+                        format_duration(remaining), output_name))
+    if len(groups) < len(inputs):
+        groups_report(groups)
+    if profile:
+        # The copies would count the same timings several times.
+        profile_report(graded_outputs)
+    if failures:
+        error_and_exit("failed to grade {} of {} submissions: {}"
+                       .format(len(failures), len(inputs),
+                               ", ".join(failures)))
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""Native simulation of JFLAP context-free grammars.
+
+As in JFLAP, every symbol of a grammar is a single character, the
+variables are the capital letters and everything else is a terminal,
+and the start variable is the left side of the first production. A
+production with an empty right side derives the empty string.
+Grammars with anything other than a single variable on the left side
+of a production (unrestricted grammars) are left to jflaplib-cli.
+
+A word is in the language of a grammar if the CYK algorithm can parse
+it with the grammar converted to Chomsky normal form, apart from the
+empty word, which is in the language if the start variable can
+derive it. The table of the CYK algorithm for a word has a column for
+each of its prefixes, giving the variables that derive each of the
+suffixes of the prefix, so it only depends on the prefix. The test
+words are therefore parsed in sorted order, and each word only adds
+the columns for the part after the prefix it shares with the word
+before it. Most entries of the table are computed from the same pairs
+of sets of variables over and over, so the sets a pair of sets
+combines into are cached across all the words.
+"""
+
+import doctest
+import sys
+
+import automata
+
+
+# The number of pairs of sets of variables whose combination a
+# ContextFreeGrammar remembers. When there are more, it starts over.
+COMBINATION_CACHE_SIZE = 1 << 16
+
+
+def is_variable(symbol):
+    """Returns whether symbol is a variable in a JFLAP grammar.
+
+    >>> is_variable("S"), is_variable("a"), is_variable("1")
+    (True, False, False)
+    """
+    return "A" <= symbol <= "Z"
+
+
+def nullable_variables(productions):
+    """Returns the set of variables which derive the empty string in the
+    grammar with the given productions, each a pair (variable,
+    symbols)."""
+    nullable = set()
+    changed = True
+    while changed:
+        changed = False
+        for variable, symbols in productions:
+            if variable not in nullable and \
+                    all(symbol in nullable for symbol in symbols):
+                nullable.add(variable)
+                changed = True
+    return nullable
+
+
+class ContextFreeGrammar(object):
+    """A JFLAP context-free grammar.
+
+    The productions are pairs (variable, right), where right is a
+    string of symbols, and start is the start variable. Variables are
+    the symbols for which is_variable is true.
+
+    >>> # Generates a^n b^n for n >= 0.
+    >>> grammar = ContextFreeGrammar([("S", "aSb"), ("S", "")], "S")
+    >>> [word for word in ["", "ab", "aabb", "aab", "abb", "ba"]
+    ...  if grammar.simulate(word).accepted]
+    ['', 'ab', 'aabb']
+    >>> # Generates the words with as many a's as b's.
+    >>> grammar = ContextFreeGrammar([("S", "aSbS"), ("S", "bSaS"),
+    ...                               ("S", "")], "S")
+    >>> outcomes = grammar.simulate_all(["abba", "baab", "aab", "bbaaab"])
+    >>> sorted(word for word in outcomes if outcomes[word].accepted)
+    ['abba', 'baab', 'bbaaab']
+    """
+
+    def __init__(self, productions, start):
+        self.start = start
+        self.accepts_empty = start in nullable_variables(productions)
+        # Convert to Chomsky normal form (for the language without the
+        # empty word) in the order that keeps the grammar small: first
+        # replace terminals in long right sides by variables of their
+        # own, then break long right sides up into pairs, then remove
+        # lambda productions, and finally unit productions. The new
+        # variables are tuples, so they cannot clash with the old ones.
+        rules = []
+        for variable, right in productions:
+            symbols = [symbol if is_variable(symbol) or len(right) == 1
+                       else ("terminal", symbol) for symbol in right]
+            rules.extend((("terminal", symbol), [symbol])
+                         for symbol in right
+                         if not is_variable(symbol) and len(right) > 1)
+            while len(symbols) > 2:
+                rest = ("rest", len(rules))
+                rules.append((variable, [symbols[0], rest]))
+                variable, symbols = rest, symbols[1:]
+            rules.append((variable, symbols))
+        nullable = nullable_variables(rules)
+        variables = {variable for variable, _ in rules}
+        units = {variable: {variable} for variable in variables}
+        terminals = {}
+        pairs = {}
+        for variable, symbols in rules:
+            if len(symbols) == 1:
+                # Only the productions of the grammar itself are left
+                # with a single symbol, which is a one-character string.
+                if is_variable(symbols[0]):
+                    units[variable].add(symbols[0])
+                else:
+                    terminals.setdefault(symbols[0], set()).add(variable)
+            elif len(symbols) == 2:
+                first, second = symbols
+                pairs.setdefault((first, second), set()).add(variable)
+                if first in nullable and second in variables:
+                    units[variable].add(second)
+                if second in nullable and first in variables:
+                    units[variable].add(first)
+        # A variable derives everything that the variables it derives
+        # by unit productions derive, so close units transitively, and
+        # then find, for each variable, those that reach it.
+        changed = True
+        while changed:
+            changed = False
+            for variable, reached in units.items():
+                size = len(reached)
+                for other in list(reached):
+                    reached |= units.get(other, set())
+                changed = changed or len(reached) > size
+        reaching = {variable: set() for variable in variables}
+        for variable, reached in units.items():
+            for other in reached:
+                reaching.setdefault(other, set()).add(variable)
+        # Only keep the variables which can still be combined with
+        # others, or which are the start variable, in the table, so
+        # that more of its entries are equal.
+        useful = {symbol for pair in pairs for symbol in pair}
+        useful.add(start)
+
+        def lift(found):
+            return frozenset(variable for other in found
+                             for variable in reaching[other]
+                             if variable in useful)
+        self.terminals = {symbol: lift(found)
+                          for symbol, found in terminals.items()}
+        self.pairs = {}
+        for (first, second), found in pairs.items():
+            if first in variables and second in variables:
+                self.pairs.setdefault(first, {})[second] = lift(found)
+        self.combinations = {}
+
+    def combine(self, left, right):
+        """Returns the set of variables deriving a word made of a word
+        derived by a variable in left followed by one derived by a
+        variable in right."""
+        key = (left, right)
+        found = self.combinations.get(key)
+        if found is None:
+            parts = []
+            for first in left:
+                seconds = self.pairs.get(first)
+                if seconds:
+                    for second in right:
+                        part = seconds.get(second)
+                        if part:
+                            parts.append(part)
+            found = frozenset().union(*parts)
+            if len(self.combinations) >= COMBINATION_CACHE_SIZE:
+                self.combinations.clear()
+            self.combinations[key] = found
+        return found
+
+    def simulate(self, word):
+        """Returns the automata.Outcome of parsing word."""
+        return self.simulate_all([word])[word]
+
+    def simulate_all(self, words):
+        """Returns a dictionary mapping each of words to its
+        automata.Outcome. See the module docstring."""
+        empty = frozenset()
+        terminals = self.terminals
+        combine = self.combine
+        outcomes = {}
+        # columns[j][i] is the set of variables deriving previous[i:j+1].
+        columns = []
+        previous = ""
+        for word in sorted(set(words)):
+            shared = 0
+            limit = min(len(word), len(columns))
+            while shared < limit and word[shared] == previous[shared]:
+                shared += 1
+            del columns[shared:]
+            for end in range(shared, len(word)):
+                column = [empty] * (end + 1)
+                column[end] = terminals.get(word[end], empty)
+                for begin in range(end - 1, -1, -1):
+                    parts = [combine(columns[middle - 1][begin],
+                                     column[middle])
+                             for middle in range(begin + 1, end + 1)
+                             if columns[middle - 1][begin] and column[middle]]
+                    if parts:
+                        column[begin] = frozenset().union(*parts)
+                columns.append(column)
+            previous = word
+            if word:
+                outcomes[word] = automata.accepted(
+                    self.start in columns[-1][0])
+            else:
+                outcomes[word] = automata.accepted(self.accepts_empty)
+        return outcomes
+
+
+def read_grammar(structure):
+    """Builds a ContextFreeGrammar from the <structure> element of a JFLAP
+    file. Raises automata.UnsupportedMachineError if the grammar is not
+    context-free.
+
+    >>> grammar = automata.parse_jff('''<structure><type>grammar</type>
+    ...   <production><left>S</left><right>(S)S</right></production>
+    ...   <production><left>S</left><right/></production>
+    ... </structure>''')
+    >>> grammar.simulate("(()())").accepted, grammar.simulate("())").accepted
+    (True, False)
+    """
+    productions = []
+    for production in structure.iter("production"):
+        left = automata.element_text(production, "left")
+        if len(left) != 1 or not is_variable(left):
+            raise automata.UnsupportedMachineError(
+                "unrestricted production with left side '{}'".format(left))
+        productions.append((left, automata.element_text(production, "right")))
+    if not productions:
+        raise automata.InvalidMachineError("grammar has no productions")
+    return ContextFreeGrammar(productions, productions[0][0])
+
+
+automata.readers["grammar"] = read_grammar
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
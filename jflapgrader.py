@@ -1,15 +1,32 @@
 #!/usr/bin/env python3
 
 
+import contextlib
 import datetime
 import doctest
 import inspect
+import itertools
+import json
+import marshal
 import os
 import re
 import sys
+import threading
+import time
 
+try:
+    import resource
+except ImportError:
+    resource = None
 
-from command import Command
+
+import automata
+import cache
+from batch import BatchUnsupportedError, run_batch
+from command import Command, run_all
+import equivalence
+import scheduler
+import wordgen
 
 
 # The name of the plugin as it is displayed on the web interface. Note
@@ -70,18 +87,7 @@ def all_bitstrings(length):
     >>> sorted(list(all_bitstrings(6)), key=len_lex) == list(all_bitstrings(6))
     True
     """
-    if length >= 0:
-        yield ""
-    current = "0"
-    while len(current) <= length:
-        yield current
-        for j in range(len(current)):
-            i = len(current) - 1 - j
-            if current[i] == "0":
-                current = current[:i] + "1" + "0" * j
-                break
-            elif i == 0:
-                current = "0" * (len(current) + 1)
+    return wordgen.all_words("01", length)
 
 
 def split_with_quotes(string):
@@ -114,55 +120,61 @@ def split_with_quotes(string):
     StringError: invalid backslash escape "\'" in double-quoted string literal in: foo "bar\'" baz
     """
     groups = []
-    current_group = ""
-    quote = None
-    backslash = False
-    for char in string:
-        if quote is None:
-            if char == "'":
-                quote = "'"
-            elif char == '"':
-                quote = '"'
-            if char in "'\"" or char.isspace():
-                if current_group:
-                    groups.append(current_group)
-                    current_group = ""
-            else:
-                current_group += char
-        elif quote == "'":
-            if char == "'" and not backslash:
-                quote = None
-                groups.append(current_group)
-                current_group = ""
-            elif char == "\\" and not backslash:
-                backslash = True
-            elif backslash and char not in "'\\":
-                raise StringError("invalid backslash escape '\\{}' in"
-                                  " single-quoted string literal in: {}"
-                                  .format(char, string))
-            else:
-                current_group += char
-                backslash = False
-        elif quote == '"':
-            if char == '"' and not backslash:
-                quote = None
-                groups.append(current_group)
-                current_group = ""
-            elif char == "\\" and not backslash:
-                backslash = True
-            elif backslash and char not in '"\\':
-                raise StringError('invalid backslash escape "\\{}" in'
-                                  " double-quoted string literal in: {}"
-                                  .format(char, string))
-            else:
-                current_group += char
-                backslash = False
+    length = len(string)
+    i = 0
+    while i < length:
+        # Outside of quotes, tokens are separated by whitespace, and
+        # end at the next quote. Find the next quote and let str.split
+        # do the rest, rather than looking at every character here.
+        single = string.find("'", i)
+        double = string.find('"', i)
+        if single < 0:
+            start = double
+        elif double < 0:
+            start = single
         else:
-            # We only ever assign "quote" to be None, "'", or '"'.
-            # This branch should never be reached!
-            raise AssertionError
-    if current_group:
-        groups.append(current_group)
+            start = min(single, double)
+        if start < 0:
+            groups.extend(string[i:].split())
+            break
+        groups.extend(string[i:start].split())
+        quote = string[start]
+        quote_name = "single" if quote == "'" else "double"
+        # Now read the quoted string, a run of text at a time, up to
+        # the next quote or backslash.
+        parts = []
+        i = start + 1
+        while True:
+            end = string.find(quote, i)
+            backslash = string.find("\\", i, end if end >= 0 else length)
+            if backslash >= 0:
+                parts.append(string[i:backslash])
+                if backslash + 1 == length:
+                    # A backslash at the end of an unterminated quoted
+                    # string escapes nothing.
+                    i = length
+                    break
+                char = string[backslash + 1]
+                if char not in quote + "\\":
+                    raise StringError("invalid backslash escape {0}\\{1}{0} in"
+                                      " {2}-quoted string literal in: {3}"
+                                      .format(quote, char, quote_name,
+                                              string))
+                parts.append(char)
+                i = backslash + 2
+            elif end >= 0:
+                parts.append(string[i:end])
+                groups.append("".join(parts))
+                parts = None
+                i = end + 1
+                break
+            else:
+                # The quoted string is not terminated.
+                parts.append(string[i:])
+                i = length
+                break
+        if parts is not None and any(parts):
+            groups.append("".join(parts))
     return groups
 
 
@@ -210,7 +222,7 @@ def exception_linum(height=0):
     return inspect.getinnerframes(sys.exc_info()[2])[-1 - height][2]
 
 
-def parse_test_file_contents(contents):
+def parse_test_file_contents(contents, profile=None, oracle=None):
     r"""Parses the contents of a JFLAP test file.
 
     The contents of the test file should be provided as a multiline
@@ -265,7 +277,11 @@ def parse_test_file_contents(contents):
     You must use at least four-space indentation in function
     definitions, and they cannot contain any lines with only
     whitespace. In both "words" and "check", you will have access to
-    the function "all_bitstrings" defined above.
+    the function "all_bitstrings" defined above, and to the word
+    generators in the wordgen module: "all_words", "count_words",
+    "random_words", "sample_words" and "stratified_words", which
+    handle arbitrary alphabets, ranges of lengths, and seeded random
+    sampling.
 
     If you define "words", then it is called to obtain an iterable of
     input strings that will be used as test cases in addition to those
@@ -286,6 +302,15 @@ def parse_test_file_contents(contents):
     This version of the function is completely reverse compatible with
     old-style test files, with the aid of a CSS-like "quirks mode".
 
+    If oracle is given, it is called once, with a list of all the
+    input strings for which you did not provide a result keyword, to
+    determine their intended results instead of "check" (see the oracle
+    module). It returns a dictionary mapping each of them to whether it
+    should be accepted.
+
+    If profile (a Profile) is given, the time spent running "words",
+    and "check" or oracle, is recorded in it.
+
     >>> def normalize(tests):
     ...     def key(item):
     ...         return len_lex(item[0])
@@ -389,9 +414,67 @@ def parse_test_file_contents(contents):
         ...
     JFLAPTestFileParseError: malformed test case on line 3: invalid backslash escape "\d" in double-quoted string literal in: "malforme\d test case" -> reject
     """
-    # First we define the dictionary from inputs to results that will
-    # be returned at the end of this function.
-    tests = {}
+    return parse_test_lines(iter(contents.splitlines()), profile, oracle)
+
+
+# The size of the blocks in which read_lines reads files.
+READ_SIZE = 1 << 16
+
+# The characters at which str.splitlines splits lines.
+LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+
+
+def read_lines(f, size=READ_SIZE):
+    r"""Generates the lines of the text file object f, without their line
+    breaks, reading it in blocks of size characters. The lines are the
+    same as those given by f.read().splitlines(), but the whole file is
+    never in memory at once.
+
+    >>> import io
+    >>> list(read_lines(io.StringIO("a\r\nb\x0cc\n\nd"), size=2))
+    ['a', 'b', 'c', '', 'd']
+    """
+    carry = ""
+    while True:
+        block = f.read(size)
+        if not block:
+            break
+        text = carry + block
+        lines = text.splitlines()
+        last = text[-1]
+        if last not in LINE_BREAKS:
+            # The last line may continue in the next block.
+            carry = lines.pop()
+        elif last == "\r":
+            # And so may its line break, if it is "\r\n".
+            carry = lines.pop() + "\r"
+        else:
+            carry = ""
+        yield from lines
+    yield from carry.splitlines()
+
+
+def parse_test_file(f, profile=None, oracle=None):
+    r"""Parses a JFLAP test file from the text file object f, as
+    parse_test_file_contents would parse its contents, but reading it
+    a block at a time and in a single pass.
+
+    >>> import io
+    >>> parse_test_file(io.StringIO("0101 -> accept\n'' -> reject\n"))
+    {'0101': True, '': False}
+    """
+    return parse_test_lines(read_lines(f), profile, oracle)
+
+
+# The lines an old-style test file may have (see parse_test_lines).
+OLD_STYLE_LINE = re.compile(r"\s*\S*\s*(reject\s*)?$")
+
+
+def parse_test_lines(lines, profile=None, oracle=None):
+    """Parses a JFLAP test file given as an iterator over its lines,
+    without line breaks. See parse_test_file_contents for the format,
+    and for profile and oracle.
+    """
     # Now we check to see if the test file is an "old style" test
     # file, so that we can provide reverse compatibility. This is very
     # similar to "quirks mode" in browsers. It would be preferable, of
@@ -399,230 +482,248 @@ def parse_test_file_contents(contents):
     # with the "old style" syntax, but this is not feasible because
     # the "old style" syntax requires that any blank line add the test
     # case specifying that the empty string is to be accepted.
-    is_old_style = True
-    for line in contents.splitlines():
-        if not re.match(r"\s*\S*\s*(reject\s*)?$", line):
-            is_old_style = False
+    #
+    # We only find out which it is when we reach a line an old-style
+    # file couldn't have, so hold on to the lines until then, and
+    # afterwards parse them and the rest of the file as the new style.
+    pending = []
+    match = OLD_STYLE_LINE.match
+    for line in lines:
+        if not match(line):
             break
-    # Now we actually parse the file contents.
-    if is_old_style:
-        for line in contents.splitlines():
-            line = line.strip()
-            should_reject = line.endswith("reject")
-            if should_reject:
-                line = line[:-len("reject")]
-                line = line.rstrip()
-                word = line
-                tests[word] = False
-            else:
-                tests[line] = True
+        pending.append(line)
     else:
-        # We define a dictionary with the same keys as "tests", but
-        # with the values being the numbers of the lines on which the
-        # respective inputs have test cases defined. This allows us to
-        # provide a more useful error message when there are duplicate
-        # definitions.
-        test_linums = {}
-        # Possible states are "standard" (reading manual test
-        # specifications), "reading_words_definition" (reading the
-        # definition of the "words" function), and
-        # "reading_check_definition" (reading the definition of the
-        # "check" function).
-        state = "standard"
-        # Lists of lines in the definitions of the "words" and "check"
-        # functions.
-        words_code_lines = []
-        check_code_lines = []
-        # Start line numbering from 1.
-        for linum, line in enumerate(contents.splitlines(), 1):
-            # Trim trailing whitespace. Note that we can't trim
-            # leading whitespace, because this would break any
-            # embedded Python function definitions.
+        return parse_old_style_lines(pending)
+    return parse_new_style_lines(
+        itertools.chain(pending, [line], lines), profile, oracle)
+
+
+def parse_old_style_lines(lines):
+    """Parses the lines of an old-style test file (see parse_test_lines).
+
+    >>> parse_old_style_lines(["0", "01 reject", ""])
+    {'0': True, '01': False, '': True}
+    """
+    tests = {}
+    for line in lines:
+        line = line.strip()
+        should_reject = line.endswith("reject")
+        if should_reject:
+            line = line[:-len("reject")]
             line = line.rstrip()
-            if state == "reading_words_definition":
-                if len(words_code_lines) >= 2:
-                    body_line = words_code_lines[1]
-                    indent_depth = len(body_line) - len(body_line.lstrip())
-                    indent = re.escape(body_line[:indent_depth])
-                else:
-                    def_line = words_code_lines[0]
-                    indent_depth = len(def_line) - len(def_line.lstrip())
-                    indent = r"\s" * (indent_depth + 1)
-                # We assume that function declarations have ended when
-                # we find a line that isn't indented. But we allow
-                # blank lines, even if they are not indented.
-                if re.match(indent, line) or not line:
-                    words_code_lines.append(line)
-                else:
-                    state = "standard"
-            elif state == "reading_check_definition":
-                if len(check_code_lines) >= 2:
-                    body_line = check_code_lines[1]
-                    indent_depth = len(body_line) - len(body_line.lstrip())
-                    indent = re.escape(body_line[:indent_depth])
-                else:
-                    def_line = check_code_lines[0]
-                    indent_depth = len(def_line) - len(def_line.lstrip())
-                    indent = r"\s" * (indent_depth + 1)
-                if re.match(indent, line) or not line:
-                    check_code_lines.append(line)
-                else:
-                    state = "standard"
-            # Skip empty lines and comments, but not inside function
-            # definitions (that would mess up the line numbers
-            # reported in error messages).
-            if not line or line.lstrip().startswith("#"):
-                continue
-            if state == "standard":
-                if re.match(r"\s*def words\(", line):
-                    # Only allow one definition of each function.
-                    if words_code_lines:
-                        # If words_code_lines is non-empty, then we must
-                        # have already run the "else" branch of this "if"
-                        # statement at least once, we know that
-                        # words_definition_linum will be defined.
-                        error = ("duplicate definitions of 'words' on lines {}"
-                                 " and {}"
-                                 .format(words_definition_linum, linum))
-                        raise JFLAPTestFileParseError(error)
-                    else:
-                        words_code_lines.append(line)
-                        words_definition_linum = linum
-                        state = "reading_words_definition"
-                elif re.match(r"\s*def check\(", line):
-                    if check_code_lines:
-                        # If check_code_lines is non-empty, then we must
-                        # have already run the "else" branch of this "if"
-                        # statement at least once, we know that
-                        # check_definition_linum will be defined.
-                        error = ("duplicate definitions of 'check' on lines {}"
-                                 " and {}"
-                                 .format(check_definition_linum, linum))
-                        raise JFLAPTestFileParseError(error)
-                    else:
-                        check_code_lines.append(line)
-                        check_definition_linum = linum
-                        state = "reading_check_definition"
-                    continue
-                else:
-                    try:
-                        groups = split_with_quotes(line)
-                    except StringError as e:
-                        error = ("malformed test case on line {}: {}"
-                                 .format(linum, str(e)))
-                        raise JFLAPTestFileParseError(error)
-                    if not groups:
-                        # If we don't have any groups, the line must
-                        # be whitespace-only or empty. But we skip
-                        # such lines earlier, so this can't happen!
-                        raise AssertionError
-                    word = groups[0]
-                    if len(groups) == 1:
-                        if word not in tests:
-                            tests[word] = None
-                    else:
-                        # The last token should be a prefix of one or
-                        # more "reject" keywords or one or more
-                        # "accept" keywords. If it's both or neither,
-                        # we have a problem.
-                        result_prefix = groups[-1].lower()
-                        reject_kword_match = None
-                        accept_kword_match = None
-                        for result_kword, should_accept in result_kwords.items():
-                            if result_kword.startswith(result_prefix):
-                                if should_accept:
-                                    accept_kword_match = result_kword
-                                else:
-                                    reject_kword_match = result_kword
-                        if not (accept_kword_match or reject_kword_match):
-                            error = ("result specifier '{}' on line {} does"
-                                     " not match any of the valid result"
-                                     " specifiers, which are: {}"
-                                     .format(result_prefix, linum,
-                                             ", ".join("'{}'".format(kword)
-                                                       for kword in result_kwords.keys())))
-                            raise JFLAPTestFileParseError(error)
-                        elif accept_kword_match and reject_kword_match:
-                            error = ("result specifier '{}' on line {} is"
-                                     " ambiguous, could match either '{}'"
-                                     " or '{}'"
-                                     .format(result_prefix, linum,
-                                             accept_kword_match,
-                                             reject_kword_match))
-                            raise JFLAPTestFileParseError(error)
-                        else:
-                            should_accept = result_kwords[accept_kword_match or
-                                                          reject_kword_match]
-                            # Use "is" because we're comparing
-                            # singleton values.
-                            if (tests.get(word, None) not in (None, should_accept)):
-                                error = ("test case on line {} specifies that"
-                                         " input string '{}' should be {}, but"
-                                         " test case on line {} specifies that"
-                                         " it should be {}"
-                                         .format(test_linums[word],
-                                                 word,
-                                                 result_to_str(not should_accept),
-                                                 linum,
-                                                 result_to_str(should_accept)))
-                                raise JFLAPTestFileParseError(error)
-                            tests[word] = should_accept
-                            test_linums[word] = linum
-        # Using a custom namespace is the preferred way to extract a
-        # declared variable from an 'exec' call.
-        #
-        # Note that this also has the effect of preventing the code in
-        # the test file from reading from or writing to the actual
-        # global or local namespaces of this script, which is good.
-        #
-        # We do, however, want to make "all_bitstrings" available to
-        # the test file's inline functions (in particular, to
-        # "words"), hence the initial value of "namespace".
-        namespace = {"all_bitstrings": all_bitstrings,
-                     # If there are test cases without explicit results
-                     # defined, and "check" is not defined in the test
-                     # file, then we want to set those test cases to
-                     # "accept".
-                     "check": lambda word: True}
-        # If one of the lists is empty, then the corresponding call is
-        # a no-op. There's no need to check first.
+            word = line
+            tests[word] = False
+        else:
+            tests[line] = True
+    return tests
+
+
+def result_of(result_prefix, linum):
+    """Returns whether the result specifier result_prefix, in lower case,
+    on line linum of a test file means the input string should be
+    accepted.
+
+    >>> result_of("acc", 1), result_of("n", 2)
+    (True, False)
+    >>> result_of("maybe", 3)
+    Traceback (most recent call last):
+        ...
+    JFLAPTestFileParseError: result specifier 'maybe' on line 3 does not match any of the valid result specifiers, which are: 'accepted', 'accepts', 'yes', 'good', 'ok', 'rejected', 'rejects', 'no', 'bad'
+    """
+    # The specifier should be a prefix of one or more "reject"
+    # keywords or one or more "accept" keywords. If it's both or
+    # neither, we have a problem.
+    reject_kword_match = None
+    accept_kword_match = None
+    for result_kword, should_accept in result_kwords.items():
+        if result_kword.startswith(result_prefix):
+            if should_accept:
+                accept_kword_match = result_kword
+            else:
+                reject_kword_match = result_kword
+    if not (accept_kword_match or reject_kword_match):
+        error = ("result specifier '{}' on line {} does"
+                 " not match any of the valid result"
+                 " specifiers, which are: {}"
+                 .format(result_prefix, linum,
+                         ", ".join("'{}'".format(kword)
+                                   for kword in result_kwords.keys())))
+        raise JFLAPTestFileParseError(error)
+    elif accept_kword_match and reject_kword_match:
+        error = ("result specifier '{}' on line {} is"
+                 " ambiguous, could match either '{}'"
+                 " or '{}'"
+                 .format(result_prefix, linum,
+                         accept_kword_match,
+                         reject_kword_match))
+        raise JFLAPTestFileParseError(error)
+    return result_kwords[accept_kword_match or reject_kword_match]
+
+
+def parse_new_style_lines(lines, profile=None, oracle=None):
+    """Parses the lines of a new-style test file, running its "words" and
+    "check" functions (or oracle). See parse_test_file_contents for the
+    format, and for profile and oracle.
+    """
+    # First we define the dictionary from inputs to results that will
+    # be returned at the end of this function.
+    tests = {}
+    # We define a dictionary with the same keys as "tests", but with
+    # the values being the numbers of the lines on which the
+    # respective inputs have test cases defined. This allows us to
+    # provide a more useful error message when there are duplicate
+    # definitions.
+    test_linums = {}
+    # The lines in the definitions of the "words" and "check"
+    # functions, and the numbers of the lines on which they start.
+    code_lines = {"words": [], "check": []}
+    definition_linums = {}
+    # The name of the function whose definition is being read, if
+    # any. Until we have seen the first line of its body, a line
+    # belongs to it if it is indented further than the "def" line;
+    # after that, if it starts with the same indentation as that
+    # first line.
+    reading = None
+    def_depth = 0
+    indent = ""
+    # The meaning of each result specifier seen so far, since there
+    # are usually only a handful of distinct ones.
+    results = {}
+    # Start line numbering from 1.
+    for linum, line in enumerate(lines, 1):
+        # Trim trailing whitespace. Note that we can't trim leading
+        # whitespace, because this would break any embedded Python
+        # function definitions.
+        line = line.rstrip()
+        stripped = line.lstrip()
+        if reading is not None:
+            function_lines = code_lines[reading]
+            if len(function_lines) >= 2:
+                indented = line.startswith(indent)
+            else:
+                indented = len(line) - len(stripped) > def_depth
+            # We assume that function declarations have ended when we
+            # find a line that isn't indented. But we allow blank
+            # lines, even if they are not indented.
+            if indented or not line:
+                function_lines.append(line)
+                if len(function_lines) == 2:
+                    indent = line[:len(line) - len(stripped)]
+            else:
+                reading = None
+        # Skip empty lines and comments, but not inside function
+        # definitions (that would mess up the line numbers reported in
+        # error messages).
+        if not line or stripped.startswith("#") or reading is not None:
+            continue
+        if stripped.startswith(("def words(", "def check(")):
+            name = stripped[len("def "):len("def words")]
+            # Only allow one definition of each function.
+            if code_lines[name]:
+                error = ("duplicate definitions of '{}' on lines {}"
+                         " and {}"
+                         .format(name, definition_linums[name], linum))
+                raise JFLAPTestFileParseError(error)
+            code_lines[name].append(line)
+            definition_linums[name] = linum
+            reading = name
+            def_depth = len(line) - len(stripped)
+            continue
         try:
-            exec("\n".join(words_code_lines), namespace)
-        except SyntaxError as e:
-            error = ("syntax error in definition of 'words' on line {}: {}: {}"
-                     .format(words_definition_linum + (e.lineno - 1),
-                             exception_name(e),
-                             e.msg))
-            raise JFLAPTestFileParseError(error)
-        except Exception as e:
-            error = ("error in definition of 'words' on line {}: {}: {}"
-                     .format(words_definition_linum + (exception_linum() - 1),
-                             exception_name(e),
-                             e.msg))
+            groups = split_with_quotes(line)
+        except StringError as e:
+            error = ("malformed test case on line {}: {}"
+                     .format(linum, str(e)))
             raise JFLAPTestFileParseError(error)
-        try:
-            exec("\n".join(check_code_lines), namespace)
-        except SyntaxError as e:
-            error = ("syntax error in definition of 'check' on line {}: {}: {}"
-                     .format(check_definition_linum + (e.lineno - 1),
-                             exception_name(e),
-                             e.msg))
+        if not groups:
+            # If we don't have any groups, the line must be
+            # whitespace-only or empty. But we skip such lines
+            # earlier, so this can't happen!
+            raise AssertionError
+        word = groups[0]
+        if len(groups) == 1:
+            if word not in tests:
+                tests[word] = None
+            continue
+        result_prefix = groups[-1].lower()
+        should_accept = results.get(result_prefix)
+        if should_accept is None:
+            should_accept = result_of(result_prefix, linum)
+            results[result_prefix] = should_accept
+        # Use "is" because we're comparing singleton values.
+        if (tests.get(word, None) not in (None, should_accept)):
+            error = ("test case on line {} specifies that"
+                     " input string '{}' should be {}, but"
+                     " test case on line {} specifies that"
+                     " it should be {}"
+                     .format(test_linums[word],
+                             word,
+                             result_to_str(not should_accept),
+                             linum,
+                             result_to_str(should_accept)))
             raise JFLAPTestFileParseError(error)
-        except Exception as e:
-            error = ("error in definition of 'check' on line {}: {}: {}"
-                     .format(check_definition_linum + (exception_linum() - 1),
-                             exception_name(e),
-                             e.msg))
+        tests[word] = should_accept
+        test_linums[word] = linum
+    words_definition_linum = definition_linums.get("words")
+    check_definition_linum = definition_linums.get("check")
+    # Using a custom namespace is the preferred way to extract a
+    # declared variable from an 'exec' call.
+    #
+    # Note that this also has the effect of preventing the code in
+    # the test file from reading from or writing to the actual
+    # global or local namespaces of this script, which is good.
+    #
+    # We do, however, want to make "all_bitstrings" and the word
+    # generators available to the test file's inline functions
+    # (in particular, to "words"), hence the initial value of
+    # "namespace".
+    namespace = dict(wordgen.test_file_namespace,
+                     all_bitstrings=all_bitstrings,
+                     # If there are test cases without explicit
+                     # results defined, and "check" is not defined
+                     # in the test file, then we want to set those
+                     # test cases to "accept".
+                     check=lambda word: True)
+    # If one of the lists is empty, then the corresponding call is
+    # a no-op. There's no need to check first.
+    try:
+        exec("\n".join(code_lines["words"]), namespace)
+    except SyntaxError as e:
+        error = ("syntax error in definition of 'words' on line {}: {}: {}"
+                 .format(words_definition_linum + (e.lineno - 1),
+                         exception_name(e),
+                         e.msg))
+        raise JFLAPTestFileParseError(error)
+    except Exception as e:
+        error = ("error in definition of 'words' on line {}: {}: {}"
+                 .format(words_definition_linum + (exception_linum() - 1),
+                         exception_name(e),
+                         e.msg))
+        raise JFLAPTestFileParseError(error)
+    try:
+        exec("\n".join(code_lines["check"]), namespace)
+    except SyntaxError as e:
+        error = ("syntax error in definition of 'check' on line {}: {}: {}"
+                 .format(check_definition_linum + (e.lineno - 1),
+                         exception_name(e),
+                         e.msg))
+        raise JFLAPTestFileParseError(error)
+    except Exception as e:
+        error = ("error in definition of 'check' on line {}: {}: {}"
+                 .format(check_definition_linum + (exception_linum() - 1),
+                         exception_name(e),
+                         e.msg))
+        raise JFLAPTestFileParseError(error)
+    if code_lines["words"]:
+        words_fn = namespace["words"]
+        required_arg_count = len(inspect.getfullargspec(words_fn).args)
+        if required_arg_count != 0:
+            error = ("'words' must be a function of no arguments, but"
+                     " it is defined with {} required arguments"
+                     " (on line {})"
+                     .format(required_arg_count, words_definition_linum))
             raise JFLAPTestFileParseError(error)
-        if words_code_lines:
-            words_fn = namespace["words"]
-            required_arg_count = len(inspect.getargspec(words_fn).args)
-            if required_arg_count != 0:
-                error = ("'words' must be a function of no arguments, but"
-                         " it is defined with {} required arguments"
-                         " (on line {})"
-                         .format(required_arg_count, words_definition_linum))
-                raise JFLAPTestFileParseError(error)
+        with Profile.phase_of(profile, "loadTests/words"):
             try:
                 words = words_fn()
             except Exception as e:
@@ -636,13 +737,27 @@ def parse_test_file_contents(contents):
                 # "words".
                 if word not in tests:
                     tests[word] = None
-        check_fn = namespace["check"]
-        required_arg_count = len(inspect.getargspec(check_fn).args)
-        if required_arg_count != 1:
-            error = ("'check' must be a function of one argument, but"
-                     " it is defined with {} required arguments (on line {})"
-                     .format(required_arg_count, check_definition_linum))
-            raise JFLAPTestFileParseError(error)
+    check_fn = namespace["check"]
+    required_arg_count = len(inspect.getfullargspec(check_fn).args)
+    if required_arg_count != 1:
+        error = ("'check' must be a function of one argument, but"
+                 " it is defined with {} required arguments (on line {})"
+                 .format(required_arg_count, check_definition_linum))
+        raise JFLAPTestFileParseError(error)
+    if oracle is not None:
+        with Profile.phase_of(profile, "loadTests/oracle"):
+            unresolved = [word for word, result in tests.items()
+                          if result is None]
+            if unresolved:
+                try:
+                    tests.update(oracle(unresolved))
+                except Exception as e:
+                    error = ("error while computing expected results with"
+                             " the oracle: {}: {}"
+                             .format(exception_name(e), str(e)))
+                    raise JFLAPTestFileParseError(error)
+        return tests
+    with Profile.phase_of(profile, "loadTests/check"):
         for word, result in tests.items():
             # Only call "check" if the desired result has not been
             # manually specified.
@@ -662,106 +777,222 @@ def parse_test_file_contents(contents):
 # API functions
 
 
+def cpu_time():
+    """Returns the CPU time, in seconds, used by this process and by those
+    of its subprocesses which have exited."""
+    seconds = time.process_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        seconds += children.ru_utime + children.ru_stime
+    return seconds
+
+
+class Profile(object):
+    """Timings collected by run_tests, for the "profile" entry of the
+    "info" section.
+
+    phases maps the name of each phase of grading to its wall-clock and
+    CPU time in seconds (with subprocesses included in the CPU time
+    once they have exited). Phases inside other phases are named
+    "outer/inner". tests maps words to the wall-clock time of their
+    simulation, and where available its CPU time and how long it took
+    to start a subprocess for it; workers lists, for each time a batch
+    worker was started, how long starting the process took and how
+    long it then took to become ready.
+
+    >>> profile = Profile()
+    >>> with profile.phase("simulate"):
+    ...     pass
+    >>> sorted(profile.phases["simulate"])
+    ['cpu', 'wall']
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.tests = {}
+        self.workers = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager which adds the time spent in its block to the
+        phase called name."""
+        wall = time.perf_counter()
+        cpu = cpu_time()
+        try:
+            yield
+        finally:
+            times = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+            times["wall"] += time.perf_counter() - wall
+            times["cpu"] += cpu_time() - cpu
+
+    @staticmethod
+    def phase_of(profile, name):
+        """Returns profile.phase(name), or a context manager which does
+        nothing if profile is None."""
+        if profile is None:
+            return contextlib.nullcontext()
+        return profile.phase(name)
+
+    def test(self, word, wall, cpu=None, spawn=None):
+        """Records the time taken by the simulation of word."""
+        self.tests[word] = {"wall": wall, "cpu": cpu, "spawn": spawn}
+
+    def as_dict(self, did_not_terminate):
+        """Returns the "profile" entry of the "info" section, given the
+        number of tests that did not terminate (because they timed out,
+        ran out of a native engine's budget, or the submission was too
+        large to compare with a reference)."""
+        return {
+            "phases": self.phases,
+            "tests": self.tests,
+            "workers": self.workers,
+            "didNotTerminate": did_not_terminate,
+        }
+
+
 class CouldNotRunJFLAPTestsError(Exception):
     """Exception thrown when none of the JFLAP tests could be run, due to
     an error."""
     pass
 
 
-def run_tests(jflap_file, test_file, timeout=None):
-    """Run tests from test_file on jflap_file.
+def jflaplib_command(jflap_file, word):
+    """Returns the Command that runs jflaplib-cli on jflap_file with the
+    given input string."""
+    # We'll need to figure out the directory containing this Python
+    # file, so we can find jflaplib-cli.jar.
+    script_directory = os.path.split(__file__)[0]
+    # Note that the command-line parsing library used by jflaplib-cli,
+    # JCommander, has an odd quirk in the way it parses arguments.
+    # First it trims whitespace from both ends of each argument, and
+    # then it removes a pair of double quotes if one exists. So, to
+    # ensure an argument is interpreted literally, we just wrap it in
+    # double quotes! See [1] for discussion of this issue.
+    #
+    # [1]: https://github.com/cbeust/jcommander/issues/306
+    return Command(["java",
+                    # The following system property prevents the Java
+                    # process from showing up in the Mac app switcher,
+                    # which is extremely annoying.
+                    "-Dapple.awt.UIElement=true",
+                    "-jar",
+                    os.path.join(script_directory, "jflaplib-cli.jar"),
+                    "run",
+                    jflap_file,
+                    '"{}"'.format(word)])
 
-    The timeout for each test is given by timeout, in seconds. If not
-    given, there is no timeout.
 
-    The return value is of the format given in the README.
+def jflaplib_jar():
+    """Returns the path of jflaplib-cli.jar, next to this file."""
+    return os.path.join(os.path.split(__file__)[0], "jflaplib-cli.jar")
+
+
+# The jflaplib-cli.jar files which could not be started as batch
+# workers in this process, mapped to the error, so that each is only
+# tried once rather than once per submission.
+batch_unsupported = {}
+
+
+def jflaplib_batch_command(jflap_file):
+    """Returns the argument list that starts jflaplib-cli as a worker for
+    jflap_file speaking the protocol described in the batch module."""
+    return ["java",
+            "-Dapple.awt.UIElement=true",
+            "-jar",
+            jflaplib_jar(),
+            "batch",
+            jflap_file]
+
+
+def jflaplib_outcome(stdout, stderr, timed_out):
+    r"""Interprets the output of a jflaplib-cli run as an automata.Outcome.
+
+    >>> jflaplib_outcome("true\n", "", False)
+    Outcome(accepted=True, terminated=True, valid=True)
+    >>> jflaplib_outcome("", "Exception in thread", False)
+    Outcome(accepted=None, terminated=True, valid=False)
+    >>> jflaplib_outcome("", "", True)
+    Outcome(accepted=None, terminated=False, valid=None)
     """
-    with open(test_file) as f:
-        try:
-            tests = parse_test_file_contents(f.read())
-        except JFLAPTestFileParseError as e:
-            error = ("Could not parse test file '{}': {}"
-                     .format(test_file, str(e)))
-            raise CouldNotRunJFLAPTestsError(error)
-        test_results = {}
-        # We'll also need to figure out the directory containing
-        # this Python file, so we can find jflaplib-cli.jar.
-        script_directory = os.path.split(__file__)[0]
-        for word, should_accept in tests.items():
-            print("testing ", word)
-            # Note that the command-line parsing library used by
-            # jflaplib-cli, JCommander, has an odd quirk in the
-            # way it parses arguments. First it trims whitespace
-            # from both ends of each argument, and then it removes
-            # a pair of double quotes if one exists. So, to ensure
-            # an argument is interpreted literally, we just wrap
-            # it in double quotes! See [1] for discussion of this
-            # issue.
-            #
-            # [1]: https://github.com/cbeust/jcommander/issues/306
-            command = Command(["java",
-                               # The following system property
-                               # prevents the Java process from
-                               # showing up in the Mac app
-                               # switcher, which is extremely
-                               # annoying.
-                               "-Dapple.awt.UIElement=true",
-                               "-jar",
-                               os.path.join(script_directory,
-                                            "jflaplib-cli.jar"),
-                               "run",
-                               jflap_file,
-                               '"{}"'.format(word)])
-            return_code, stdout, stderr, timed_out = command.run(
-                timeout=timeout,
-                env=os.environ)
-            if timed_out:
-                test_results[word] = {
-                    "expected": should_accept,
-                    "actual": None,
-                    "terminated": False,
-                    "valid": None,
-                    "correct": None,
-                    "passed": False,
-                    "output": {
-                        "stdout": stdout,
-                        "stderr": stderr,
-                    },
-                }
-            else:
-                # jflaplib-cli should print "true" or "false",
-                # depending on whether the NFA or Turing
-                # machine accepted or rejected the input. But
-                # we handle all the possible edge cases here,
-                # just in case.
-                contains_true = "true" in stdout
-                contains_false = "false" in stdout
-                if contains_true is contains_false:
-                    test_results[word] = {
-                        "expected": should_accept,
-                        "actual": None,
-                        "terminated": True,
-                        "valid": False,
-                        "correct": None,
-                        "passed": False,
-                        "output": {
-                            "stdout": stdout,
-                            "stderr": stderr,
-                        },
-                    }
-                else:
-                    test_results[word] = {
-                        "expected": should_accept,
-                        "actual": contains_true,
-                        "terminated": True,
-                        "valid": True,
-                        "correct": contains_true is should_accept,
-                        "passed": contains_true is should_accept,
-                        "output": {
-                            "stdout": stdout,
-                            "stderr": stderr,
-                        },
-                    }
+    if timed_out:
+        return automata.Outcome(None, terminated=False, valid=None,
+                                stdout=stdout, stderr=stderr)
+    # jflaplib-cli should print "true" or "false", depending on
+    # whether the NFA or Turing machine accepted or rejected the
+    # input. But we handle all the possible edge cases here, just in
+    # case.
+    contains_true = "true" in stdout
+    contains_false = "false" in stdout
+    if contains_true is contains_false:
+        return automata.Outcome(None, terminated=True, valid=False,
+                                stdout=stdout, stderr=stderr)
+    return automata.Outcome(contains_true, stdout=stdout, stderr=stderr)
+
+
+def is_verdict(line):
+    """Returns whether a line of output from jflaplib-cli is its verdict,
+    after which there is no need to wait for the JVM to exit.
+
+    >>> is_verdict("true"), is_verdict(" false "), is_verdict("Trace: true")
+    (True, True, False)
+    """
+    return line.strip() in ("true", "false")
+
+
+def run_jflaplib(jflap_file, word, timeout=None):
+    """Runs jflaplib-cli on jflap_file with the given input string and
+    returns the automata.Outcome."""
+    command = jflaplib_command(jflap_file, word)
+    return_code, stdout, stderr, timed_out = command.run(
+        timeout=timeout,
+        until=is_verdict,
+        env=os.environ)
+    return jflaplib_outcome(stdout, stderr, timed_out)
+
+
+def test_result(should_accept, outcome):
+    """Returns the entry for one test in the "tests" section of the
+    output of run_tests, given the expected result and the
+    automata.Outcome of the simulation.
+    """
+    if outcome.valid:
+        correct = outcome.accepted is should_accept
+    else:
+        correct = None
+    return {
+        "expected": should_accept,
+        "actual": outcome.accepted,
+        "terminated": outcome.terminated,
+        "valid": outcome.valid,
+        "correct": correct,
+        "passed": correct is True,
+        "output": {
+            "stdout": outcome.stdout,
+            "stderr": outcome.stderr,
+        },
+    }
+
+
+def rejudge(should_accept, entry):
+    """Returns the entry for a test in the "tests" section of the output
+    of run_tests, given an entry for the same word from an earlier run
+    whose expected result may have been different.
+
+    >>> entry = test_result(True, automata.accepted(False))
+    >>> entry["passed"], rejudge(False, entry)["passed"]
+    (False, True)
+    """
+    if entry["expected"] == should_accept:
+        return entry
+    return test_result(should_accept, automata.Outcome(
+        entry["actual"], terminated=entry["terminated"],
+        valid=entry["valid"], stdout=entry["output"]["stdout"],
+        stderr=entry["output"]["stderr"]))
+
+
+def summarize(test_results):
+    """Returns the "summary" section of the output of run_tests, given
+    the "tests" section."""
     summary = {
         "testsAll": [],
         "testsTerminated": [],
@@ -793,18 +1024,476 @@ def run_tests(jflap_file, test_file, timeout=None):
             summary["testsFailed"].append(test)
         else:
             raise AssertionError("non-boolean value for 'passed'")
+    return summary
+
+
+# The version of parse_test_file, which is part of the key for
+# compiled test sets. Bump it whenever parsing could give a different
+# result for the same file.
+TEST_FORMAT_VERSION = "1"
+
+
+# Test sets compiled in this process, by the digest of the test file.
+compiled_tests = {}
+
+
+def load_tests(test_file, test_cache=None, refresh=False, profile=None,
+               oracle=None):
+    """Returns the dictionary of tests in test_file, as parsed by
+    parse_test_file.
+
+    The result is remembered for the rest of the process, and if
+    test_cache (a cache.TestSetCache) is given, also stored there, in
+    both cases keyed by the contents of the test file. So a test file
+    is only parsed, and its "words" and "check" functions run, once per
+    version of it. (This assumes "words" and "check" are
+    deterministic.) If refresh is true, test_cache is not looked in,
+    but a test file is still only parsed once per process. profile is
+    passed on to parse_test_file.
+
+    If oracle is given, it is passed on to parse_test_file to compute
+    the expected results "check" would otherwise give, and its key
+    becomes part of the key of the test set, so the expected results
+    are cached along with the test file they complete.
+
+    The file is hashed, and if need be parsed with parse_test_file, a
+    block at a time, so it is never all in memory.
+
+    Raises CouldNotRunJFLAPTestsError if the file cannot be parsed.
+    """
+    key_parts = [cache.file_digest(test_file), TEST_FORMAT_VERSION,
+                 marshal.version]
+    if oracle is not None:
+        key_parts.append(oracle.key())
+    key = cache.digest(*key_parts)
+    tests = compiled_tests.get(key)
+    if tests is None and test_cache is not None and not refresh:
+        tests = test_cache.get(key)
+    if tests is None:
+        try:
+            with open(test_file) as f:
+                tests = parse_test_file(f, profile, oracle)
+        except JFLAPTestFileParseError as e:
+            error = ("Could not parse test file '{}': {}"
+                     .format(test_file, str(e)))
+            raise CouldNotRunJFLAPTestsError(error)
+        if test_cache is not None:
+            test_cache.put(key, tests)
+    compiled_tests[key] = tests
+    # Callers are free to modify the dictionary they get.
+    return dict(tests)
+
+
+jflaplib_version = None
+
+
+def grader_version():
+    """Returns a value identifying the version of everything that can
+    affect grading results: the native engines and jflaplib-cli.jar."""
+    global jflaplib_version
+    if jflaplib_version is None:
+        try:
+            jflaplib_version = cache.file_digest(jflaplib_jar())
+        except OSError:
+            jflaplib_version = ""
+    return {"engine": automata.ENGINE_VERSION, "jflaplib": jflaplib_version}
+
+
+def submission_results_key(contents, timeout=None, native=True):
+    """Returns the key identifying the results run_tests gives, with the
+    given options, for a submission whose file has the given contents:
+    the "resultsKey" entry of their "info" section."""
+    return cache.digest(contents, grader_version(),
+                        {"timeout": timeout, "native": native})
+
+
+class ResultStream(object):
+    """A log of test results as they finish, in NDJSON format (one JSON
+    object per line), from which an interrupted run of run_tests can be
+    resumed.
+
+    The first line is a header, {"key": key}, where key identifies the
+    submission and everything else that affects its results. Each
+    following line is {"word": word, "engine": engine, "test": entry},
+    where entry is as in the "tests" section of the output of
+    run_tests. If the file at path already has a header with the same
+    key, the results in it are loaded into the results and engines
+    dictionaries (keyed by word) and new results are appended to it;
+    otherwise it is started afresh. A last line cut off halfway through
+    is discarded.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "results.ndjson")
+    >>> stream = ResultStream(path, "abc")
+    >>> stream.write("01", "native", {"passed": True})
+    >>> stream.close()
+    >>> with open(path, "a") as f:
+    ...     _ = f.write('{"word": "1')
+    >>> stream = ResultStream(path, "abc")
+    >>> stream.results, stream.engines
+    ({'01': {'passed': True}}, {'01': 'native'})
+    >>> stream.close()
+    >>> ResultStream(path, "xyz").results
+    {}
+    """
+
+    def __init__(self, path, key):
+        self.results = {}
+        self.engines = {}
+        self.lock = threading.Lock()
+        # The number of bytes at the start of the file that hold
+        # complete lines for this key.
+        valid = 0
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        if not line.endswith(b"\n"):
+                            break
+                        if valid == 0:
+                            if record["key"] != key:
+                                break
+                        else:
+                            word = record["word"]
+                            self.results[word] = record["test"]
+                            self.engines[word] = record["engine"]
+                    except (ValueError, TypeError, KeyError):
+                        break
+                    valid += len(line)
+        except OSError:
+            pass
+        if valid:
+            self.file = open(path, "r+b")
+            self.file.truncate(valid)
+            self.file.seek(valid)
+        else:
+            self.file = open(path, "wb")
+            self.append({"key": key})
+
+    def append(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record).encode("utf-8") + b"\n")
+            self.file.flush()
+
+    def write(self, word, engine, entry):
+        """Appends the result of one test."""
+        self.append({"word": word, "engine": engine, "test": entry})
+
+    def close(self):
+        self.file.close()
+
+
+def simulate_tests(jflap_file, machine, tests, test_results, timeout, batch,
+                   jobs, finish, timings):
+    """Simulates the tests (a dictionary mapping words to expected results)
+    which don't have results in test_results yet, on the machine
+    loaded from jflap_file by the automata module, or with
+    jflaplib-cli if machine is None. See run_tests.
+
+    finish is called with each word, its automata.Outcome and the name
+    of the engine that simulated it as soon as it is known, and the
+    times taken by subprocesses are recorded in timings (a Profile).
+    """
+    remaining = [word for word in tests if word not in test_results]
+    if not remaining:
+        return
+    if machine is not None:
+        outcomes = machine.simulate_all(remaining)
+        for word in remaining:
+            finish(word, outcomes[word], "native")
+        return
+    jar = jflaplib_jar()
+    if batch and jar not in batch_unsupported:
+        stats = {}
+        try:
+            run_batch(jflaplib_batch_command(jflap_file), remaining,
+                      timeout, jobs,
+                      on_outcome=lambda word, outcome: finish(
+                          word, outcome, "jflaplib-cli-batch"),
+                      stats=stats)
+        except BatchUnsupportedError as e:
+            batch_unsupported[jar] = str(e)
+        timings.workers.extend(stats.get("workers", []))
+        for word, wall in stats.get("tests", {}).items():
+            timings.test(word, wall)
+    # Some of the batch workers may have finished before one of them
+    # failed to start.
+    remaining = [word for word in remaining if word not in test_results]
+    for word in remaining:
+        print("testing ", word)
+
+    def finish_run(index, result):
+        timings.test(remaining[index], result.wall_time, result.cpu_time,
+                     result.spawn_time)
+        finish(remaining[index],
+               jflaplib_outcome(result.output, result.error,
+                                result.timed_out),
+               "jflaplib-cli")
+    run_all([jflaplib_command(jflap_file, word) for word in remaining],
+            timeout, jobs, slot=scheduler.async_subprocess_slot,
+            on_result=finish_run, until=is_verdict, env=os.environ)
+
+
+def run_tests(jflap_file, test_file, timeout=None, native=True, batch=False,
+              jobs=1, result_cache=None, test_cache=None, refresh=False,
+              stream_file=None, previous=None, profile=False, oracle=None):
+    """Run tests from test_file on jflap_file.
+
+    The timeout for each test is given by timeout, in seconds. If not
+    given, there is no timeout.
+
+    If native is true and jflap_file describes a machine that one of
+    the engines in the automata module supports, then the tests are
+    simulated in this process. Otherwise, jflaplib-cli is run once for
+    each test. The "engine" entry of the "info" section records which
+    of the two happened.
+
+    If batch is true, jflaplib-cli is first started once as a batch
+    worker (see the batch module) which simulates every test, with the
+    timeout applying to each test separately. If the worker cannot be
+    started, we fall back to one run per test, and jflaplib-cli.jar is
+    not tried as a batch worker again in this process. Batch mode is
+    off by default, since jflaplib-cli.jar does not support the
+    protocol yet.
+
+    When jflaplib-cli is used, up to jobs simulations (or batch
+    workers) are run at once, subject to the global limit on
+    subprocesses set with scheduler.set_subprocess_limit. The results
+    do not depend on the order in which the simulations finish.
+
+    If result_cache (a cache.ResultCache) is given, the results are
+    looked up in it by the contents of jflap_file, the parsed tests,
+    the grader version and the options that affect the results, and
+    stored in it after grading. If refresh is true, the lookup is
+    skipped but the results are still stored. Cached results have
+    "cached" set to true in the "info" section. The test file is
+    loaded with load_tests, using test_cache and oracle (which, if
+    given, computes the expected results of the tests the test file
+    leaves unspecified; see the oracle module).
+
+    If stream_file is given, each test result is also appended to it
+    as soon as it is known, as a ResultStream. If the file is left
+    over from an earlier, interrupted run on the same submission with
+    the same options, the tests it already has results for (with the
+    same expected result, and which did not time out) are not run
+    again, and the "resumed" entry of the "info" section says how many
+    there were.
+
+    If previous is given, it is the output of an earlier call of
+    run_tests, perhaps with a different version of the test file.
+    If that was for the same submission with the same grader version
+    and options (as recorded in the "resultsKey" entry of its "info"
+    section), the results of the tests it shares with this test file
+    are reused, with their expected results updated, and only new
+    tests are run; the "reused" entry of the "info" section says how
+    many tests were not. Tests that timed out are always run again.
+
+    If profile is true, the "profile" entry of the "info" section
+    gives the time spent in each phase of grading, and in each test
+    when they are simulated in subprocesses; see Profile. Results
+    from result_cache only have timings for the phases up to looking
+    them up there.
+
+    The return value is of the format given in the README.
+    """
+    timings = Profile()
+    with timings.phase("loadTests"):
+        tests = load_tests(test_file, test_cache, refresh, timings, oracle)
+    try:
+        with open(jflap_file, "rb") as f:
+            contents = f.read()
+    except OSError:
+        # Let the engines report the problem, and don't cache it.
+        contents = None
+        result_cache = None
+    options = {"timeout": timeout, "native": native}
+    if result_cache is not None:
+        key = cache.digest(contents, list(tests.items()), grader_version(),
+                           options)
+        if not refresh:
+            with timings.phase("cache"):
+                data = result_cache.get(key)
+            if data is not None:
+                data["info"]["filename"] = os.path.realpath(jflap_file)
+                data["info"]["cached"] = True
+                if profile:
+                    data["info"]["profile"] = timings.as_dict(
+                        len(data["summary"]["testsDidNotTerminate"]))
+                return data
+    results_key = submission_results_key(contents, timeout, native)
+    stream = None
+    test_results = {}
+    engines = set()
+
+    def reuse(word, entry, engine):
+        # Tests that hit the timeout are run again, as they might not
+        # if the machine was less busy.
+        if (word in tests and word not in test_results and
+                entry["terminated"]):
+            test_results[word] = rejudge(tests[word], entry)
+            engines.update(engine.split("+"))
+
+    if stream_file is not None:
+        stream = ResultStream(stream_file, results_key)
+        for word, entry in stream.results.items():
+            reuse(word, entry, stream.engines[word])
+    resumed = len(test_results)
+    if (previous is not None and contents is not None and
+            previous.get("info", {}).get("resultsKey") == results_key):
+        for word, entry in previous["tests"].items():
+            reuse(word, entry, previous["info"]["engine"])
+    reused = len(test_results) - resumed
+
+    def finish(word, outcome, engine):
+        entry = test_result(tests[word], outcome)
+        test_results[word] = entry
+        engines.add(engine)
+        if stream is not None:
+            stream.write(word, engine, entry)
+
+    machine = None
+    if native:
+        try:
+            with timings.phase("loadMachine"):
+                machine = automata.load_jff(jflap_file)
+        except automata.UnsupportedMachineError:
+            pass
+        except automata.InvalidMachineError as e:
+            # The machine can't be simulated at all, so every test
+            # fails in the same way.
+            machine = InvalidMachine(str(e))
+    try:
+        with timings.phase("simulate"):
+            simulate_tests(jflap_file, machine, tests, test_results,
+                           timeout, batch, jobs, finish, timings)
+    finally:
+        if stream is not None:
+            stream.close()
+    test_results = {word: test_results[word] for word in tests}
+    if engines:
+        engine = "+".join(sorted(engines))
+    else:
+        engine = "native" if machine is not None else "jflaplib-cli"
     info = {
         "filename": os.path.realpath(jflap_file),
         "timeout": timeout,
         "timestamp": datetime.datetime.today().isoformat(),
+        "engine": engine,
+    }
+    if engine == "native":
+        info["engineVersion"] = automata.ENGINE_VERSION
+        subset_cache = getattr(machine, "subset_cache", None)
+        if subset_cache is not None:
+            info["subsetCache"] = subset_cache.statistics()
+    if contents is not None:
+        info["resultsKey"] = results_key
+    if stream is not None:
+        info["resumed"] = resumed
+    if previous is not None:
+        info["reused"] = reused
+    with timings.phase("summarize"):
+        data = {
+            "tests": test_results,
+            "summary": summarize(test_results),
+            "info": info,
+        }
+    # Results from jflaplib-cli are only worth keeping if the jar was
+    # actually there, and if no test hit the wall-clock timeout, which
+    # depends on how busy the machine was.
+    if result_cache is not None and (
+            engine == "native" or
+            (grader_version()["jflaplib"] and
+             not data["summary"]["testsDidNotTerminate"])):
+        result_cache.put(key, data)
+    if profile:
+        info["profile"] = timings.as_dict(
+            len(data["summary"]["testsDidNotTerminate"]))
+    return data
+
+
+def run_equivalence(jflap_file, reference_file, counterexample_limit=5):
+    """Grade jflap_file by comparing it with the finite automaton in
+    reference_file, rather than by running tests.
+
+    Both machines are determinized and minimized, and the product
+    automaton is searched for words on which they disagree (see the
+    equivalence module). Up to counterexample_limit of the shortest
+    such words for each kind of mistake (accepting a word that should
+    be rejected, and vice versa) become the tests of the result, which
+    is otherwise in the same format as that of run_tests. So a
+    submission passes all its tests if and only if it is equivalent to
+    the reference. The "equivalent" entry of the "info" section says
+    which it is.
+
+    A submission whose DFA would have more than
+    equivalence.MAX_DFA_STATES states is not compared, since that could
+    take exponential time; like a test that times out, the empty
+    string is reported as not terminating instead.
+
+    Raises automata.UnsupportedMachineError if jflap_file is not a
+    finite automaton, and CouldNotRunJFLAPTestsError if reference_file
+    is not a valid one.
+    """
+    try:
+        reference = automata.load_jff(reference_file)
+        if not isinstance(reference, automata.FiniteAutomaton):
+            raise automata.UnsupportedMachineError(
+                "reference is not a finite automaton")
+        reference.start()
+    except (automata.UnsupportedMachineError,
+            automata.InvalidMachineError) as e:
+        error = ("Could not use reference '{}': {}"
+                 .format(reference_file, str(e)))
+        raise CouldNotRunJFLAPTestsError(error)
+    try:
+        submission = automata.load_jff(jflap_file)
+        if not isinstance(submission, automata.FiniteAutomaton):
+            raise automata.UnsupportedMachineError(
+                "submission is not a finite automaton")
+        false_accepts, false_rejects = equivalence.compare(
+            submission, reference, counterexample_limit,
+            equivalence.MAX_DFA_STATES)
+    except automata.InvalidMachineError as e:
+        # There is nothing to compare, so report the failure on the
+        # empty string.
+        outcomes = {"": automata.invalid(str(e))}
+    except equivalence.StateLimitError as e:
+        outcomes = {"": automata.did_not_terminate(str(e))}
+    else:
+        outcomes = {word: automata.accepted(True) for word in false_accepts}
+        outcomes.update((word, automata.accepted(False))
+                        for word in false_rejects)
+    test_results = {}
+    for word, outcome in sorted(outcomes.items(),
+                                key=lambda item: len_lex(item[0])):
+        test_results[word] = test_result(reference.accepts(word), outcome)
+    info = {
+        "filename": os.path.realpath(jflap_file),
+        "reference": os.path.realpath(reference_file),
+        "timestamp": datetime.datetime.today().isoformat(),
+        "engine": "equivalence",
+        "engineVersion": automata.ENGINE_VERSION,
+        "equivalent": not test_results,
     }
     return {
         "tests": test_results,
-        "summary": summary,
+        "summary": summarize(test_results),
         "info": info,
     }
 
 
+class InvalidMachine(object):
+    """Stand-in for a machine from the automata module which could not
+    be built, so that every simulation of it is invalid."""
+
+    def __init__(self, message):
+        self.message = message
+
+    def simulate_all(self, words):
+        return {word: automata.invalid(self.message) for word in words}
+
+
 if __name__ == "__main__":
     args = sys.argv[1:]
     if args:
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Reference oracles, which give the expected results of test cases.
+
+Instead of defining "check", a test file can leave the expected results
+of some of its test cases unspecified and have them computed by a
+reference solution (see jflapgrader.parse_test_file). An oracle is
+called once, with all such input strings, and returns a dictionary
+mapping each of them to whether it should be accepted. There are two
+kinds:
+
+* A program, such as pythonGrader.py, which reads input strings from
+  stdin, one per line, and for each of them writes a line ending in a
+  result specifier of a test file, such as "accept" or "reject".
+  Everything before the last token of the line is ignored, so a
+  program may echo the input string, as pythonGrader.py does. The
+  program is started once, and the input strings are streamed through
+  it.
+* A reference JFLAP file, which is simulated by the native engines of
+  the automata module.
+
+Each oracle also has a key, identifying its behaviour, so that the
+expected results it gives can be cached along with the test file they
+complete.
+"""
+
+import doctest
+import os
+import subprocess
+import sys
+import threading
+
+import automata
+from batch import pump_lines
+import cache
+from command import BoundedBuffer, signal_group
+import jflapgrader
+
+
+# How long, in seconds, a reference program may take to give the
+# results of all the input strings before it is killed.
+ORACLE_TIMEOUT = 300
+
+
+class OracleError(Exception):
+    """Exception thrown when an oracle cannot give the expected result of
+    an input string."""
+    pass
+
+
+class ProgramOracle(object):
+    """Oracle that pipes input strings through a reference program,
+    started with the argument list command. script is the file holding
+    the program, whose contents identify the oracle in its key. If the
+    program has not given all the results after timeout seconds (if
+    not None), it is killed, along with any processes it started.
+
+    >>> oracle = ProgramOracle([sys.executable, example_program],
+    ...                        example_program)
+    >>> oracle(["0101", "0110", ""])
+    {'0101': False, '0110': True, '': True}
+    >>> sleeper = [sys.executable, "-c", "import time; time.sleep(30)"]
+    >>> ProgramOracle(sleeper, "sleeper.py", timeout=0.5)(["0"])
+    Traceback (most recent call last):
+        ...
+    OracleError: sleeper.py did not give all its results within 0.5 seconds
+    """
+
+    def __init__(self, command, script, timeout=ORACLE_TIMEOUT):
+        self.command = command
+        self.script = script
+        self.timeout = timeout
+
+    def key(self):
+        """Returns a value identifying the results the oracle gives."""
+        return ["program", os.path.basename(self.script),
+                cache.file_digest(self.script)]
+
+    def __call__(self, words):
+        words = list(words)
+        for word in words:
+            if "\n" in word or "\r" in word:
+                raise OracleError("cannot pass input string {!r}, which"
+                                  " contains a line break, to {}"
+                                  .format(word, self.script))
+        try:
+            process = subprocess.Popen(self.command,
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       start_new_session=(
+                                           os.name == "posix"))
+        except OSError as e:
+            raise OracleError("could not start {}: {}"
+                              .format(self.script, e))
+        errors = BoundedBuffer()
+        # Killing the program on the deadline closes its stdout, which
+        # wakes us up from reading it.
+        timed_out = threading.Event()
+
+        def expire():
+            timed_out.set()
+            signal_group(process, force=True)
+
+        def add_stderr(line):
+            if line is not None:
+                errors.write(line.encode("utf-8"))
+
+        def feed():
+            # Write from a thread of its own, so that neither we nor the
+            # program can block on a full pipe while the other waits.
+            try:
+                for word in words:
+                    process.stdin.write(word.encode("utf-8") + b"\n")
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        threads = [threading.Thread(target=feed, daemon=True),
+                   threading.Thread(target=pump_lines,
+                                    args=(process.stderr, add_stderr),
+                                    daemon=True)]
+        for thread in threads:
+            thread.start()
+        timer = None
+        if self.timeout is not None:
+            timer = threading.Timer(self.timeout, expire)
+            timer.daemon = True
+            timer.start()
+        results = {}
+        try:
+            for linum, word in enumerate(words, 1):
+                line = process.stdout.readline().decode("utf-8", "replace")
+                if timed_out.is_set():
+                    raise OracleError("{} did not give all its results"
+                                      " within {} seconds"
+                                      .format(self.script, self.timeout))
+                tokens = line.split()
+                if not tokens:
+                    raise OracleError("{} gave no result for input string"
+                                      " {!r}".format(self.script, word))
+                try:
+                    results[word] = jflapgrader.result_of(
+                        tokens[-1].lower(), linum)
+                except jflapgrader.JFLAPTestFileParseError as e:
+                    raise OracleError("unexpected output from {}: {}"
+                                      .format(self.script, e))
+            if process.stdout.read(1):
+                raise OracleError("{} gave more results than there were"
+                                  " input strings".format(self.script))
+        except OracleError as e:
+            if timer is not None:
+                timer.cancel()
+            signal_group(process, force=True)
+            process.wait()
+            for thread in threads:
+                thread.join()
+            stderr = errors.getvalue()
+            if stderr:
+                raise OracleError("{}; its stderr was:\n{}"
+                                  .format(e, stderr)) from None
+            raise
+        process.wait()
+        if timer is not None:
+            timer.cancel()
+        for thread in threads:
+            thread.join()
+        return results
+
+
+class MachineOracle(object):
+    """Oracle that simulates a reference JFLAP file with the native
+    engines of the automata module.
+
+    >>> oracle = MachineOracle(example_jff)
+    >>> oracle(["00001101", "1"])
+    {'00001101': True, '1': False}
+    """
+
+    def __init__(self, jflap_file):
+        self.jflap_file = jflap_file
+
+    def key(self):
+        """Returns a value identifying the results the oracle gives."""
+        return ["machine", cache.file_digest(self.jflap_file),
+                automata.ENGINE_VERSION]
+
+    def __call__(self, words):
+        try:
+            machine = automata.load_jff(self.jflap_file)
+        except (automata.UnsupportedMachineError,
+                automata.InvalidMachineError) as e:
+            raise OracleError("could not simulate {}: {}"
+                              .format(self.jflap_file, e))
+        results = {}
+        for word, outcome in machine.simulate_all(words).items():
+            if outcome.accepted is None:
+                raise OracleError("{} gives no result for input string"
+                                  " {!r}: {}".format(self.jflap_file, word,
+                                                     outcome.stderr))
+            results[word] = outcome.accepted
+        return results
+
+
+def make_oracle(reference, timeout=ORACLE_TIMEOUT):
+    """Returns the oracle for the reference solution at the path
+    reference: a MachineOracle for a JFLAP file, or a ProgramOracle for
+    anything else, run with this Python if it is a Python script and
+    directly otherwise, and killed after timeout seconds.
+    """
+    if reference.endswith(".jff"):
+        return MachineOracle(reference)
+    elif reference.endswith(".py"):
+        return ProgramOracle([sys.executable, reference], reference,
+                             timeout)
+    else:
+        return ProgramOracle([os.path.abspath(reference)], reference,
+                             timeout)
+
+
+example_program = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "pythonGrader.py")
+example_jff = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "jff", "example.jff")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Native simulation of JFLAP pushdown automata.
+
+A pushdown automaton may be nondeterministic and have lambda
+transitions, so it is simulated by a breadth-first search of its
+configurations (state, position in the input, stack), remembering
+those already seen so that each is explored only once. As in JFLAP,
+the stack starts out holding "Z", and a word is accepted if the
+automaton can reach a final state after reading all of it.
+
+Lambda transitions that push without popping can make the set of
+configurations infinite, so the search is bounded by the height of the
+stack and by the number of configurations explored. If it had to skip
+configurations because of either bound and found no way to accept, the
+word is neither accepted nor rejected, and the result is marked
+invalid.
+"""
+
+import collections
+import doctest
+import sys
+
+import automata
+
+
+# The default bounds on the search. See the module docstring.
+MAX_STACK = 1000
+MAX_CONFIGURATIONS = 100000
+
+# The symbol on the stack at the start of every simulation.
+INITIAL_STACK = "Z"
+
+
+class PushdownAutomaton(object):
+    """A JFLAP pushdown automaton.
+
+    Each transition is a tuple (from, to, read, pop, push) of strings,
+    any of which may be empty. The first symbol of pop must be on top
+    of the stack, and the first symbol of push ends up on top.
+
+    >>> # Accepts a^n b^n for n >= 0.
+    >>> pda = PushdownAutomaton([0, 1, 2], 0, [2],
+    ...                         [(0, 0, "a", "", "A"),
+    ...                          (0, 1, "", "", ""),
+    ...                          (1, 1, "b", "A", ""),
+    ...                          (1, 2, "", "Z", "Z")])
+    >>> [word for word in ["", "ab", "aabb", "aab", "abb", "ba"]
+    ...  if pda.simulate(word).accepted]
+    ['', 'ab', 'aabb']
+    >>> # Pushes forever without reading anything.
+    >>> PushdownAutomaton([0], 0, [], [(0, 0, "", "", "A")]).simulate("")
+    Outcome(accepted=None, terminated=True, valid=False)
+    """
+
+    def __init__(self, states, initial, finals, transitions,
+                 max_stack=MAX_STACK, max_configurations=MAX_CONFIGURATIONS):
+        states = set(states)
+        if initial is not None and initial not in states:
+            raise automata.InvalidMachineError(
+                "initial state '{}' does not exist".format(initial))
+        self.initial = initial
+        self.finals = frozenset(finals)
+        self.max_stack = max_stack
+        self.max_configurations = max_configurations
+        # The stack is stored as a string with its top at the end, so
+        # popping and pushing are slices and concatenations at the end
+        # of the string; hence pop and push are reversed here.
+        self.moves = collections.defaultdict(list)
+        for source, target, read, pop, push in transitions:
+            if source not in states or target not in states:
+                raise automata.InvalidMachineError(
+                    "transition from '{}' to '{}' refers to a missing state"
+                    .format(source, target))
+            self.moves[source].append((read, pop[::-1], push[::-1], target))
+
+    def simulate(self, word):
+        """Returns the automata.Outcome of running the automaton on word."""
+        if self.initial is None:
+            return automata.invalid("pushdown automaton has no initial state")
+        start = (self.initial, 0, INITIAL_STACK)
+        seen = {start}
+        queue = collections.deque([start])
+        pruned = None
+        while queue:
+            state, position, stack = queue.popleft()
+            if position == len(word) and state in self.finals:
+                return automata.accepted(True)
+            for read, pop, push, target in self.moves[state]:
+                if read and not word.startswith(read, position):
+                    continue
+                if pop and not stack.endswith(pop):
+                    continue
+                successor_stack = (stack[:len(stack) - len(pop)] if pop
+                                   else stack) + push
+                if len(successor_stack) > self.max_stack:
+                    pruned = ("stack grew beyond {} symbols"
+                              .format(self.max_stack))
+                    continue
+                successor = (target, position + len(read), successor_stack)
+                if successor in seen:
+                    continue
+                if len(seen) >= self.max_configurations:
+                    pruned = ("explored more than {} configurations"
+                              .format(self.max_configurations))
+                    continue
+                seen.add(successor)
+                queue.append(successor)
+        if pruned is not None:
+            return automata.invalid(
+                "budget exhausted: {} without accepting".format(pruned))
+        return automata.accepted(False)
+
+    def simulate_all(self, words):
+        """Returns a dictionary mapping each of words to its
+        automata.Outcome."""
+        return {word: self.simulate(word) for word in words}
+
+
+def read_pda(structure):
+    """Builds a PushdownAutomaton from the <structure> element of a JFLAP
+    file.
+
+    >>> pda = automata.parse_jff('''<structure><type>pda</type><automaton>
+    ...   <state id="0"><initial/></state><state id="1"><final/></state>
+    ...   <transition><from>0</from><to>0</to>
+    ...     <read>(</read><pop/><push>X</push></transition>
+    ...   <transition><from>0</from><to>0</to>
+    ...     <read>)</read><pop>X</pop><push/></transition>
+    ...   <transition><from>0</from><to>1</to>
+    ...     <read/><pop>Z</pop><push/></transition>
+    ... </automaton></structure>''')
+    >>> pda.simulate("(()())").accepted, pda.simulate("())").accepted
+    (True, False)
+    """
+    automaton = automata.automaton_element(structure)
+    states = []
+    initial = None
+    finals = []
+    for state in automaton.iter("state"):
+        state_id = state.get("id")
+        states.append(state_id)
+        if state.find("initial") is not None:
+            initial = state_id
+        if state.find("final") is not None:
+            finals.append(state_id)
+    transitions = [(automata.element_text(transition, "from"),
+                    automata.element_text(transition, "to"),
+                    automata.element_text(transition, "read"),
+                    automata.element_text(transition, "pop"),
+                    automata.element_text(transition, "push"))
+                   for transition in automaton.iter("transition")]
+    return PushdownAutomaton(states, initial, finals, transitions)
+
+
+automata.readers["pda"] = read_pda
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Native simulation of JFLAP regular expressions.
+
+A regular expression is compiled into a nondeterministic finite
+automaton with lambda transitions, by Thompson's construction, so it
+is simulated by the same engines as finite automata (see
+automata.FiniteAutomaton), and can also be compared with a reference
+or deduplicated by its language like one.
+
+The syntax is that of JFLAP: every character stands for itself except
+for "+" (union), "*" (Kleene star), parentheses for grouping and "!",
+which stands for the empty string. Concatenation is written by putting
+expressions next to each other, and binds tighter than union but
+looser than star. As in JFLAP, the empty expression (and "()") stands
+for the empty string.
+"""
+
+import doctest
+import sys
+
+import automata
+
+
+# Characters with a special meaning in JFLAP regular expressions.
+UNION = "+"
+STAR = "*"
+OPEN = "("
+CLOSE = ")"
+LAMBDA = "!"
+
+
+class RegexCompiler(object):
+    """Builds the transitions of an automaton accepting the language of a
+    regular expression. The states are numbered from 0; see compile_regex.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.position = 0
+        self.size = 0
+        self.transitions = []
+
+    def new_state(self):
+        self.size += 1
+        return self.size - 1
+
+    def error(self, message):
+        return automata.InvalidMachineError(
+            "malformed regular expression '{}': {} at position {}"
+            .format(self.expression, message, self.position))
+
+    def peek(self):
+        if self.position < len(self.expression):
+            return self.expression[self.position]
+        return None
+
+    def fragment(self, read):
+        """Returns the (start, end) states of a new automaton that only
+        accepts read."""
+        start = self.new_state()
+        end = self.new_state()
+        self.transitions.append((start, read, end))
+        return start, end
+
+    def union(self):
+        """Compiles a union of concatenations, up to the next unmatched
+        closing parenthesis or the end of the expression, and returns
+        its (start, end) states."""
+        alternatives = [self.concatenation()]
+        while self.peek() == UNION:
+            self.position += 1
+            alternatives.append(self.concatenation())
+        if len(alternatives) == 1:
+            return alternatives[0]
+        start = self.new_state()
+        end = self.new_state()
+        for first, last in alternatives:
+            self.transitions.append((start, "", first))
+            self.transitions.append((last, "", end))
+        return start, end
+
+    def concatenation(self):
+        """Compiles a concatenation of starred expressions and returns its
+        (start, end) states."""
+        factors = []
+        while self.peek() not in (UNION, CLOSE, None):
+            factors.append(self.star())
+        if not factors:
+            if UNION in (self.peek(),
+                         self.expression[self.position - 1:self.position]):
+                raise self.error("'+' without an operand")
+            # Nothing at all, as in "()", is the empty string.
+            return self.fragment("")
+        for (_, last), (first, _) in zip(factors, factors[1:]):
+            self.transitions.append((last, "", first))
+        return factors[0][0], factors[-1][1]
+
+    def star(self):
+        """Compiles a symbol, lambda or parenthesized expression followed
+        by any number of stars and returns its (start, end) states."""
+        char = self.peek()
+        if char == STAR:
+            raise self.error("'*' without an operand")
+        self.position += 1
+        if char == OPEN:
+            first, last = self.union()
+            if self.peek() != CLOSE:
+                raise self.error("unbalanced parentheses")
+            self.position += 1
+        elif char == LAMBDA:
+            first, last = self.fragment("")
+        else:
+            first, last = self.fragment(char)
+        if self.peek() == STAR:
+            while self.peek() == STAR:
+                self.position += 1
+            start = self.new_state()
+            end = self.new_state()
+            self.transitions.extend([(start, "", first), (last, "", first),
+                                     (start, "", end), (last, "", end)])
+            return start, end
+        return first, last
+
+
+def compile_regex(expression):
+    """Returns an automata.FiniteAutomaton accepting the language of the
+    JFLAP regular expression expression. Raises
+    automata.InvalidMachineError if it is malformed.
+
+    >>> fa = compile_regex("(a+b)*abb")
+    >>> [word for word in ["abb", "babb", "ab", "aabba", ""]
+    ...  if fa.accepts(word)]
+    ['abb', 'babb']
+    >>> [word for word in ["", "0", "1", "11", "01"]
+    ...  if compile_regex("!+0+1*").accepts(word)]
+    ['', '0', '1', '11']
+    >>> compile_regex("").accepts(""), compile_regex("()*a").accepts("a")
+    (True, True)
+    >>> compile_regex("a+*")
+    Traceback (most recent call last):
+        ...
+    automata.InvalidMachineError: malformed regular expression 'a+*': '*' without an operand at position 2
+    >>> compile_regex("(ab")
+    Traceback (most recent call last):
+        ...
+    automata.InvalidMachineError: malformed regular expression '(ab': unbalanced parentheses at position 3
+    """
+    compiler = RegexCompiler(expression)
+    start, end = compiler.union()
+    if compiler.peek() == CLOSE:
+        raise compiler.error("unbalanced parentheses")
+    return automata.FiniteAutomaton(range(compiler.size), start, [end],
+                                    compiler.transitions)
+
+
+def read_re(structure):
+    """Builds a FiniteAutomaton from the <structure> element of a JFLAP
+    file holding a regular expression.
+
+    >>> fa = automata.parse_jff('''<structure><type>re</type>
+    ...   <expression>0*(10*10*)*</expression></structure>''')
+    >>> fa.simulate("0110").accepted, fa.simulate("0100").accepted
+    (True, False)
+    """
+    return compile_regex(automata.element_text(structure, "expression"))
+
+
+automata.readers["re"] = read_re
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
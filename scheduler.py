@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Bounded concurrency for running simulations of a single submission.
+
+Simulations that need a subprocess (jflaplib-cli) spend nearly all of
+their time waiting, so they can be overlapped using threads. To keep
+this from oversubscribing the machine when several submissions are
+graded at once (see "grade.py --jobs"), every subprocess must also hold
+one of a global number of slots, which may be shared between
+processes.
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import doctest
+import sys
+import threading
+
+
+# The semaphore limiting the number of concurrently running
+# subprocesses, or None for no limit. See set_subprocess_limit.
+subprocess_slots = None
+
+
+def set_subprocess_limit(limit):
+    """Limits the number of subprocesses that may run at once.
+
+    limit is either a number, or a semaphore to use directly; pass a
+    multiprocessing.BoundedSemaphore to share one limit between
+    several worker processes. None removes the limit.
+    """
+    global subprocess_slots
+    if isinstance(limit, int):
+        subprocess_slots = threading.BoundedSemaphore(limit)
+    else:
+        subprocess_slots = limit
+
+
+@contextlib.contextmanager
+def subprocess_slot():
+    """Context manager which blocks until a subprocess slot is available
+    and holds it for the duration of the block."""
+    slots = subprocess_slots
+    if slots is None:
+        yield
+    else:
+        with slots:
+            yield
+
+
+@contextlib.asynccontextmanager
+async def async_subprocess_slot(poll_interval=0.05):
+    """Asynchronous version of subprocess_slot, for use in coroutines. The
+    slots may be shared with other processes, which can't wake us up,
+    so this polls every poll_interval seconds instead of blocking the
+    event loop."""
+    slots = subprocess_slots
+    if slots is None:
+        yield
+        return
+    while not slots.acquire(False):
+        await asyncio.sleep(poll_interval)
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+def map_concurrently(fn, items, jobs=1):
+    """Returns the list of fn(item) for each of items, in order, running
+    up to jobs calls at once in separate threads.
+
+    The results do not depend on the order in which the calls finish.
+    If any call raises an exception, it is re-raised here.
+
+    >>> import time
+    >>> def slow_square(n):
+    ...     time.sleep(0.01 * (5 - n))
+    ...     return n * n
+    >>> map_concurrently(slow_square, range(5), jobs=3)
+    [0, 1, 4, 9, 16]
+    >>> map_concurrently(slow_square, [])
+    []
+    """
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with concurrent.futures.ThreadPoolExecutor(min(jobs, len(items))) as pool:
+        return list(pool.map(fn, items))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""Shrinking a test set to a small one that exercises a reference
+finite automaton just as thoroughly.
+
+What a test set exercises is measured by two kinds of goals:
+
+* Transitions: a word covers a transition of the reference that reads
+  a symbol if some run of the reference on the word can take it.
+* Distinguished transitions: in the minimal DFA of the reference, a
+  word covers the pair of a transition (or the start, before the
+  first symbol) and another state if it takes the transition and
+  then ends with a suffix that the target of the transition and the
+  other state disagree on (a Myhill-Nerode witness for the two
+  states). A submission whose transition leads to the wrong state, or
+  which merges the two states, gets such a word wrong. Only suffixes
+  of at most a given length count.
+
+minimize_tests picks a subset of a test set covering the same goals,
+by greedily adding the word that covers the most goals still
+uncovered, and then dropping any word the others make redundant.
+Finding the smallest such subset is NP-hard, so this is not always the
+smallest, but it is typically orders of magnitude smaller than an
+exhaustive test set.
+"""
+
+import collections
+import doctest
+import heapq
+import os
+import sys
+
+# Only the doctests use automata directly.
+import automata  # noqa: F401
+import equivalence
+import jflapgrader
+
+
+def popcount(mask):
+    """Returns the number of bits set in the non-negative integer mask."""
+    return bin(mask).count("1")
+
+
+class Coverage(object):
+    """The goals covered by words on the automata.FiniteAutomaton fa, with
+    witnesses of at most max_witness_length symbols (or any length if
+    it is None). alphabet gives any symbols the words use besides
+    those of fa. See the module docstring.
+
+    Sets of goals are represented as integers, with a bit for each
+    goal, so that they can be combined and counted quickly; describe
+    turns them into tuples.
+
+    >>> # Whether the number of 1s is divisible by 3.
+    >>> fa = automata.FiniteAutomaton([0, 1, 2], 0, [0],
+    ...     [(0, "0", 0), (0, "1", 1), (1, "0", 1), (1, "1", 2),
+    ...      (2, "0", 2), (2, "1", 0)])
+    >>> coverage = Coverage(fa)
+    >>> goals = coverage.describe(coverage.goals("11"))
+    >>> [goal for goal in goals if goal[0] == "transition"]
+    [('transition', 0, '1', 1), ('transition', 1, '1', 2)]
+    >>> # After the first transition, to 1, the rest of the word ("1")
+    >>> # tells 1 apart from 2, but not from 0.
+    >>> [goal[2] for goal in goals if goal[1] == (0, "1")]
+    [2]
+    >>> coverage.totals()
+    {'transitions': 6, 'distinguished': 14}
+    """
+
+    def __init__(self, fa, alphabet=(), max_witness_length=None):
+        self.fa = fa
+        self.max_witness_length = max_witness_length
+        dfa = self.dfa = equivalence.minimize(equivalence.determinize(
+            fa, set(fa.alphabet).union(alphabet)))
+        self.index = {symbol: i for i, symbol in enumerate(dfa.alphabet)}
+        # The transitions of fa which read a symbol, whose goals come
+        # first, and for each state and symbol, the goals of those
+        # reading it from that state.
+        self.arcs = []
+        self.outgoing = [collections.defaultdict(int)
+                         for _ in range(fa.size)]
+        for symbol, pairs in sorted(fa.arcs.items()):
+            if symbol:
+                for source, target in zip(pairs[::2], pairs[1::2]):
+                    self.outgoing[source][symbol] |= 1 << len(self.arcs)
+                    self.arcs.append((source, symbol, target))
+        # Then come the goals of each transition of the DFA (numbered
+        # from 1, after the start) and each of its states.
+        self.offset = len(self.arcs)
+        self.transition_mask = (1 << self.offset) - 1
+        # For each suffix, the set of states of the DFA that accept it,
+        # as a mask.
+        self.accepters = {"": sum(1 << state
+                                  for state in range(dfa.size)
+                                  if dfa.accepting[state])}
+
+    def suffix_accepters(self, suffix):
+        """Returns the set of states of the DFA that accept suffix, as a
+        mask."""
+        accepters = self.accepters.get(suffix)
+        if accepters is None:
+            rest = self.suffix_accepters(suffix[1:])
+            column = self.index[suffix[0]]
+            accepters = 0
+            for state, row in enumerate(self.dfa.table):
+                if rest >> row[column] & 1:
+                    accepters |= 1 << state
+            self.accepters[suffix] = accepters
+        return accepters
+
+    def goals(self, word):
+        """Returns the set of goals word covers."""
+        return self.goals_all([word])[word]
+
+    def goals_all(self, words):
+        """Returns a dictionary mapping each of words to the set of goals
+        it covers.
+
+        As in automata.FiniteAutomaton.accepts_all, the words are taken
+        in sorted order, so that a prefix shared with the word before is
+        only run once.
+        """
+        fa = self.fa
+        outgoing = self.outgoing
+        dfa = self.dfa
+        table = dfa.table
+        index = self.index
+        width = len(dfa.alphabet)
+        size = dfa.size
+        everything = (1 << size) - 1
+        found = {}
+        # For each prefix of the last word, the states fa is in after
+        # reading it, the state the DFA is in, and the goals of the
+        # transitions of fa it covers.
+        prefixes = [(fa.start(), dfa.start, 0)]
+        previous = ""
+        for word in sorted(set(words)):
+            shared = 0
+            limit = min(len(word), len(prefixes) - 1)
+            while shared < limit and word[shared] == previous[shared]:
+                shared += 1
+            del prefixes[shared + 1:]
+            for symbol in word[shared:]:
+                current, state, covered = prefixes[-1]
+                for source in current:
+                    covered |= outgoing[source].get(symbol, 0)
+                prefixes.append((fa.step(current, symbol),
+                                 table[state][index[symbol]], covered))
+            previous = word
+            goals = prefixes[-1][2]
+            accepting = dfa.accepting[prefixes[-1][1]]
+            first = 0
+            if self.max_witness_length is not None:
+                first = max(len(word) - self.max_witness_length, 0)
+            for position in range(first, len(word) + 1):
+                accepters = self.suffix_accepters(word[position:])
+                if accepting:
+                    accepters ^= everything
+                if position:
+                    transition = (prefixes[position - 1][1] * width
+                                  + index[word[position - 1]] + 1)
+                else:
+                    transition = 0
+                goals |= accepters << (self.offset + transition * size)
+            found[word] = goals
+        return found
+
+    def describe(self, goals):
+        """Returns the set of goals goals as a list of tuples
+        ("transition", from, symbol, to), for the transitions of fa, and
+        ("distinguish", transition, state), where transition is a pair
+        (from, symbol) of the DFA, or None for the start."""
+        described = [("transition",) + arc
+                     for i, arc in enumerate(self.arcs) if goals >> i & 1]
+        size = self.dfa.size
+        goals >>= self.offset
+        bit = 0
+        while goals:
+            if goals & 1:
+                transition, state = divmod(bit, size)
+                if transition:
+                    source, i = divmod(transition - 1, len(self.dfa.alphabet))
+                    transition = (source, self.dfa.alphabet[i])
+                else:
+                    transition = None
+                described.append(("distinguish", transition, state))
+            goals >>= 1
+            bit += 1
+        return described
+
+    def count(self, goals):
+        """Returns a dictionary giving the number of goals of each kind in
+        the set goals."""
+        return {
+            "transitions": popcount(goals & self.transition_mask),
+            "distinguished": popcount(goals >> self.offset),
+        }
+
+    def totals(self):
+        """Returns a dictionary giving the number of goals of each kind."""
+        size = self.dfa.size
+        return {
+            "transitions": len(self.arcs),
+            "distinguished": ((size * len(self.dfa.alphabet) + 1)
+                              * (size - 1)),
+        }
+
+
+def minimize_tests(fa, words, max_witness_length=None):
+    """Returns a list of words, taken from words, which covers the same
+    goals of the automata.FiniteAutomaton fa as all of them do (see the
+    module docstring), in order of length and then alphabetically,
+    along with a dictionary giving the number of goals of each kind
+    covered, and in total.
+
+    >>> fa = automata.load_jff(example_jff)
+    >>> words = list(jflapgrader.all_bitstrings(10))
+    >>> selected, report = minimize_tests(fa, words, 6)
+    >>> len(selected) < len(words) // 10
+    True
+    >>> minimize_tests(fa, selected, 6)[1] == report
+    True
+    """
+    words = list(dict.fromkeys(words))
+    coverage = Coverage(fa, {symbol for word in words for symbol in word},
+                        max_witness_length)
+    # Greedy set cover. Gains only ever go down, so a word whose gain
+    # is stale is pushed back with its current gain, and a word is
+    # taken when its gain is current and still the largest. Ties go to
+    # the shortest word.
+    goals = coverage.goals_all(words)
+    heap = []
+    uncovered = 0
+    for word, found in goals.items():
+        if found:
+            uncovered |= found
+            heap.append((-popcount(found), jflapgrader.len_lex(word), word))
+    heapq.heapify(heap)
+    covered = coverage.count(uncovered)
+    selected = []
+    while uncovered:
+        gain, key, word = heapq.heappop(heap)
+        found = goals[word] & uncovered
+        count = popcount(found)
+        if count < -gain:
+            if count:
+                heapq.heappush(heap, (-count, key, word))
+            continue
+        selected.append(word)
+        uncovered &= ~found
+    # A word taken early may be covered by those taken after it.
+    for word in reversed(selected[:]):
+        others = 0
+        for other in selected:
+            if other != word:
+                others |= goals[other]
+        if goals[word] & ~others == 0:
+            selected.remove(word)
+    totals = coverage.totals()
+    report = {
+        "transitions": covered["transitions"],
+        "totalTransitions": totals["transitions"],
+        "distinguished": covered["distinguished"],
+        "totalDistinguished": totals["distinguished"],
+    }
+    return sorted(selected, key=jflapgrader.len_lex), report
+
+
+def quote_word(word):
+    r"""Returns word as the first token of a line of a test file.
+
+    >>> [quote_word(word) for word in ["0110", "", "a b", 'say "hi"\\']]
+    ['0110', '""', '"a b"', '"say \\"hi\\"\\\\"']
+    >>> jflapgrader.split_with_quotes(quote_word('say "hi"\\'))
+    ['say "hi"\\']
+    """
+    if word and not word.startswith(("#", "def")) and \
+            not any(char.isspace() or char in "'\"" for char in word):
+        return word
+    return '"{}"'.format(word.replace("\\", "\\\\").replace('"', '\\"'))
+
+
+def write_test_file(f, tests, comments=()):
+    """Writes the tests, a dictionary mapping words to whether they
+    should be accepted, as a test file to the text file object f, after
+    the given comment lines. Each test is written with an arrow, so that
+    the file is never mistaken for an old-style one. Raises ValueError
+    for a word with a line break, which cannot be written.
+
+    >>> import io
+    >>> f = io.StringIO()
+    >>> write_test_file(f, {"": False, "a b": True}, ["Two tests."])
+    >>> print(f.getvalue(), end="")
+    # Two tests.
+    "" -> reject
+    "a b" -> accept
+    >>> jflapgrader.parse_test_file_contents(f.getvalue())
+    {'': False, 'a b': True}
+    """
+    for comment in comments:
+        f.write("# {}\n".format(comment))
+    for word, should_accept in tests.items():
+        if any(char in jflapgrader.LINE_BREAKS for char in word):
+            raise ValueError("cannot write input string {!r}, which"
+                             " contains a line break".format(word))
+        f.write("{} -> {}\n".format(
+            quote_word(word), "accept" if should_accept else "reject"))
+
+
+example_jff = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "jff", "example.jff")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import automata
+import jflapgrader
+import os
+import shrink
+import sys
+
+NAME = sys.argv[0]
+
+USAGE = """\
+usage: {}
+         [--max-witness-length <length>]
+         <reference-jff> <test-file> <output-test-file>
+
+Writes the smallest subset of the test file's test cases it can find
+which covers the reference finite automaton as well as all of them.\
+""".format(NAME)
+
+def print_stderr(msg, *args, **kwargs):
+    print(msg, *args, **kwargs, file=sys.stderr)
+
+def error_and_exit(msg, *args, **kwargs):
+    print_stderr('{}: {}'.format(NAME, msg), *args, **kwargs)
+    sys.exit(1)
+
+def usage_and_exit(*args, **kwargs):
+    print_stderr(USAGE, *args, **kwargs)
+    sys.exit(1)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    max_witness_length = None
+    while args and args[0].startswith("--"):
+        option = args.pop(0)
+        if not args:
+            usage_and_exit()
+        value = args.pop(0)
+        if option == "--max-witness-length":
+            try:
+                max_witness_length = int(value)
+            except ValueError:
+                max_witness_length = -1
+            if max_witness_length < 0:
+                error_and_exit("max witness length '{}' is not a"
+                               " non-negative integer".format(value))
+        else:
+            usage_and_exit()
+    if len(args) != 3:
+        usage_and_exit()
+    reference, test_file, output_file = args
+    for path in (reference, test_file):
+        if not os.path.isfile(path):
+            error_and_exit("no such file: " + path)
+
+    try:
+        fa = automata.load_jff(reference)
+        if not isinstance(fa, automata.FiniteAutomaton):
+            raise automata.UnsupportedMachineError(
+                "not a finite automaton or regular expression")
+        fa.start()
+    except (automata.UnsupportedMachineError,
+            automata.InvalidMachineError) as e:
+        error_and_exit("could not use reference '{}': {}"
+                       .format(reference, e))
+    try:
+        tests = jflapgrader.load_tests(test_file)
+    except jflapgrader.CouldNotRunJFLAPTestsError as e:
+        error_and_exit(str(e))
+
+    selected, report = shrink.minimize_tests(fa, tests, max_witness_length)
+    # The expected results are those of the test file, which should be
+    # those of the reference.
+    outcomes = fa.simulate_all(tests)
+    disagreements = [word for word in tests
+                     if tests[word] != outcomes[word].accepted]
+    if disagreements:
+        print_stderr("{}: warning: the reference disagrees with the test file"
+                     " on {} test cases, such as '{}'"
+                     .format(NAME, len(disagreements), disagreements[0]))
+    comments = [
+        "Chosen by shrink_tests.py from the {} test cases of {}".format(
+            len(tests), os.path.basename(test_file)),
+        "to cover the same transitions of {} ({} of {}) and the same".format(
+            os.path.basename(reference), report["transitions"],
+            report["totalTransitions"]),
+        "pairs of a transition and a state to tell it apart from ({} of {}),"
+        .format(report["distinguished"], report["totalDistinguished"]),
+        "with witnesses of {}. See shrink.py.".format(
+            "any length" if max_witness_length is None else
+            "at most {} symbols".format(max_witness_length)),
+    ]
+    try:
+        with open(output_file, "w") as f:
+            shrink.write_test_file(
+                f, {word: tests[word] for word in selected}, comments)
+    except (OSError, ValueError) as e:
+        error_and_exit("could not write {}: {}".format(output_file, e))
+    for comment in comments:
+        print(comment)
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""Native simulation of JFLAP Turing machines.
+
+Machines may have several tapes and may be nondeterministic. The input
+is written on the first tape with every head on its first symbol, and
+the machine accepts as soon as it reaches a final state, as in JFLAP.
+
+Instead of a wall-clock timeout, simulations are bounded by a number of
+steps, so the results do not depend on how fast or busy the grading
+machine is. Many machines that would never halt are also recognized
+long before the budget runs out:
+
+* A configuration (state, tape contents and head positions, up to
+  shifting everything along the tape) which repeats must repeat
+  forever. For deterministic machines, this is checked with Brent's
+  cycle detection, which needs to remember just one configuration.
+* A single-tape machine which is in some state with only blanks at and
+  to the right of its head, and later in the same state with only
+  blanks at and to the right of its head, without having moved left of
+  where it was the first time, will do the same thing again forever
+  (and similarly to the left). This catches machines that run off
+  along the tape, whose configurations never repeat.
+* For nondeterministic machines, all reachable configurations are
+  explored breadth first; if none accepts and they contain a cycle,
+  the simulation would not have terminated.
+"""
+
+import collections
+import doctest
+import sys
+
+import automata
+
+
+# The default number of steps (for nondeterministic machines,
+# configurations) a simulation may take before it is stopped.
+STEP_BUDGET = 100000
+
+# JFLAP writes the blank symbol as an empty <read/> or <write/>.
+BLANK = ""
+
+MOVES = {"L": -1, "R": 1, "S": 0}
+
+
+class Tape(object):
+    """One tape of a Turing machine, holding only its non-blank cells.
+
+    left and right are the positions of the outermost non-blank cells,
+    or None if the tape is blank.
+    """
+    __slots__ = ("cells", "left", "right")
+
+    def __init__(self, word=""):
+        self.cells = dict(enumerate(word))
+        if word:
+            self.left, self.right = 0, len(word) - 1
+        else:
+            self.left = self.right = None
+
+    def read(self, position):
+        return self.cells.get(position, BLANK)
+
+    def write(self, position, symbol):
+        if symbol == BLANK:
+            if position in self.cells:
+                del self.cells[position]
+                if position in (self.left, self.right):
+                    if self.cells:
+                        self.left = min(self.cells)
+                        self.right = max(self.cells)
+                    else:
+                        self.left = self.right = None
+        else:
+            self.cells[position] = symbol
+            if self.left is None:
+                self.left = self.right = position
+            elif position < self.left:
+                self.left = position
+            elif position > self.right:
+                self.right = position
+
+    def snapshot(self, head):
+        """Returns the contents of the tape and the position of head
+        relative to them, which is the same for tapes that differ only
+        by a shift."""
+        if self.left is None:
+            return (), 0
+        return (tuple(self.read(position)
+                      for position in range(self.left, self.right + 1)),
+                head - self.left)
+
+
+def loops(steps):
+    return automata.did_not_terminate(
+        "configuration repeated after {} steps, so the machine never halts"
+        .format(steps))
+
+
+def runs_off(steps):
+    return automata.did_not_terminate(
+        "machine was moving into blank tape forever after {} steps"
+        .format(steps))
+
+
+class TuringMachine(object):
+    """A JFLAP Turing machine with any number of tapes.
+
+    Each transition is a tuple (from, to, reads, writes, moves), where
+    the last three are tuples with one entry per tape, moves being "L",
+    "R" or "S".
+
+    >>> # Accepts strings of a's of even length, and loops on others.
+    >>> tm = TuringMachine([0, 1, 2], 0, [2],
+    ...                    [(0, 1, ("a",), ("a",), ("R",)),
+    ...                     (1, 0, ("a",), ("a",), ("R",)),
+    ...                     (0, 2, ("",), ("",), ("S",)),
+    ...                     (1, 1, ("",), ("x",), ("R",))])
+    >>> tm.simulate("aaaa")
+    Outcome(accepted=True, terminated=True, valid=True)
+    >>> tm.simulate("aaa")
+    Outcome(accepted=None, terminated=False, valid=None)
+    >>> tm.simulate("ab")
+    Outcome(accepted=False, terminated=True, valid=True)
+    """
+
+    def __init__(self, states, initial, finals, transitions, tapes=1,
+                 step_budget=STEP_BUDGET):
+        states = set(states)
+        if initial is not None and initial not in states:
+            raise automata.InvalidMachineError(
+                "initial state '{}' does not exist".format(initial))
+        self.initial = initial
+        self.finals = frozenset(finals)
+        self.tapes = tapes
+        self.step_budget = step_budget
+        self.table = {}
+        for source, target, reads, writes, moves in transitions:
+            if source not in states or target not in states:
+                raise automata.InvalidMachineError(
+                    "transition from '{}' to '{}' refers to a missing state"
+                    .format(source, target))
+            if not len(reads) == len(writes) == len(moves) == tapes:
+                raise automata.InvalidMachineError(
+                    "transition from '{}' to '{}' does not have one read,"
+                    " write and move for each of the {} tapes"
+                    .format(source, target, tapes))
+            for move in moves:
+                if move not in MOVES:
+                    raise automata.InvalidMachineError(
+                        "transition from '{}' to '{}' has invalid move '{}'"
+                        .format(source, target, move))
+            self.table.setdefault((source, tuple(reads)), []).append(
+                (target, tuple(writes), tuple(MOVES[move] for move in moves)))
+        self.deterministic = all(len(choices) == 1
+                                 for choices in self.table.values())
+
+    def simulate(self, word):
+        """Returns the automata.Outcome of running the machine on word."""
+        if self.initial is None:
+            return automata.invalid("Turing machine has no initial state")
+        if self.deterministic:
+            return self.run_deterministic(word)
+        return self.run_nondeterministic(word)
+
+    def simulate_all(self, words):
+        """Returns a dictionary mapping each of words to its
+        automata.Outcome."""
+        return {word: self.simulate(word) for word in words}
+
+    def run_deterministic(self, word):
+        tapes = [Tape(word)] + [Tape() for _ in range(self.tapes - 1)]
+        heads = [0] * self.tapes
+        state = self.initial
+        finals = self.finals
+        table = self.table
+        # Brent's cycle detection: compare each configuration with the
+        # one saved at the last power of two steps. Configurations are
+        # first compared cheaply by state, symbols under the heads and
+        # the extent of each tape relative to its head.
+        saved = saved_key = None
+        next_save = 1
+        # For the single-tape check for running off along the tape: the
+        # head positions at which each state was last seen with only
+        # blanks to its right (or left), and not moved back since.
+        drift = self.tapes == 1
+        right_seen = {}
+        left_seen = {}
+        for step in range(self.step_budget):
+            if state in finals:
+                return automata.accepted(True)
+            reads = tuple(tape.read(head) for tape, head in zip(tapes, heads))
+            choices = table.get((state, reads))
+            if choices is None:
+                return automata.accepted(False)
+            key = (state, reads, tuple(
+                None if tape.left is None else
+                (head - tape.left, tape.right - tape.left)
+                for tape, head in zip(tapes, heads)))
+            if key == saved_key and self.snapshot(state, tapes, heads) == saved:
+                return loops(step)
+            if step == next_save:
+                saved = self.snapshot(state, tapes, heads)
+                saved_key = key
+                next_save *= 2
+            if drift:
+                tape, head = tapes[0], heads[0]
+                if tape.left is None or head > tape.right:
+                    if state in right_seen:
+                        return runs_off(step)
+                    right_seen[state] = head
+                if tape.left is None or head < tape.left:
+                    if state in left_seen:
+                        return runs_off(step)
+                    left_seen[state] = head
+            target, writes, moves = choices[0]
+            for i in range(self.tapes):
+                tapes[i].write(heads[i], writes[i])
+                heads[i] += moves[i]
+            if drift:
+                head = heads[0]
+                if moves[0] < 0 and right_seen:
+                    right_seen = {seen_state: seen_head
+                                  for seen_state, seen_head in right_seen.items()
+                                  if seen_head <= head}
+                elif moves[0] > 0 and left_seen:
+                    left_seen = {seen_state: seen_head
+                                 for seen_state, seen_head in left_seen.items()
+                                 if seen_head >= head}
+            state = target
+        return automata.did_not_terminate(
+            "step budget of {} exhausted".format(self.step_budget))
+
+    @staticmethod
+    def snapshot(state, tapes, heads):
+        return state, tuple(tape.snapshot(head)
+                            for tape, head in zip(tapes, heads))
+
+    def run_nondeterministic(self, word):
+        start = (self.initial,
+                 (tuple(word), 0),) + ((((), 0),) * (self.tapes - 1))
+        start = trim(start)
+        index = {start: 0}
+        edges = [[]]
+        queue = collections.deque([start])
+        while queue:
+            config = queue.popleft()
+            state = config[0]
+            if state in self.finals:
+                return automata.accepted(True)
+            number = index[config]
+            reads = tuple(cells[head] if 0 <= head < len(cells) else BLANK
+                          for cells, head in config[1:])
+            for target, writes, moves in self.table.get((state, reads), ()):
+                successor = [target]
+                for (cells, head), write, move in zip(config[1:], writes,
+                                                      moves):
+                    if head < 0:
+                        cells = (write,) + (BLANK,) * (-head - 1) + cells
+                        head = 0
+                    elif head >= len(cells):
+                        cells = cells + (BLANK,) * (head - len(cells)) + (write,)
+                    else:
+                        cells = cells[:head] + (write,) + cells[head + 1:]
+                    successor.append((cells, head + move))
+                successor = trim(tuple(successor))
+                if successor not in index:
+                    if len(index) >= self.step_budget:
+                        return automata.did_not_terminate(
+                            "step budget of {} exhausted"
+                            .format(self.step_budget))
+                    index[successor] = len(index)
+                    edges.append([])
+                    queue.append(successor)
+                edges[number].append(index[successor])
+        # Every reachable configuration halts without accepting. JFLAP
+        # would still run forever if one of them can be reached from
+        # itself.
+        if has_cycle(edges):
+            return loops(len(index))
+        return automata.accepted(False)
+
+
+def trim(config):
+    """Returns the configuration (state, (cells, head)...) with blanks
+    removed from both ends of each tape, which makes configurations
+    that differ only by a shift equal."""
+    tapes = []
+    for cells, head in config[1:]:
+        start = 0
+        while start < len(cells) and cells[start] == BLANK:
+            start += 1
+        end = len(cells)
+        while end > start and cells[end - 1] == BLANK:
+            end -= 1
+        if start == end:
+            tapes.append(((), 0))
+        else:
+            tapes.append((cells[start:end], head - start))
+    return (config[0],) + tuple(tapes)
+
+
+def has_cycle(edges):
+    """Returns whether the directed graph with the given adjacency lists
+    has a cycle.
+
+    >>> has_cycle([[1], [2], []]), has_cycle([[1], [2], [0]])
+    (False, True)
+    """
+    # Iterative depth-first search with the usual three colors.
+    color = [0] * len(edges)
+    for root in range(len(edges)):
+        if color[root]:
+            continue
+        color[root] = 1
+        stack = [(root, iter(edges[root]))]
+        while stack:
+            node, successors = stack[-1]
+            for successor in successors:
+                if color[successor] == 1:
+                    return True
+                if color[successor] == 0:
+                    color[successor] = 1
+                    stack.append((successor, iter(edges[successor])))
+                    break
+            else:
+                color[node] = 2
+                stack.pop()
+    return False
+
+
+def read_turing(structure):
+    """Builds a TuringMachine from the <structure> element of a JFLAP
+    file.
+
+    >>> tm = automata.parse_jff('''<structure><type>turing</type>
+    ...   <tapes>2</tapes><automaton>
+    ...   <state id="0"><initial/></state><state id="1"><final/></state>
+    ...   <transition><from>0</from><to>0</to>
+    ...     <read tape="1">a</read><write tape="1">a</write>
+    ...     <move tape="1">R</move>
+    ...     <read tape="2"/><write tape="2">a</write><move tape="2">R</move>
+    ...   </transition>
+    ...   <transition><from>0</from><to>1</to>
+    ...     <read tape="1"/><write tape="1"/><move tape="1">S</move>
+    ...     <read tape="2"/><write tape="2"/><move tape="2">L</move>
+    ...   </transition>
+    ... </automaton></structure>''')
+    >>> tm.tapes, tm.simulate("aaa"), tm.simulate("ab")
+    (2, Outcome(accepted=True, terminated=True, valid=True), Outcome(accepted=False, terminated=True, valid=True))
+    """
+    automaton = automata.automaton_element(structure)
+    if automaton.find("block") is not None:
+        raise automata.UnsupportedMachineError(
+            "Turing machine building blocks are not supported")
+    tapes_text = automata.element_text(structure, "tapes").strip()
+    try:
+        tapes = int(tapes_text) if tapes_text else 1
+    except ValueError:
+        raise automata.UnsupportedMachineError(
+            "invalid number of tapes '{}'".format(tapes_text))
+    states = []
+    initial = None
+    finals = []
+    for state in automaton.iter("state"):
+        state_id = state.get("id")
+        states.append(state_id)
+        if state.find("initial") is not None:
+            initial = state_id
+        if state.find("final") is not None:
+            finals.append(state_id)
+    transitions = []
+    for transition in automaton.iter("transition"):
+        fields = {}
+        for tag in ("read", "write", "move"):
+            values = [BLANK] * tapes
+            for element in transition.findall(tag):
+                tape_text = element.get("tape", "1")
+                try:
+                    tape = int(tape_text) - 1
+                except ValueError:
+                    raise automata.InvalidMachineError(
+                        "transition refers to invalid tape '{}'"
+                        .format(tape_text))
+                if not 0 <= tape < tapes:
+                    raise automata.InvalidMachineError(
+                        "transition refers to tape {} of {}"
+                        .format(tape + 1, tapes))
+                values[tape] = element.text or BLANK
+            fields[tag] = values
+        for symbol in fields["read"] + fields["write"]:
+            # "~" and "!" have special meanings in JFLAP (any symbol
+            # and any symbol but, respectively), and longer strings
+            # aren't symbols at all.
+            if len(symbol) > 1 or symbol in ("~", "!"):
+                raise automata.UnsupportedMachineError(
+                    "unsupported tape symbol '{}'".format(symbol))
+        transitions.append((automata.element_text(transition, "from"),
+                            automata.element_text(transition, "to"),
+                            fields["read"], fields["write"],
+                            [move.strip() for move in fields["move"]]))
+    return TuringMachine(states, initial, finals, transitions, tapes)
+
+
+automata.readers["turing"] = read_turing
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Generators of input strings for test files.
+
+These are available to the "words" and "check" functions of test
+files (see jflapgrader.parse_test_file_contents), alongside
+all_bitstrings, which is now implemented with all_words. An alphabet
+is a string of single-character symbols, or any iterable of symbols,
+and the words of each length are produced in the order of the
+alphabet. Everything here is a generator, so millions of words can be
+produced without building a list of them.
+
+The random generators take a seed, and give the same words every time
+for the same seed. Test sets are cached by the contents of the test
+file (see jflapgrader.load_tests), so a test file should always pass
+one.
+"""
+
+import bisect
+import doctest
+import itertools
+import random
+import sys
+
+
+def symbols_of(alphabet):
+    """Returns the alphabet as a tuple of symbols, without duplicates."""
+    return tuple(dict.fromkeys(alphabet))
+
+
+def length_range(length, min_length, max_length):
+    """Returns the range of lengths selected by the arguments of the
+    generators below: exactly length if it is given, and otherwise
+    min_length to max_length inclusive."""
+    if length is not None:
+        return range(length, length + 1)
+    return range(max(min_length, 0), max_length + 1)
+
+
+def all_words(alphabet="01", max_length=0, min_length=0, length=None):
+    """Generates every word over alphabet with between min_length and
+    max_length symbols, or with exactly length symbols if it is given,
+    shortest first.
+
+    >>> list(all_words("ab", 2))
+    ['', 'a', 'b', 'aa', 'ab', 'ba', 'bb']
+    >>> list(all_words("ab", length=2))
+    ['aa', 'ab', 'ba', 'bb']
+    >>> list(all_words("xyz", max_length=2, min_length=2))[:4]
+    ['xx', 'xy', 'xz', 'yx']
+    >>> sum(1 for _ in all_words("01", 10)) == 2 ** 11 - 1
+    True
+    """
+    symbols = symbols_of(alphabet)
+    join = "".join
+    for n in length_range(length, min_length, max_length):
+        # product yields tuples in lexicographic order, and joining
+        # them is done in C, so each word costs O(n) with a very small
+        # constant rather than a Python-level loop per symbol.
+        yield from map(join, itertools.product(symbols, repeat=n))
+
+
+def count_words(alphabet="01", max_length=0, min_length=0, length=None):
+    """Returns the number of words all_words would generate.
+
+    >>> count_words("01", 3), count_words("abc", length=4)
+    (15, 81)
+    """
+    size = len(symbols_of(alphabet))
+    return sum(size ** n for n in length_range(length, min_length, max_length))
+
+
+# The format specifications that write numbers in bases which are
+# common alphabet sizes, with their digits in order.
+BASE_FORMATS = {
+    2: ("b", "01"),
+    8: ("o", "01234567"),
+    16: ("x", "0123456789abcdef"),
+}
+
+
+def unrank(index, symbols, n):
+    """Returns the word with n symbols at position index (from 0) in
+    all_words(symbols, length=n).
+
+    >>> unrank(5, "ab", 3), unrank(5, "abc", 3), unrank(0, "ab", 0)
+    ('bab', 'abc', '')
+    """
+    size = len(symbols)
+    if size in BASE_FORMATS and n and all(len(s) == 1 for s in symbols):
+        # Let format write the digits, in C, and then map them to the
+        # symbols.
+        spec, digits = BASE_FORMATS[size]
+        text = format(index, "0{}{}".format(n, spec))
+        return text.translate(str.maketrans(digits, "".join(symbols)))
+    chars = []
+    for _ in range(n):
+        index, digit = divmod(index, size)
+        chars.append(symbols[digit])
+    return "".join(reversed(chars))
+
+
+def random_words(count, alphabet="01", max_length=0, min_length=0,
+                 length=None, seed=None):
+    """Generates count words chosen uniformly at random (independently, so
+    possibly repeating) from all the words all_words would generate,
+    using random.Random(seed). count may be None for an endless
+    stream.
+
+    >>> words = list(random_words(5, "ab", max_length=8, min_length=4, seed=1))
+    >>> len(words), all(4 <= len(word) <= 8 for word in words)
+    (5, True)
+    >>> words == list(random_words(5, "ab", 8, 4, seed=1))
+    True
+    """
+    rng = random.Random(seed)
+    symbols = symbols_of(alphabet)
+    lengths = list(length_range(length, min_length, max_length))
+    if not symbols:
+        # Only the empty word can be formed.
+        lengths = [n for n in lengths if n == 0]
+    if not lengths:
+        return
+    # Choose lengths in proportion to the number of words of that
+    # length, so that every word is equally likely. The weights can be
+    # too large for floats, so choose by integer bisection instead of
+    # random.choices.
+    sizes = [len(symbols) ** n for n in lengths]
+    cumulative = list(itertools.accumulate(sizes))
+    total = cumulative[-1]
+    choices = rng.choices
+    join = "".join
+    fast = len(symbols) in BASE_FORMATS and all(len(s) == 1 for s in symbols)
+    if fast:
+        spec, digits = BASE_FORMATS[len(symbols)]
+        table = str.maketrans(digits, "".join(symbols))
+        specs = ["0{}{}".format(n, spec) if n else "" for n in lengths]
+    remaining = count
+    while remaining is None or remaining > 0:
+        index = rng.randrange(total)
+        i = bisect.bisect_right(cumulative, index)
+        if fast:
+            # The position of the word among those of its length is
+            # uniformly distributed, so write it out as in unrank.
+            if specs[i]:
+                yield format(index - cumulative[i] + sizes[i],
+                             specs[i]).translate(table)
+            else:
+                yield ""
+        else:
+            yield join(choices(symbols, k=lengths[i]))
+        if remaining is not None:
+            remaining -= 1
+
+
+def sample_words(count, alphabet="01", max_length=0, min_length=0,
+                 length=None, seed=None):
+    """Generates count distinct words chosen uniformly at random from all
+    the words all_words would generate (or all of them, if there are
+    no more than count), in no particular order, using
+    random.Random(seed).
+
+    >>> words = list(sample_words(10, "01", length=5, seed=2))
+    >>> len(set(words)), all(len(word) == 5 for word in words)
+    (10, True)
+    >>> sorted(sample_words(100, "01", 2, seed=2))
+    ['', '0', '00', '01', '1', '10', '11']
+    """
+    rng = random.Random(seed)
+    symbols = symbols_of(alphabet)
+    lengths = list(length_range(length, min_length, max_length))
+    sizes = [len(symbols) ** n for n in lengths]
+    total = sum(sizes)
+    if total <= count:
+        yield from all_words(symbols, max_length, min_length, length)
+        return
+    if total <= sys.maxsize:
+        indices = rng.sample(range(total), count)
+    else:
+        # Too many words to sample by index; with so many to choose
+        # from, duplicates are rare enough to just skip them.
+        seen = set()
+        while len(seen) < count:
+            seen.add(rng.randrange(total))
+        indices = seen
+    offsets = list(itertools.accumulate(sizes))
+    for index in indices:
+        i = bisect.bisect_right(offsets, index)
+        yield unrank(index - (offsets[i - 1] if i else 0), symbols,
+                     lengths[i])
+
+
+def stratified_words(per_length, alphabet="01", max_length=0, min_length=0,
+                     length=None, seed=None):
+    """Generates up to per_length distinct words of each length between
+    min_length and max_length (or of exactly length), chosen
+    uniformly at random with random.Random(seed), shortest first.
+    Lengths with no more than per_length words contribute all of them.
+
+    >>> words = list(stratified_words(2, "01", max_length=4, seed=3))
+    >>> [len(word) for word in words]
+    [0, 1, 1, 2, 2, 3, 3, 4, 4]
+    """
+    rng = random.Random(seed)
+    symbols = symbols_of(alphabet)
+    for n in length_range(length, min_length, max_length):
+        yield from sample_words(per_length, symbols, length=n,
+                                seed=rng.getrandbits(64))
+
+
+# The names under which the generators are available to test files.
+test_file_namespace = {
+    "all_words": all_words,
+    "count_words": count_words,
+    "random_words": random_words,
+    "sample_words": sample_words,
+    "stratified_words": stratified_words,
+}
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        print("This module is not meant to be used from the command line.",
+              file=sys.stderr)
+    else:
+        doctest.testmod()